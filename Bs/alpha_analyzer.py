@@ -0,0 +1,213 @@
+import io
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from utils import probe_media_cached, read_mp4_header
+from ffmpeg_log import StderrLog
+from media_cache import get_media_cache
+from process_supervisor import get_supervisor
+
+# 缓存中的数据种类名前缀，格式变化时修改版本号
+ALPHA_BLOB_KIND = "alpha.v1"
+DEFAULT_SAMPLE_FPS = 2.0
+# 完全不透明判定：覆盖率不低于该值
+OPAQUE_COVERAGE = 0.999
+
+
+@dataclass
+class AlphaProfile:
+    """
+    模板alpha平面的采样时间序列
+
+    coverage[i] 为第i个采样帧中可见像素（alpha > threshold）的比例，
+    bboxes[i] 为可见区域的包围盒 (x, y, w, h)，全透明帧为 (0, 0, 0, 0)。
+    """
+    width: int
+    height: int
+    sample_fps: float
+    times: np.ndarray
+    coverage: np.ndarray
+    bboxes: np.ndarray
+
+    @property
+    def frames(self):
+        return len(self.coverage)
+
+    @property
+    def mean_coverage(self):
+        return float(self.coverage.mean()) if self.frames else 0.0
+
+    @property
+    def peak_coverage(self):
+        return float(self.coverage.max()) if self.frames else 0.0
+
+    @property
+    def transparent_ratio(self):
+        """全透明采样帧的比例"""
+        return float((self.coverage == 0).mean()) if self.frames else 0.0
+
+    @property
+    def opaque_ratio(self):
+        """完全不透明采样帧的比例"""
+        return float((self.coverage >= OPAQUE_COVERAGE).mean()) if self.frames else 0.0
+
+    @property
+    def union_bbox(self):
+        """所有采样帧可见区域的并集 (x, y, w, h)，全程透明时返回None"""
+        visible = self.bboxes[self.bboxes[:, 2] > 0]
+        if not len(visible):
+            return None
+        x0 = int(visible[:, 0].min())
+        y0 = int(visible[:, 1].min())
+        x1 = int((visible[:, 0] + visible[:, 2]).max())
+        y1 = int((visible[:, 1] + visible[:, 3]).max())
+        return x0, y0, x1 - x0, y1 - y0
+
+    def transparent_ranges(self, min_duration=0.0):
+        """
+        全透明的时间段 [(开始, 结束), ...]
+
+        每个采样帧代表 [t, t + 1/sample_fps)，按模板帧率采样时结果精确到帧。
+        """
+        ranges = []
+        step = 1.0 / self.sample_fps
+        start = None
+        for i, value in enumerate(self.coverage):
+            if value == 0:
+                if start is None:
+                    start = round(i * step, 6)
+            elif start is not None:
+                ranges.append((start, round(i * step, 6)))
+                start = None
+        if start is not None:
+            ranges.append((start, round(len(self.coverage) * step, 6)))
+        return [(s, e) for s, e in ranges if e - s >= min_duration]
+
+    def summary(self):
+        """供报告使用的统计字典"""
+        return {
+            'frames': self.frames,
+            'sample_fps': self.sample_fps,
+            'mean_coverage': self.mean_coverage,
+            'peak_coverage': self.peak_coverage,
+            'transparent_ratio': self.transparent_ratio,
+            'opaque_ratio': self.opaque_ratio,
+            'union_bbox': self.union_bbox,
+        }
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            meta=np.array([self.width, self.height, self.sample_fps], dtype=np.float64),
+            times=self.times, coverage=self.coverage, bboxes=self.bboxes
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            width, height, sample_fps = arrays['meta']
+            return cls(int(width), int(height), float(sample_fps),
+                       arrays['times'], arrays['coverage'], arrays['bboxes'])
+
+
+def frame_alpha_stats(alpha, threshold=0):
+    """
+    单帧alpha平面的覆盖率和包围盒
+
+    Args:
+        alpha: (h, w) 的uint8数组
+        threshold: alpha大于该值视为可见
+
+    Returns:
+        tuple: (coverage, (x, y, w, h))
+    """
+    mask = alpha > threshold
+    rows = mask.any(axis=1)
+    if not rows.any():
+        return 0.0, (0, 0, 0, 0)
+    cols = mask.any(axis=0)
+    y0 = int(rows.argmax())
+    y1 = len(rows) - int(rows[::-1].argmax())
+    x0 = int(cols.argmax())
+    x1 = len(cols) - int(cols[::-1].argmax())
+    return float(np.count_nonzero(mask)) / mask.size, (x0, y0, x1 - x0, y1 - y0)
+
+
+def _frame_size(video_path):
+    info = read_mp4_header(video_path)
+    if info is None or info.video is None:
+        info = probe_media_cached(video_path)
+    if info.video is None or not info.width or not info.height:
+        raise ValueError(f"无法获取视频尺寸: {video_path}")
+    return info.width, info.height
+
+
+def analyze_alpha_plane(video_path, sample_fps=DEFAULT_SAMPLE_FPS, threshold=0) -> AlphaProfile:
+    """
+    只解码alpha平面（alphaextract），按sample_fps采样，通过rawvideo管道逐帧统计
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg返回非零（例如视频没有alpha通道）
+        ValueError: 无法获取视频尺寸
+    """
+    width, height = _frame_size(video_path)
+    frame_bytes = width * height
+    command = [
+        'ffmpeg', '-v', 'error', '-nostdin',
+        '-i', video_path,
+        '-an', '-sn',
+        '-vf', f'fps={sample_fps},alphaextract,format=gray',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        'pipe:1'
+    ]
+    coverage = []
+    bboxes = []
+    proc = get_supervisor().popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+    # 标准错误由后台线程读进环形缓冲，解码警告很多时管道写满也不会卡住ffmpeg
+    log = StderrLog(max_lines=20)
+    reader = threading.Thread(target=log.drain, args=(proc.stderr,), daemon=True)
+    reader.start()
+    try:
+        while True:
+            data = proc.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            alpha = np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+            frame_coverage, bbox = frame_alpha_stats(alpha, threshold)
+            coverage.append(frame_coverage)
+            bboxes.append(bbox)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        reader.join(timeout=5)
+        get_supervisor().release(proc)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command, stderr="\n".join(log.tail()))
+
+    count = len(coverage)
+    return AlphaProfile(
+        width=width,
+        height=height,
+        sample_fps=float(sample_fps),
+        times=np.arange(count, dtype=np.float32) / np.float32(sample_fps),
+        coverage=np.asarray(coverage, dtype=np.float32),
+        bboxes=np.asarray(bboxes, dtype=np.int32).reshape(count, 4)
+    )
+
+
+def get_alpha_profile(video_path, sample_fps=DEFAULT_SAMPLE_FPS, threshold=0, cache=None) -> Optional[AlphaProfile]:
+    """读取缓存的alpha时间序列，未缓存或文件已变化时重新分析并写回"""
+    cache = cache if cache is not None else get_media_cache()
+    kind = f"{ALPHA_BLOB_KIND}:{sample_fps:g}:{threshold}"
+    data = cache.get_blob(video_path, kind)
+    if data is not None:
+        return AlphaProfile.from_bytes(data)
+    profile = analyze_alpha_plane(video_path, sample_fps=sample_fps, threshold=threshold)
+    cache.put_blob(video_path, kind, profile.to_bytes())
+    return profile
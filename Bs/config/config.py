@@ -8,6 +8,40 @@ class Config:
     DEFAULT_CRF = 23
     DEFAULT_PRESET = "medium"
     DEFAULT_AUDIO_BITRATE = 192
+    # 定点/随机模式只重编码模板出现的时间段（H.264/AAC素材，帧率与 OUTPUT_FPS 相同时）；
+    # 直接复制的部分保留素材原有的编码参数，与整段编码的输出不一致，默认关闭
+    SMART_RENDER = False
+    # 单个素材一次最多生成的变体数（共享一次解码）
+    MAX_VARIANTS_PER_MATERIAL = 8
+    # 标准/定点模式下多层模板每批只预合成一次，缓存保留最近使用的文件数
+    PRECOMPOSITE_LAYERS = True
+    PRECOMPOSITE_CACHE_FILES = 16
+    # 模板裁剪到alpha可见区域再叠加，可见区域不小于整帧的 1 - CROP_MIN_SAVING 时不裁剪
+    CROP_TEMPLATES = True
+    CROP_MIN_SAVING = 0.2
+    # 按素材和模板的流属性规划滤镜图：帧率和像素格式在split之前各转换一次
+    OPTIMIZE_FILTER_GRAPH = True
+    OUTPUT_FPS = 24
+    # 把尺寸与素材不同（宽高比相同）的模板等比缩放到素材尺寸再叠加；会改变画面，默认关闭
+    SCALE_TEMPLATES = False
+    # 合成引擎："ffmpeg"（滤镜图）或 "numpy"（rawvideo管道 + NumPy按批混合，用于实验和特殊混合模式）
+    COMPOSITOR = "ffmpeg"
+    BLEND_MODE = "normal"
+    NUMPY_BATCH_FRAMES = 8
+    NUMPY_QUEUE_BATCHES = 4
+    # NumPy合成时模板帧只解码一次，预乘后存成内存映射文件，按最近使用淘汰
+    TEMPLATE_FRAME_STORE = True
+    TEMPLATE_FRAME_STORE_DIR = "scratch/frames"
+    TEMPLATE_FRAME_STORE_MAX_MB = 4096
+    # ffmpeg输出进度（out_time）超过该秒数不增长视为卡住并终止
+    FFMPEG_STALL_TIMEOUT = 60
+    # ffmpeg单次运行的总时长上限（秒），只兜底防止无限运行，卡住由上面的进度检测判断；None不限制
+    FFMPEG_MAX_RUNTIME = 4 * 3600
+    # 停止子进程时SIGTERM后等待的秒数，仍未退出则SIGKILL
+    PROCESS_KILL_GRACE = 0.5
+    # ffmpeg失败重试：原因不明时原样重试的次数；资源不足（内存、卡住、超时）时依次叠加的降级
+    FFMPEG_TRANSIENT_RETRIES = 1
+    RETRY_FALLBACK_LADDER = ["faster_preset", "fewer_threads", "lower_resolution"]
     
     # 文件路径
     MATERIAL_DIR = "material_videos"
@@ -17,4 +51,13 @@ class Config:
     # 素材加工专用文件夹
     RESOLUTION_CONVERTED_DIR = "pixels_trans"  # 分辨率转换后的文件
     TRIMMED_DIR = "End_cut"  # 结尾裁剪后的文件
-    SEGMENTS_DIR = "segments"  # 视频切分后的文件
\ No newline at end of file
+    SEGMENTS_DIR = "segments"  # 视频切分后的文件
+    PRECOMPOSITE_DIR = "scratch/precomposite"  # 预合成模板缓存
+    CROPPED_TEMPLATE_DIR = "scratch/cropped"  # 裁剪到可见区域的模板缓存
+    
+    # 媒体元数据缓存（与presets.json同放在config目录）
+    MEDIA_CACHE_DB = "media_cache.db"
+    
+    # 界面异步探测：同时运行的ffprobe上限和单次探测超时（秒）
+    PROBE_MAX_CONCURRENT = 4
+    PROBE_TIMEOUT = 30
\ No newline at end of file
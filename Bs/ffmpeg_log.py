@@ -0,0 +1,118 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# 一行日志最多保留的字符数，超长的行（如整段滤镜图回显）截断
+MAX_LINE_CHARS = 400
+# 读管道时单次 readline 的上限，没有换行的超长输出也不会一次读进内存
+_READ_LIMIT = 8192
+
+
+@dataclass
+class ErrorPattern:
+    """一类ffmpeg错误：stderr 中出现任一关键字即归入该类"""
+    name: str
+    message: str
+    patterns: tuple
+
+
+# 按优先级排列，summary() 取最先匹配的类别
+ERROR_PATTERNS = [
+    ErrorPattern('missing_file', "文件不存在或路径错误", ("No such file or directory",)),
+    ErrorPattern('permission', "文件权限不足", ("Permission denied",)),
+    ErrorPattern('disk_full', "磁盘空间不足", ("No space left", "Disk full")),
+    ErrorPattern('invalid_data', "视频文件损坏或格式不支持",
+                 ("Invalid data found", "moov atom not found", "could not find codec parameters")),
+    ErrorPattern('filter_graph', "滤镜图错误",
+                 ("Error parsing filterchain", "Error initializing filter", "No such filter",
+                  "Error reinitializing filters", "Filter not found", "Failed to configure")),
+    ErrorPattern('encoder', "编码器不可用或参数错误",
+                 ("Unknown encoder", "Error while opening encoder", "Error initializing output stream")),
+    ErrorPattern('memory', "内存不足", ("Cannot allocate memory", "Out of memory")),
+]
+
+
+@dataclass
+class ErrorHit:
+    """某类错误的出现次数和第一次出现的那一行"""
+    count: int
+    first_line: str
+
+
+class StderrLog:
+    """
+    ffmpeg标准错误的环形缓冲
+
+    只保留最近 max_lines 行（每行最多 MAX_LINE_CHARS 字符），连续重复的行合并计数；
+    每行到达时即按 ERROR_PATTERNS 分类，每类只记次数和首行。内存占用与输出长度无关。
+    """
+
+    def __init__(self, max_lines=50):
+        self.lines = deque(maxlen=max_lines)
+        self.errors: Dict[str, ErrorHit] = {}
+        self.total_lines = 0
+        self._last = None
+        self._repeats = 0
+
+    def feed(self, line):
+        line = line.rstrip()
+        if not line:
+            return
+        self.total_lines += 1
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + "…"
+        for pattern in ERROR_PATTERNS:
+            if any(p in line for p in pattern.patterns):
+                hit = self.errors.get(pattern.name)
+                if hit is None:
+                    self.errors[pattern.name] = ErrorHit(1, line)
+                else:
+                    hit.count += 1
+                break
+        if line == self._last:
+            self._repeats += 1
+            return
+        self._flush_repeats()
+        self._last = line
+        self.lines.append(line)
+
+    def _flush_repeats(self):
+        if self._repeats:
+            self.lines.append(f"（上一行又重复 {self._repeats} 次）")
+            self._repeats = 0
+
+    def drain(self, stream):
+        """逐行读完一个二进制管道，供后台线程使用"""
+        for raw in iter(lambda: stream.readline(_READ_LIMIT), b""):
+            self.feed(raw.decode("utf-8", "ignore"))
+        self._flush_repeats()
+
+    def tail(self, n=None) -> List[str]:
+        lines = list(self.lines)
+        return lines if n is None else lines[-n:]
+
+    @property
+    def error_class(self) -> Optional[str]:
+        """最先匹配的错误类别，没有匹配时为None"""
+        for pattern in ERROR_PATTERNS:
+            if pattern.name in self.errors:
+                return pattern.name
+        return None
+
+    def summary(self, tail_lines=3):
+        """一句话错误说明：已分类的给出类别和首条原文，否则给出最后几行"""
+        name = self.error_class
+        if name is not None:
+            message = next(p.message for p in ERROR_PATTERNS if p.name == name)
+            return f"{message}: {self.errors[name].first_line}"
+        tail = self.tail(tail_lines)
+        return " | ".join(tail) if tail else "未知错误"
+
+    def to_dict(self, tail_lines=5):
+        """写入任务统计的错误摘要"""
+        return {
+            'error_class': self.error_class,
+            'errors': {name: hit.count for name, hit in self.errors.items()},
+            'stderr_lines': self.total_lines,
+            'stderr_tail': self.tail(tail_lines),
+        }
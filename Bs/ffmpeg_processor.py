@@ -1,124 +1,125 @@
 import subprocess
 import threading
 import time
-import signal
 import os
-from typing import Optional, Callable, Dict, Any
+
+from ffmpeg_progress import ProgressParser, output_duration, with_progress
+from ffmpeg_log import StderrLog
+from retry_policy import RetryPolicy, RetryState, classify_failure
+from ffmpeg_watchdog import get_watchdog
+from process_supervisor import ProcessCancelled, get_supervisor
 
 class FFmpegProcessor:
     """FFmpeg处理器，支持重试机制、超时控制和进程管理"""
     
-    def __init__(self, max_retries=3, timeout=300):
+    def __init__(self, max_retries=3, timeout=300, stall_timeout=60, watchdog=None, supervisor=None,
+                 stderr_lines=50, retry_policy=None):
+        # 最多尝试的总次数（含降级重试）
         self.max_retries = max_retries
+        # 未指定策略时按旧行为：原因不明的失败最多重试 max_retries-1 次
+        self.retry_policy = retry_policy or RetryPolicy(transient_retries=max_retries - 1)
+        self.attempt_path = []
         self.timeout = timeout
+        # out_time 超过该秒数不增长视为卡住；None表示只做总时长超时
+        self.stall_timeout = stall_timeout
+        self.watchdog = watchdog or get_watchdog()
+        self.supervisor = supervisor or get_supervisor()
         self.current_process = None
+        self.current_watch = None
         self.is_cancelled = False
         self.process_lock = threading.Lock()
+        # 最近一次 -progress 快照（FFmpegProgress），供状态查询
+        self.last_progress = None
+        # 标准错误只保留最近 stderr_lines 行，last_log 为最近一次尝试的日志
+        self.stderr_lines = stderr_lines
+        self.last_log = None
+        # 每次尝试的看门狗统计，process_with_retry 开始时清空
+        self.attempt_metrics = []
         
-    def kill_stuck_ffmpeg_processes(self):
-        """杀掉所有卡住的FFmpeg进程"""
-        try:
-            # 查找所有FFmpeg进程
-            result = subprocess.run(
-                ['ps', 'aux'], 
-                capture_output=True, 
-                text=True, 
-                timeout=10
-            )
-            
-            killed_count = 0
-            for line in result.stdout.split('\n'):
-                if 'ffmpeg' in line and 'grep' not in line:
-                    parts = line.split()
-                    if len(parts) > 1:
-                        try:
-                            pid = int(parts[1])
-                            # 检查进程运行时间，只杀掉运行时间过长且可能卡住的进程
-                            # 获取进程启动时间（ps aux格式中的STAT字段后面是START时间）
-                            if len(parts) > 8:  # 确保有足够的字段
-                                # 只杀掉明显异常的进程（比如运行超过1小时的）
-                                # 这里我们采用更保守的策略，只在明确需要时才杀进程
-                                # 暂时注释掉自动杀进程的逻辑，避免误杀
-                                print(f"🔍 发现FFmpeg进程 PID: {pid}，暂不自动终止")
-                                # os.kill(pid, signal.SIGKILL)
-                                # killed_count += 1
-                                # print(f"🔪 终止可能卡住的FFmpeg进程 PID: {pid}")
-                        except (ValueError, ProcessLookupError, PermissionError):
-                            continue
-                            
-            return killed_count
-            
-        except Exception as e:
-            print(f"❌ 清理FFmpeg进程时出错: {e}")
-            return 0
-    
     def cancel_current_process(self):
-        """取消当前正在运行的FFmpeg进程"""
+        """取消当前正在运行的FFmpeg进程（整个进程组，先SIGTERM，宽限期后SIGKILL）"""
         with self.process_lock:
             self.is_cancelled = True
-            if self.current_process and self.current_process.poll() is None:
-                try:
-                    self.current_process.terminate()
-                    # 等待2秒，如果还没结束就强制杀掉
-                    time.sleep(2)
-                    if self.current_process.poll() is None:
-                        self.current_process.kill()
-                    print("🛑 已取消当前FFmpeg进程")
-                    return True
-                except Exception as e:
-                    print(f"❌ 取消进程时出错: {e}")
-                    return False
+            process = self.current_process
+        if process is not None and process.poll() is None:
+            try:
+                self.supervisor.stop([process])
+                print("🛑 已取消当前FFmpeg进程")
+                return True
+            except Exception as e:
+                print(f"❌ 取消进程时出错: {e}")
+                return False
         return False
     
-    def process_with_retry(self, command, progress_callback=None):
-        """带重试机制的FFmpeg执行"""
+    def process_with_retry(self, command, progress_callback=None, duration=None, stats_callback=None):
+        """
+        按重试策略执行FFmpeg：永久性错误不重试，资源不足时降级重试，原因不明时原样重试
+
+        Args:
+            progress_callback: callback(百分比, 说明)，百分比按已输出时长/预期输出时长计算
+            duration: 预期输出时长（秒），None时取命令里输出级的 -t
+            stats_callback: callback(FFmpegProgress)，每次收到 -progress 快照时调用
+
+        每次尝试的降级、结果和失败类别记录在 attempt_path 中。
+        """
         self.is_cancelled = False
+        self.attempt_metrics = []
+        self.attempt_path = []
+        state = RetryState()
         
-        # 保存当前命令，供超时监控使用
+        # 保存当前命令，供状态查询使用
         self.current_command = command
+        message = "未执行"
         
-        for attempt in range(self.max_retries):
-            if self.is_cancelled:
-                print("🛑 处理已被取消")
-                self.current_command = None  # 清除命令引用
-                return False, "处理已被用户取消"
-                
-            try:
-                print(f"🔄 尝试 {attempt + 1}/{self.max_retries}")
-                
-                # 在每次重试前清理卡住的进程
-                if attempt > 0:
-                    killed = self.kill_stuck_ffmpeg_processes()
-                    if killed > 0:
-                        print(f"🧹 清理了 {killed} 个卡住的FFmpeg进程")
-                        time.sleep(2)  # 等待系统清理
+        try:
+            while state.attempts < self.max_retries:
+                if self.is_cancelled:
+                    print("🛑 处理已被取消")
+                    return False, "处理已被用户取消"
                 
-                success, message = self._execute_ffmpeg(command, progress_callback)
+                state.attempts += 1
+                fallbacks = f"（降级: {', '.join(state.fallbacks)}）" if state.fallbacks else ""
+                print(f"🔄 尝试 {state.attempts}/{self.max_retries}{fallbacks}")
+                self.current_command = command
+                success, message = self._execute_ffmpeg(command, progress_callback, duration, stats_callback)
+                step = {'attempt': state.attempts, 'fallbacks': list(state.fallbacks)}
+                self.attempt_path.append(step)
                 
                 if success:
-                    self.current_command = None  # 清除命令引用
+                    step['outcome'] = 'ok'
                     return True, "处理成功完成"
-                elif self.is_cancelled:
-                    self.current_command = None  # 清除命令引用
+                if self.is_cancelled:
+                    step['outcome'] = 'cancelled'
                     return False, "处理已被取消"
-                else:
-                    print(f"❌ 尝试 {attempt + 1} 失败: {message}")
-                    if attempt < self.max_retries - 1:
-                        wait_time = 2 ** attempt  # 指数退避
-                        print(f"⏳ 等待 {wait_time} 秒后重试...")
-                        time.sleep(wait_time)
-                        
-            except Exception as e:
-                print(f"❌ 尝试 {attempt + 1} 出现异常: {e}")
-                if attempt == self.max_retries - 1:
-                    self.current_command = None  # 清除命令引用
-                    return False, f"所有重试都失败了: {e}"
-                    
-        self.current_command = None  # 清除命令引用
-        return False, f"经过 {self.max_retries} 次重试后仍然失败"
+                
+                metrics = self.attempt_metrics[-1] if len(self.attempt_metrics) == state.attempts else {}
+                failure = classify_failure(metrics)
+                step.update(outcome=failure, error_class=metrics.get('error_class'), message=message)
+                print(f"❌ 尝试 {state.attempts} 失败（{failure}）: {message}")
+                if state.attempts >= self.max_retries:
+                    break
+                decision = self.retry_policy.decide(failure, command, state)
+                if not decision.retry:
+                    print(f"⛔ {decision.reason}")
+                    return False, message
+                if decision.fallback:
+                    state.fallbacks.append(decision.fallback)
+                    command = decision.command
+                print(f"⏳ {decision.reason}，等待 {decision.wait:g} 秒后重试...")
+                time.sleep(decision.wait)
+            
+            return False, f"经过 {state.attempts} 次尝试后仍然失败: {message}"
+        finally:
+            self.current_command = None  # 清除命令引用
     
-    def _execute_ffmpeg(self, command, progress_callback=None):
-        """执行FFmpeg命令"""
+    def _execute_ffmpeg(self, command, progress_callback=None, duration=None, stats_callback=None):
+        """执行FFmpeg命令，从 -progress 输出读取真实进度"""
+        log = self.last_log = StderrLog(self.stderr_lines)
+        process = None
+        with self.process_lock:
+            # 上一次尝试的进程和看门狗记录不能混进这次的统计
+            self.current_process = None
+            self.current_watch = None
         try:
             with self.process_lock:
                 if self.is_cancelled:
@@ -126,324 +127,97 @@ class FFmpegProcessor:
                     
                 # 记录进程启动时间
                 self.process_start_time = time.time()
+                self.last_progress = None
                 
-                # 启动FFmpeg进程
-                self.current_process = subprocess.Popen(
-                    command,
+                # 启动FFmpeg进程：标准输出只用于 -progress，日志走标准错误；两个管道都按字节逐行读
+                run_command = with_progress(command)
+                process = self.current_process = self.supervisor.popen(
+                    run_command,
+                    stdin=subprocess.DEVNULL,
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    encoding='utf-8',
-                    errors='ignore',  # 忽略无法解码的字符
-                    bufsize=1
+                    stderr=subprocess.PIPE
                 )
             
-            # 使用线程监控超时
-            timeout_thread = threading.Thread(
-                target=self._timeout_monitor,
-                args=(self.current_process,)
-            )
-            timeout_thread.daemon = True
-            timeout_thread.start()
+                # 交给共用的看门狗：没有 -progress 输出时只做总时长超时
+                watch = self.current_watch = self.watchdog.watch(
+                    process, timeout=self.timeout,
+                    stall_timeout=self.stall_timeout if "-progress" in run_command else None,
+                    label=os.path.basename(str(command[-1])))
             
-            # 模拟进度更新（简化版本，避免复杂的输出解析）
-            if progress_callback:
-                progress_thread = threading.Thread(
-                    target=self._simulate_progress,
-                    args=(progress_callback,)
-                )
-                progress_thread.daemon = True
-                progress_thread.start()
+            # 标准错误由后台线程读进环形缓冲，避免管道写满后ffmpeg阻塞
+            stderr_thread = threading.Thread(target=log.drain, args=(process.stderr,), daemon=True)
+            stderr_thread.start()
+            
+            parser = ProgressParser(duration or output_duration(command))
+            for line in process.stdout:
+                snapshot = parser.feed(line.decode('utf-8', 'ignore'))
+                if snapshot is None:
+                    continue
+                self.last_progress = snapshot
+                watch.observe(snapshot)
+                if stats_callback:
+                    stats_callback(snapshot)
+                if progress_callback and snapshot.percent is not None and not snapshot.done:
+                    progress_callback(snapshot.percent, snapshot.describe())
             
             # 等待进程完成
-            stdout, stderr = self.current_process.communicate()
+            process.wait()
+            stderr_thread.join(timeout=5)
             
+            # 所属任务或批次在登记处被取消时不再重试
+            if self.supervisor.is_cancelled():
+                self.is_cancelled = True
             if self.is_cancelled:
                 return False, "处理已被取消"
+            if watch.verdict == 'stall':
+                return False, f"FFmpeg进程卡住，已终止（{watch.events[0].detail}）"
+            if watch.verdict == 'timeout':
+                return False, f"FFmpeg执行超时（{self.timeout}秒），已终止"
                 
-            if self.current_process.returncode == 0:
+            if process.returncode == 0:
                 # 确保进度回调显示100%完成
                 if progress_callback:
                     progress_callback(100, "处理完成")
                 return True, "FFmpeg执行成功"
+            elif log.error_class is not None:
+                # 已分类的错误：类别说明 + 第一条原文
+                return False, log.summary()
             else:
-                # 提供更详细的错误信息
-                error_msg = stderr.strip() if stderr else "未知错误"
-                # 提取关键错误信息
-                if "No such file or directory" in error_msg:
-                    return False, "文件不存在或路径错误"
-                elif "Invalid data found" in error_msg:
-                    return False, "视频文件损坏或格式不支持"
-                elif "Permission denied" in error_msg:
-                    return False, "文件权限不足"
-                elif "Disk full" in error_msg or "No space left" in error_msg:
-                    return False, "磁盘空间不足"
-                else:
-                    return False, f"FFmpeg执行失败: {error_msg[:200]}..." if len(error_msg) > 200 else f"FFmpeg执行失败: {error_msg}"
+                return False, f"FFmpeg执行失败（退出码 {process.returncode}）: {log.summary()}"
                 
         except subprocess.TimeoutExpired:
             return False, "FFmpeg执行超时"
+        except ProcessCancelled:
+            self.is_cancelled = True
+            return False, "处理已被取消"
         except Exception as e:
             return False, f"FFmpeg执行异常: {e}"
         finally:
+            # 读进度时出错等异常退出：先停止并等待仍在运行的ffmpeg，免得它和下一次尝试写同一个输出文件
+            if process is not None and process.poll() is None:
+                self.supervisor.stop([process])
+                process.wait()
             with self.process_lock:
+                if self.current_process is not None:
+                    self.supervisor.release(self.current_process)
+                if self.current_watch is not None:
+                    self.watchdog.release(self.current_watch)
+                    # 每次尝试：看门狗决定 + 标准错误摘要
+                    self.attempt_metrics.append({**self.current_watch.metrics(), **log.to_dict(),
+                                                 'returncode': self.current_process.returncode})
                 self.current_process = None
+                self.current_watch = None
                 self.process_start_time = None
     
-    def _timeout_monitor(self, process):
-        """超时监控线程 - 增强版，定期检查进程状态和资源使用"""
-        start_time = time.time()
-        check_interval = 10  # 每10秒检查一次（原为15秒）
-        last_progress_time = start_time
-        last_output_size = 0
-        stalled_count = 0
-        max_stalled_checks = 3  # 连续3次检查无进展则视为卡住（原为4次）
-        cpu_usage_samples = []  # CPU使用率样本
-        
-        # 获取输出文件路径（如果可能）
-        output_path = None
-        if hasattr(self, 'current_command') and self.current_command:
-            for i, arg in enumerate(self.current_command):
-                if arg == '-y' and i+1 < len(self.current_command):
-                    output_path = self.current_command[i+1]
-                    break
-        
-        while True:
-            # 如果进程已结束或被取消，退出监控
-            if not process or process.poll() is not None or self.is_cancelled:
-                return
-                
-            current_time = time.time()
-            elapsed_time = current_time - start_time
-            
-            # 检查是否超时
-            if elapsed_time >= self.timeout:
-                print(f"⏰ FFmpeg进程超时 ({self.timeout}秒)，正在终止...")
-                try:
-                    # 先尝试正常终止
-                    process.terminate()
-                    
-                    # 等待最多5秒看进程是否结束
-                    for _ in range(5):
-                        time.sleep(1)
-                        if process.poll() is not None:
-                            print("进程已正常终止")
-                            break
-                    
-                    # 如果进程仍未结束，强制杀死
-                    if process.poll() is None:
-                        print("进程未响应终止信号，强制结束...")
-                        process.kill()
-                        
-                        # 再等待3秒确认进程已被杀死
-                        for _ in range(3):
-                            time.sleep(1)
-                            if process.poll() is not None:
-                                print("进程已被强制终止")
-                                break
-                        
-                        # 如果进程仍未结束，尝试使用系统命令杀死
-                        if process.poll() is None:
-                            print("进程仍未终止，尝试使用系统命令强制终止...")
-                            try:
-                                import signal
-                                os.kill(process.pid, signal.SIGKILL)
-                            except Exception as e:
-                                print(f"使用系统命令终止进程时出错: {e}")
-                except Exception as e:
-                    print(f"终止进程时出错: {e}")
-                    
-                # 清理相关资源
-                with self.process_lock:
-                    self.current_process = None
-                return
-            
-            # 检查进程资源使用情况
-            try:
-                import psutil
-                proc = psutil.Process(process.pid)
-                cpu_percent = proc.cpu_percent(interval=0.5)
-                memory_percent = proc.memory_percent()
-                cpu_usage_samples.append(cpu_percent)
-                
-                # 保留最近5个样本
-                if len(cpu_usage_samples) > 5:
-                    cpu_usage_samples.pop(0)
-                
-                # 计算平均CPU使用率
-                avg_cpu = sum(cpu_usage_samples) / len(cpu_usage_samples) if cpu_usage_samples else 0
-                
-                # 如果CPU使用率持续过低且进程运行超过30秒，可能卡住了
-                if elapsed_time > 30 and avg_cpu < 1.0 and len(cpu_usage_samples) >= 3:
-                    print(f"警告: CPU使用率过低 ({avg_cpu:.1f}%)，可能卡住")
-                    stalled_count += 1
-                    if stalled_count >= max_stalled_checks:  # 连续多次检测到低CPU使用率
-                        print(f"⚠️ FFmpeg进程CPU使用率持续过低，可能卡住，正在终止...")
-                        try:
-                            process.terminate()
-                            time.sleep(2)
-                            if process.poll() is None:
-                                process.kill()
-                        except Exception as e:
-                            print(f"终止卡住进程时出错: {e}")
-                        return
-            except (ImportError, Exception) as e:
-                # psutil可能未安装或进程访问出错
-                pass
-            
-            # 检查输出文件大小是否有变化（判断进程是否卡住）
-            if output_path and os.path.exists(output_path):
-                try:
-                    current_size = os.path.getsize(output_path)
-                    if current_size == last_output_size:
-                        stalled_count += 1
-                        print(f"警告: 输出文件大小未变化 ({stalled_count}/{max_stalled_checks})")
-                        if stalled_count >= max_stalled_checks:
-                            print(f"⚠️ FFmpeg进程似乎卡住了（输出文件大小长时间未变化），正在终止...")
-                            try:
-                                process.terminate()
-                                time.sleep(2)
-                                if process.poll() is None:
-                                    process.kill()
-                            except Exception as e:
-                                print(f"终止卡住进程时出错: {e}")
-                            return
-                    else:
-                        stalled_count = 0  # 重置卡住计数
-                        print(f"✅ 输出文件大小正常增长: {last_output_size} -> {current_size} bytes")
-                    last_output_size = current_size
-                    
-                    # 检查文件大小增长率和进程运行时间
-                    if elapsed_time > 120:  # 运行超过2分钟
-                        # 如果文件过小，可能卡住了
-                        if current_size < 1024 * 1024:  # 文件小于1MB
-                            print(f"⚠️ 进程运行{elapsed_time:.1f}秒，但输出文件仅{current_size/1024:.1f}KB，可能卡住，终止进程")
-                            try:
-                                process.terminate()
-                                time.sleep(2)
-                                if process.poll() is None:
-                                    process.kill()
-                            except Exception as e:
-                                print(f"终止卡住进程时出错: {e}")
-                            return
-                        
-                        # 如果文件大小增长率过低，也可能卡住了
-                        if elapsed_time > 300 and last_output_size > 0:  # 运行超过5分钟且有上次大小记录
-                            # 计算每秒平均增长字节数
-                            growth_rate = (current_size - last_output_size) / check_interval
-                            if growth_rate < 10240:  # 每秒增长少于10KB
-                                print(f"⚠️ 文件增长率过低 ({growth_rate:.1f} bytes/s)，可能卡住，终止进程")
-                                try:
-                                    process.terminate()
-                                    time.sleep(2)
-                                    if process.poll() is None:
-                                        process.kill()
-                                except Exception as e:
-                                    print(f"终止卡住进程时出错: {e}")
-                                return
-                except Exception as e:
-                    print(f"检查输出文件时出错: {e}")
-            
-            # 短暂休眠后继续检查
-            time.sleep(check_interval)
-    
-    def _simulate_progress(self, progress_callback):
-        """模拟进度更新 - 改进版，更平滑的进度过渡"""
-        progress = 0
-        start_time = time.time()
-        last_update_time = start_time
-        slow_progress_threshold = 90  # 90%后进度变慢
-        
-        # 快速阶段 - 0% 到 90%
-        while progress < slow_progress_threshold and not self.is_cancelled:
-            if self.current_process and self.current_process.poll() is not None:
-                # 进程已结束
-                if self.current_process.returncode == 0:
-                    progress_callback(100, "处理完成")
-                else:
-                    progress_callback(progress, f"处理失败 (退出码: {self.current_process.returncode})")
-                return
-                
-            # 快速增长阶段
-            progress = min(progress + 5, slow_progress_threshold)
-            progress_callback(progress, f"处理中... {progress}%")
-            time.sleep(0.8)  # 更新间隔
-        
-        # 慢速阶段 - 90% 到 98%
-        while progress < 98 and not self.is_cancelled:
-            if self.current_process and self.current_process.poll() is not None:
-                # 进程已结束
-                if self.current_process.returncode == 0:
-                    progress_callback(100, "处理完成")
-                else:
-                    progress_callback(progress, f"处理失败 (退出码: {self.current_process.returncode})")
-                return
-            
-            # 慢速增长阶段
-            current_time = time.time()
-            if current_time - last_update_time >= 3:  # 每3秒更新一次
-                progress = min(progress + 1, 98)
-                progress_callback(progress, f"处理中... {progress}%")
-                last_update_time = current_time
-            
-            time.sleep(1)  # 更频繁地检查进程状态
-            
-        # 等待进程完成
-        if not self.is_cancelled and self.current_process:
-            check_interval = 0.5  # 检查间隔
-            last_status_time = time.time()
-            max_wait_time = 60  # 最大等待时间60秒
-            wait_start_time = time.time()
-            
-            # 等待进程完成
-            while self.current_process and self.current_process.poll() is None and not self.is_cancelled:
-                current_time = time.time()
-                
-                # 检查是否等待时间过长
-                if current_time - wait_start_time > max_wait_time:
-                    progress_callback(99, "处理超时，正在强制完成...")
-                    break
-                
-                # 每10秒更新一次状态，让用户知道进程仍在运行
-                if current_time - last_status_time >= 10:
-                    progress_callback(98, f"处理中... 98% (正在完成最终处理)")
-                    last_status_time = current_time
-                
-                time.sleep(check_interval)
-            
-            # 进程完成后的最终状态更新
-            if self.current_process and self.current_process.poll() is not None:
-                if self.current_process.returncode == 0:
-                    progress_callback(100, "处理完成")
-                else:
-                    progress_callback(99, f"处理失败 (退出码: {self.current_process.returncode})")
-            elif self.is_cancelled:
-                progress_callback(0, "处理已取消")
-            else:
-                progress_callback(100, "处理完成")
-    
     def get_status(self):
-        """获取当前处理状态，增强版，可以检测卡住的进程"""
+        """获取当前处理状态，out_time 长时间不增长时返回“卡住”"""
         with self.process_lock:
             if self.current_process is None:
                 return "空闲"
             elif self.current_process.poll() is None:
-                # 检查是否有输出文件且大小长时间未变化
-                if hasattr(self, 'current_command') and self.current_command:
-                    output_path = None
-                    for i, arg in enumerate(self.current_command):
-                        if arg == '-y' and i+1 < len(self.current_command):
-                            output_path = self.current_command[i+1]
-                            break
-                    
-                    if output_path and os.path.exists(output_path):
-                        # 检查进程运行时间
-                        if hasattr(self, 'process_start_time'):
-                            elapsed_time = time.time() - self.process_start_time
-                            # 如果进程运行超过5分钟，且输出文件存在但大小小于1MB，可能卡住了
-                            if elapsed_time > 300 and os.path.getsize(output_path) < 1024 * 1024:
-                                return "卡住"
-                
+                watch = self.current_watch
+                if watch is not None and watch.stall_timeout and watch.stalled_for() >= watch.stall_timeout / 2:
+                    return "卡住"
                 return "运行中"
             else:
-                return "已完成"
\ No newline at end of file
+                return "已完成"
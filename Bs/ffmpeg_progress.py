@@ -0,0 +1,92 @@
+from dataclasses import dataclass, replace
+from typing import Optional, Sequence
+
+# ffmpeg -progress 每个块以 progress=continue/end 结束
+_BLOCK_END = "progress"
+
+
+@dataclass
+class FFmpegProgress:
+    """ffmpeg -progress 输出的一次快照"""
+    frame: int = 0
+    fps: float = 0.0              # 编码速度（帧/秒）
+    out_time: float = 0.0         # 已输出的时长（秒）
+    speed: float = 0.0            # 相对实时的倍速
+    total_size: int = 0           # 已写出的字节数
+    percent: Optional[float] = None   # 相对预期输出时长的百分比，时长未知时为None
+    done: bool = False
+
+    def describe(self):
+        """进度条旁边显示的一行说明"""
+        return f"帧{self.frame} · {self.fps:.1f}fps · {self.speed:.2f}x"
+
+
+def _number(value, cast):
+    try:
+        return cast(value.strip().rstrip("x"))
+    except (ValueError, AttributeError):
+        return None
+
+
+class ProgressParser:
+    """
+    逐行解析 -progress 的 key=value 输出，每读完一个块返回一次快照
+
+    out_time_us 优先于 out_time_ms（旧版本ffmpeg里两者都是微秒）；N/A 的字段保持上一次的值。
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration if duration and duration > 0 else None
+        self.current = FFmpegProgress()
+        self._has_us = False
+
+    def feed(self, line) -> Optional[FFmpegProgress]:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        current = self.current
+        if key == "frame":
+            current.frame = _number(value, int) or current.frame
+        elif key == "fps":
+            fps = _number(value, float)
+            current.fps = fps if fps is not None else current.fps
+        elif key in ("out_time_us", "out_time_ms"):
+            us = _number(value, int)
+            if us is not None and us >= 0 and (key == "out_time_us" or not self._has_us):
+                current.out_time = us / 1e6
+            if key == "out_time_us":
+                self._has_us = True
+        elif key == "speed":
+            speed = _number(value, float)
+            current.speed = speed if speed is not None else current.speed
+        elif key == "total_size":
+            size = _number(value, int)
+            current.total_size = size if size is not None else current.total_size
+        elif key == _BLOCK_END:
+            current.done = value.strip() == "end"
+            if self.duration:
+                current.percent = min(current.out_time / self.duration * 100, 100.0 if current.done else 99.9)
+            return replace(current)
+        return None
+
+
+def output_duration(command: Sequence[str]) -> Optional[float]:
+    """命令里最后一个输出级 -t（出现在最后一个 -i 之后）的值，没有时返回None"""
+    args = list(command)
+    last_input = max((i for i, arg in enumerate(args) if arg == "-i"), default=-1)
+    for i in range(len(args) - 2, last_input, -1):
+        if args[i] == "-t":
+            return _number(args[i + 1], float)
+    return None
+
+
+def with_progress(command: Sequence[str]):
+    """
+    在ffmpeg命令中加入 -progress pipe:1 -nostats
+
+    输出写到标准输出（"-" 或 pipe:1）或命令里已有 -progress 时原样返回。
+    """
+    args = list(command)
+    if "-progress" in args or any(arg in ("-", "pipe:1", "pipe:") for arg in args[1:]):
+        return args
+    return args[:1] + ["-progress", "pipe:1", "-nostats"] + args[1:]
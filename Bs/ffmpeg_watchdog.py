@@ -0,0 +1,155 @@
+import time
+import signal
+import threading
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+from process_supervisor import get_supervisor
+
+
+@dataclass
+class WatchEvent:
+    """看门狗的一次决定，elapsed 为任务开始后的秒数"""
+    elapsed: float
+    action: str         # stall / timeout / terminate / kill
+    detail: str = ""
+
+
+class WatchedJob:
+    """
+    被监控的ffmpeg进程
+
+    out_time 增长即视为有进展；stall_timeout 秒内没有增长（包括启动后迟迟没有第一次输出）判定为卡住。
+    stall_timeout 为None时只做总时长超时。
+    """
+
+    def __init__(self, process, timeout=None, stall_timeout=None, label="", clock=time.monotonic):
+        self.process = process
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.label = label
+        self._clock = clock
+        self.started = clock()
+        self.last_advance = self.started
+        self.last_out_time = None
+        self.max_gap = 0.0            # 两次进展之间最长的间隔（秒）
+        self.events: List[WatchEvent] = []
+        self.verdict: Optional[str] = None   # 'stall' 或 'timeout'，被看门狗终止时设置
+        self.terminated_at = None
+
+    def observe(self, snapshot, now=None):
+        """收到一次 -progress 快照"""
+        if self.last_out_time is not None and snapshot.out_time <= self.last_out_time:
+            return
+        now = self._clock() if now is None else now
+        self.max_gap = max(self.max_gap, now - self.last_advance)
+        self.last_advance = now
+        self.last_out_time = snapshot.out_time
+
+    def stalled_for(self, now=None):
+        now = self._clock() if now is None else now
+        return now - self.last_advance
+
+    def record(self, action, detail="", now=None):
+        now = self._clock() if now is None else now
+        event = WatchEvent(round(now - self.started, 3), action, detail)
+        self.events.append(event)
+        return event
+
+    def metrics(self, now=None):
+        """写入任务统计的看门狗数据"""
+        now = self._clock() if now is None else now
+        return {
+            'elapsed': round(now - self.started, 3),
+            'max_progress_gap': round(max(self.max_gap, self.stalled_for(now)), 3),
+            'verdict': self.verdict,
+            'events': [asdict(e) for e in self.events],
+        }
+
+
+class Watchdog:
+    """
+    所有ffmpeg任务共用的看门狗：一个后台线程按间隔检查全部任务
+
+    判定卡住或超时后先 terminate，kill_grace 秒后仍未退出再 kill，检查本身从不阻塞。
+    信号经子进程登记处发给整个进程组，ffmpeg派生的子进程一并结束。
+    """
+
+    def __init__(self, interval=1.0, kill_grace=5.0, clock=time.monotonic, supervisor=None):
+        self.interval = interval
+        self.kill_grace = kill_grace
+        self._clock = clock
+        self.supervisor = supervisor or get_supervisor()
+        self._jobs: List[WatchedJob] = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, process, timeout=None, stall_timeout=None, label="") -> WatchedJob:
+        job = WatchedJob(process, timeout, stall_timeout, label, clock=self._clock)
+        with self._lock:
+            self._jobs.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                thread = threading.Thread(target=self._run, daemon=True, name="ffmpeg-watchdog")
+                thread.start()
+                self._thread = thread
+        return job
+
+    def release(self, job):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def check(self, now=None) -> List[WatchEvent]:
+        """检查一遍全部任务，返回本次做出的决定"""
+        now = self._clock() if now is None else now
+        events = []
+        for job in self.jobs():
+            if job.process.poll() is not None:
+                continue
+            if job.terminated_at is not None:
+                if now - job.terminated_at >= self.kill_grace:
+                    self.supervisor.signal(job.process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                    job.terminated_at = float('inf')     # 只kill一次
+                    events.append(job.record('kill', "terminate后未退出", now))
+                continue
+            elapsed = now - job.started
+            if job.timeout and elapsed >= job.timeout:
+                job.verdict = 'timeout'
+                events.append(job.record('timeout', f"运行{elapsed:.0f}秒，超过{job.timeout}秒", now))
+            elif job.stall_timeout and job.stalled_for(now) >= job.stall_timeout:
+                job.verdict = 'stall'
+                position = f"out_time停在{job.last_out_time:.2f}s" if job.last_out_time is not None else "没有进度输出"
+                events.append(job.record('stall', f"{position}，{job.stalled_for(now):.0f}秒未增长", now))
+            else:
+                continue
+            self.supervisor.signal(job.process, signal.SIGTERM)
+            job.terminated_at = now
+            events.append(job.record('terminate', "", now))
+        for event in events:
+            if event.action in ('stall', 'timeout', 'kill'):
+                print(f"🐕 看门狗: {event.action} {event.detail}")
+        return events
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"❌ 看门狗检查出错: {e}")
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+
+
+_default_watchdog = Watchdog()
+
+
+def get_watchdog() -> Watchdog:
+    """获取全局看门狗"""
+    return _default_watchdog
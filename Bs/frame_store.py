@@ -0,0 +1,237 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ffmpeg_log import StderrLog
+from layer_graph import input_args
+from process_supervisor import get_supervisor
+
+# 缓存文件格式变化时修改版本号
+FRAME_STORE_VERSION = 1
+# 解码时每次写入的帧数
+_CHUNK_FRAMES = 16
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+@dataclass
+class StoredFrames:
+    """
+    一段模板解码后的帧：预乘alpha的rgba，固定分辨率，按帧率等间隔
+
+    frames 是只读的 np.memmap，形状 (帧数, 高, 宽, 4)；多个进程打开同一文件时共享页缓存。
+    """
+    path: str
+    fps: float
+    width: int
+    height: int
+    timestamps: List[float]
+    frames: np.ndarray
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def _key(template_path, seek, duration, fps, width, height, filters):
+    st = os.stat(template_path)
+    payload = json.dumps({
+        'version': FRAME_STORE_VERSION,
+        'source': [os.path.abspath(template_path), st.st_size, st.st_mtime_ns],
+        'window': [round(seek, 3) if seek else None, round(duration, 3) if duration is not None else None],
+        'format': [fps, width, height, list(filters)],
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _premultiply_inplace(frames):
+    """rgba uint8 原地预乘：rgb = rgb * a / 255（四舍五入）"""
+    alpha = frames[..., 3:4].astype(np.uint16)
+    rgb = frames[..., :3].astype(np.uint16)
+    rgb *= alpha
+    rgb += 127
+    rgb //= 255
+    frames[..., :3] = rgb
+
+
+class FrameStore:
+    """
+    模板帧仓库：每段模板只解码一次，存成本地磁盘上的内存映射文件
+
+    文件按最近使用时间（mtime）做LRU淘汰，总大小不超过 max_bytes。
+    写入先写临时文件再原子改名，多个进程同时生成同一段模板也不会读到半成品。
+    """
+
+    def __init__(self, cache_dir, max_bytes=4 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, f"frames_{key}")
+        return base + ".rgba", base + ".json"
+
+    def _lock(self, key):
+        with _locks_guard:
+            return _locks.setdefault(key, threading.Lock())
+
+    def get(self, template_path, seek, duration, fps, width, height, filters: Sequence[str]) -> StoredFrames:
+        """
+        取出模板片段 [seek, seek + duration) 按 filters 处理后的帧（走缓存）
+
+        Args:
+            filters: 解码滤镜，最后必须输出 width x height 的rgba
+
+        Raises:
+            subprocess.CalledProcessError: 解码失败
+        """
+        key = _key(template_path, seek, duration, fps, width, height, filters)
+        data_path, index_path = self._paths(key)
+        with self._lock(key):
+            stored = self._open(data_path, index_path)
+            if stored is not None:
+                self.hits += 1
+                return stored
+            self.misses += 1
+            self._build(template_path, seek, duration, fps, width, height, filters, data_path, index_path)
+            stored = self._open(data_path, index_path)
+        self.prune()
+        return stored
+
+    def _open(self, data_path, index_path) -> Optional[StoredFrames]:
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            count = len(index['timestamps'])
+            shape = (count, index['height'], index['width'], 4)
+            frames = (np.memmap(data_path, dtype=np.uint8, mode='r', shape=shape) if count
+                      else np.zeros(shape, dtype=np.uint8))
+        except (OSError, ValueError, KeyError):
+            return None
+        # 记录最近使用时间，供LRU淘汰
+        for path in (data_path, index_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return StoredFrames(data_path, index['fps'], index['width'], index['height'], index['timestamps'], frames)
+
+    def _build(self, template_path, seek, duration, fps, width, height, filters, data_path, index_path):
+        frame_size = width * height * 4
+        cmd = (["ffmpeg", "-v", "error", "-nostdin"] + input_args(template_path, seek, duration) +
+               ["-map", "0:v:0", "-vf", ",".join(filters), "-f", "rawvideo", "-pix_fmt", "rgba", "-"])
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_data = f"{data_path}.{os.getpid()}.{threading.get_ident()}.part"
+        count = 0
+        process = get_supervisor().popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        # 标准错误在后台线程里读，避免管道写满后ffmpeg卡住
+        log = StderrLog(max_lines=20)
+        reader = threading.Thread(target=log.drain, args=(process.stderr,), daemon=True)
+        reader.start()
+        try:
+            with open(tmp_data, 'wb') as out:
+                buf = bytearray(frame_size * _CHUNK_FRAMES)
+                view = memoryview(buf)
+                while True:
+                    filled = 0
+                    while filled < len(buf):
+                        n = process.stdout.readinto(view[filled:])
+                        if not n:
+                            break
+                        filled += n
+                    frames = filled // frame_size
+                    if not frames:
+                        break
+                    chunk = np.frombuffer(buf, dtype=np.uint8, count=frames * frame_size).reshape(
+                        frames, height, width, 4)
+                    _premultiply_inplace(chunk)
+                    out.write(view[:frames * frame_size])
+                    count += frames
+                    if filled < len(buf):
+                        break
+            if process.wait() != 0:
+                reader.join(timeout=5)
+                raise subprocess.CalledProcessError(process.returncode, cmd, stderr="\n".join(log.tail()))
+            index = {'version': FRAME_STORE_VERSION, 'source': template_path, 'fps': fps,
+                     'width': width, 'height': height,
+                     'timestamps': [round(i / fps, 6) for i in range(count)]}
+            tmp_index = f"{index_path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp_index, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            # 先放数据再放索引：索引存在即表示数据完整
+            os.replace(tmp_data, data_path)
+            os.replace(tmp_index, index_path)
+            print(f"🗃️ 模板帧已缓存 {count}帧 {width}x{height}: {os.path.basename(template_path)}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            get_supervisor().release(process)
+            if os.path.exists(tmp_data):
+                os.remove(tmp_data)
+
+    def _names(self):
+        try:
+            return os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return []
+
+    def total_bytes(self):
+        total = 0
+        for name in self._names():
+            if name.startswith("frames_"):
+                try:
+                    total += os.path.getsize(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+        return total
+
+    def prune(self):
+        """按最近使用时间淘汰，直到总大小不超过上限；已映射的文件删除后仍可继续读取"""
+        entries = []
+        for name in self._names():
+            if not (name.startswith("frames_") and name.endswith(".json")):
+                continue
+            index_path = os.path.join(self.cache_dir, name)
+            data_path = index_path[:-len(".json")] + ".rgba"
+            try:
+                size = os.path.getsize(data_path) + os.path.getsize(index_path)
+                mtime = os.path.getmtime(index_path)
+            except OSError:
+                continue
+            entries.append((mtime, size, data_path, index_path))
+        total = sum(e[1] for e in entries)
+        for _, size, data_path, index_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in (index_path, data_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def configure_frame_store(cache_dir, max_bytes=4 << 30):
+    """设置全局模板帧仓库的位置和大小上限"""
+    global _default_store
+    with _default_store_lock:
+        _default_store = FrameStore(cache_dir, max_bytes=max_bytes)
+    return _default_store
+
+
+def get_frame_store() -> Optional[FrameStore]:
+    """获取全局模板帧仓库，未配置时返回None"""
+    with _default_store_lock:
+        return _default_store
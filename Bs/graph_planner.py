@@ -0,0 +1,167 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import MediaInfo, probe_media_cached, read_mp4_header
+
+# 输出为 yuv420p 的 H.264：overlay 在 yuv420 下混合，素材无需转换，
+# 叠加层只接受 yuva420p，模板分支直接转换成它，overlay 内部不再隐式转换
+OVERLAY_FORMAT = "yuv420"
+OVERLAY_INPUT_PIX_FMT = "yuva420p"
+MATERIAL_PIX_FMTS = ('yuv420p', 'yuvj420p')
+# 帧率差小于该值视为相同
+_FPS_EPS = 0.01
+# 宽高比相对差小于该值视为相同（854x480 与 16:9 之类的取整误差）
+_ASPECT_EPS = 0.01
+
+
+def _even(value):
+    return max(2, int(round(value / 2.0)) * 2)
+
+
+@dataclass
+class BranchPlan:
+    """单个模板输入的预处理：在split和时间戳平移之前执行，每帧最多一次swscale"""
+    filters: List[str]
+    scale: float = 1.0               # 等比缩放系数，叠加位置同样乘以它
+    note: str = ""
+    size: Tuple[int, int] = (0, 0)   # 预处理后的画面尺寸
+
+
+@dataclass
+class GraphPlan:
+    """
+    叠加滤镜图的格式规划
+
+    素材分支：fps（输出帧率与素材不同时）-> format（非yuv420p时）
+    模板分支：fps（模板帧率更高时丢帧）-> scale（开启模板缩放且宽高比相同、尺寸不同时等比缩放）-> format=yuva420p
+    overlay：format=yuv420
+    """
+    width: int
+    height: int
+    fps: Optional[float]
+    material_filters: List[str] = field(default_factory=list)
+    branches: Dict[str, BranchPlan] = field(default_factory=dict)
+    notes: List[str] = field(default_factory=list)
+    overlay_format: str = OVERLAY_FORMAT
+
+    def branch_filters(self, path) -> List[str]:
+        branch = self.branches.get(path)
+        return branch.filters if branch else []
+
+    def position(self, placement) -> Tuple[int, int]:
+        """模板缩放后叠加位置同比例缩放"""
+        branch = self.branches.get(placement.template_path)
+        if branch is None:
+            return placement.x, placement.y
+        return int(round(placement.x * branch.scale)), int(round(placement.y * branch.scale))
+
+
+def stream_info(path) -> Optional[MediaInfo]:
+    """模板流信息：优先用元数据缓存，ffprobe不可用时退回MP4/MOV文件头（没有像素格式）"""
+    try:
+        return probe_media_cached(path)
+    except Exception:
+        pass
+    try:
+        return read_mp4_header(path)
+    except Exception:
+        return None
+
+
+def plan_branch(info: MediaInfo, fps: Optional[float], width, height, canvas=None,
+                scale_templates=False) -> BranchPlan:
+    """
+    根据模板流属性规划预处理滤镜
+
+    Args:
+        info: 模板（或裁剪后模板）的流信息
+        fps: 目标帧率
+        width / height: 素材画面尺寸
+        canvas: 裁剪前的模板画面尺寸，None表示就是 info 的尺寸
+        scale_templates: 是否把模板缩放到素材尺寸（会改变画面，默认关闭）
+
+    开启缩放时只有模板画面与素材宽高比相同才等比缩放到素材尺寸；宽高比不同的模板不缩放，
+    仍按原尺寸和原位置叠加，避免被拉伸变形。
+    """
+    filters = []
+    steps = []
+    if fps and info.fps and info.fps > fps + _FPS_EPS:
+        # 只丢帧不补帧：帧率低于输出时overlay会沿用上一帧，补帧只会增加转换次数
+        filters.append(f"fps={fps:g}")
+        steps.append(f"{info.fps:g}->{fps:g}fps")
+
+    scale = 1.0
+    size = (info.width, info.height)
+    canvas_w, canvas_h = canvas or (info.width, info.height)
+    if scale_templates and canvas_w and canvas_h and (canvas_w, canvas_h) != (width, height):
+        if abs(canvas_w * height - canvas_h * width) <= _ASPECT_EPS * canvas_h * width:
+            scale = width / canvas_w
+            target_w = _even(info.width * scale)
+            target_h = _even(info.height * scale)
+            # scale 和 format 相邻，由同一个swscale一次完成缩放和像素格式转换
+            filters.append(f"scale={target_w}:{target_h}")
+            size = (target_w, target_h)
+            steps.append(f"{info.width}x{info.height}->{target_w}x{target_h}")
+        else:
+            steps.append(f"宽高比不同({canvas_w}x{canvas_h})，不缩放")
+
+    filters.append(f"format={OVERLAY_INPUT_PIX_FMT}")
+    if info.pix_fmt != OVERLAY_INPUT_PIX_FMT:
+        steps.append(f"{info.pix_fmt or '?'}->{OVERLAY_INPUT_PIX_FMT}")
+    return BranchPlan(filters, scale, ", ".join(steps), size)
+
+
+def plan_graph(material_info: MediaInfo, placements: Iterable, output_fps: Optional[float] = None,
+               infos: Optional[Dict[str, MediaInfo]] = None, scale_templates=False) -> Optional[GraphPlan]:
+    """
+    读取素材和各模板的流属性，规划整张滤镜图的帧率、尺寸和像素格式
+
+    Args:
+        material_info: 素材流信息
+        placements: 所有变体的全部摆放方式
+        output_fps: 输出帧率，None表示保持素材帧率（智能渲染）
+        infos: 可选的 {模板路径: 流信息}，未提供时读取缓存
+        scale_templates: 是否把尺寸不同的模板等比缩放到素材尺寸，见 plan_branch
+
+    Returns:
+        GraphPlan；素材信息不完整时返回None，交给ffmpeg自动协商
+    """
+    if material_info is None or material_info.video is None or not material_info.width or not material_info.height:
+        return None
+    width, height = material_info.width, material_info.height
+    plan = GraphPlan(width=width, height=height, fps=output_fps or material_info.fps)
+
+    if output_fps and material_info.fps and abs(material_info.fps - output_fps) > _FPS_EPS:
+        # 先统一帧率再叠加，输出端的 -r 不再丢弃已经混合过的帧
+        plan.material_filters.append(f"fps={output_fps:g}")
+        plan.notes.append(f"素材 {material_info.fps:g}fps -> {output_fps:g}fps（叠加前）")
+    if material_info.pix_fmt and material_info.pix_fmt not in MATERIAL_PIX_FMTS:
+        plan.material_filters.append("format=yuv420p")
+        plan.notes.append(f"素材 {material_info.pix_fmt} -> yuv420p（叠加前一次转换）")
+
+    infos = dict(infos or {})
+    for placement in placements:
+        path = placement.template_path
+        if path in plan.branches:
+            continue
+        info = infos.get(path) or stream_info(path)
+        if info is None or info.video is None or not info.width or not info.height:
+            plan.notes.append(f"⚠️ 无法获取流信息，交给ffmpeg自动协商: {path}")
+            continue
+        branch = plan_branch(info, plan.fps, width, height, canvas=placement.canvas,
+                             scale_templates=scale_templates)
+        plan.branches[path] = branch
+        if branch.note:
+            plan.notes.append(f"{placement.layer}: {branch.note}")
+    return plan
+
+
+def describe_graph(filter_complex, plan: Optional[GraphPlan] = None) -> str:
+    """把滤镜图拆成每行一条链，附上格式规划说明，便于日志排查"""
+    lines = []
+    if plan is not None:
+        lines.append(f"# 画面 {plan.width}x{plan.height} @ {plan.fps:g}fps，overlay format={plan.overlay_format}"
+                     if plan.fps else f"# 画面 {plan.width}x{plan.height}，overlay format={plan.overlay_format}")
+        lines += [f"#   {note}" for note in plan.notes]
+    lines += filter_complex.split(";")
+    return "\n".join(lines)
@@ -0,0 +1,366 @@
+import random
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 叠加顺序：先底层，最后顶层
+LAYER_ORDER = ('bottom_layer', 'middle_layer', 'top_layer')
+
+
+@dataclass
+class LayerPlacement:
+    """单个模板层在素材上的摆放方式"""
+    layer: str
+    template_path: str
+    offset: float                 # 模板出现在素材上的时间（秒）
+    trim_start: float             # 从模板的第几秒开始取
+    trim_duration: float          # 取多长
+    trim: bool = True             # False 时模板原样播放（标准模式短模板）
+    enable_until: Optional[float] = None  # 标准模式短模板：overlay只在 [0, enable_until] 生效
+    audio_weight: float = 1               # 混音权重，预合成的叠加层按其包含的图层数计
+    x: int = 0                            # 叠加位置，模板裁剪到可见区域后不为0
+    y: int = 0
+    canvas: Optional[Tuple[int, int]] = None  # 裁剪前的模板画面尺寸，None表示就是输入文件的尺寸
+    # 模板时间上的可见片段 ((开始, 结束), ...)，跳过全透明部分；None表示整段叠加
+    visible: Optional[Tuple[Tuple[float, float], ...]] = None
+
+    @property
+    def end(self):
+        return self.offset + self.trim_duration
+
+
+def visible_segments(start, duration, transparent_ranges):
+    """从模板时间窗 [start, start + duration) 中去掉全透明的时间段，返回剩下的片段"""
+    segments = []
+    cursor = start
+    end = start + duration
+    for t0, t1 in sorted(transparent_ranges):
+        if t1 <= cursor or t0 >= end:
+            continue
+        if t0 - cursor > 1e-3:
+            segments.append((cursor, t0))
+        cursor = max(cursor, t1)
+    if end - cursor > 1e-3:
+        segments.append((cursor, end))
+    return segments
+
+
+def _skip_transparent(placement: LayerPlacement, transparent_ranges):
+    """根据模板的全透明时间段设置可见片段，整段可见时保持原样"""
+    if not transparent_ranges:
+        return
+    start = placement.trim_start if placement.trim else 0
+    duration = placement.trim_duration
+    if placement.enable_until is not None:
+        duration = min(duration, placement.enable_until)
+    segments = visible_segments(start, duration, transparent_ranges)
+    if segments == [(start, start + duration)]:
+        return
+    placement.visible = tuple(segments)
+    skipped = duration - sum(b - a for a, b in segments)
+    print(f"🫥 {placement.layer} 跳过全透明片段 {skipped:.2f}s，可见片段 {len(segments)} 段")
+
+
+def plan_layer_placements(chosen_entries, material_duration,
+                          random_timing=False, random_timing_window=40,
+                          random_timing_mode="before_window", random_timing_start=0, random_timing_end=40,
+                          random_timing_exact=0, exact_timing_enabled=False, advanced_timing_enabled=False,
+                          alpha_clips=None) -> List[LayerPlacement]:
+    """
+    根据时间模式计算各层模板的出现时间和截取范围
+
+    Args:
+        chosen_entries: {图层: TemplateEntry}
+        material_duration: 素材时长（秒）
+        alpha_clips: {图层: (截取起点, 截取时长)}，只包含启用了Alpha截取的图层
+
+    Returns:
+        list: 按叠加顺序排列的 LayerPlacement
+    """
+    alpha_clips = alpha_clips or {}
+    # 精确定点模式优先级最高，其次是随机模式，最后是标准覆盖模式
+    use_exact_timing = exact_timing_enabled
+    use_random_timing = (random_timing or advanced_timing_enabled) and not exact_timing_enabled
+
+    placements = []
+    for layer in LAYER_ORDER:
+        entry = chosen_entries.get(layer)
+        if entry is None:
+            continue
+        template_dur = entry.duration or material_duration
+
+        # 应用Alpha截取设置
+        clip_enabled = layer in alpha_clips
+        trim_start = 0
+        trim_duration = template_dur
+        if clip_enabled:
+            trim_start, trim_duration = alpha_clips[layer]
+            template_dur = trim_duration
+            print(f"🎬 {layer} 启用截取: 从{trim_start}秒开始，截取{trim_duration}秒")
+
+        if use_exact_timing:
+            # ===== 精确定点模式 =====
+            start = max(0, min(random_timing_exact, material_duration - template_dur))
+            placements.append(LayerPlacement(layer, entry.path, start, trim_start, trim_duration))
+            print(f"🎯 {layer} {start:.2f}–{start + template_dur:.2f}s 精确定点播放（时间戳平移）")
+
+        elif use_random_timing:
+            # ===== 随机时间点模式（不限制模板时长，允许完整播放）=====
+            if advanced_timing_enabled and random_timing_mode == "range":
+                # N–M 范围随机
+                lo = max(0, min(random_timing_start, random_timing_end))
+                hi = min(max(random_timing_start, random_timing_end), material_duration)
+                start = random.uniform(lo, hi) if hi > lo else lo
+            else:
+                # 前 N 秒随机（窗口模式）
+                max_start = max(0, min(random_timing_window, material_duration))
+                start = random.uniform(0, max_start)
+            placements.append(LayerPlacement(layer, entry.path, start, trim_start, trim_duration))
+            print(f"🕒 {layer} {start:.2f}–{start + template_dur:.2f}s 随机播放（时间戳平移）")
+
+        elif template_dur >= material_duration:
+            # ===== 标准模式（长模板）：裁成素材时长或截取时长 =====
+            final_duration = min(trim_duration, material_duration)
+            placements.append(LayerPlacement(layer, entry.path, 0, trim_start, final_duration))
+            print(f"🔧 {layer} 标准模式（长模板）：从{trim_start}s开始trim到{final_duration:.2f}s")
+
+        elif clip_enabled:
+            # ===== 标准模式（短模板+截取）：按截取时长播放，不循环 =====
+            placements.append(LayerPlacement(layer, entry.path, 0, trim_start, trim_duration,
+                                             enable_until=trim_duration))
+            print(f"📹 {layer} 标准模式（短模板+截取）：从{trim_start}s开始播放{trim_duration:.2f}s")
+
+        else:
+            # ===== 标准模式（短模板）：按原时长播放，不循环 =====
+            placements.append(LayerPlacement(layer, entry.path, 0, 0, template_dur,
+                                             trim=False, enable_until=template_dur))
+            print(f"📹 {layer} 标准模式（短模板）：按原时长{template_dur:.2f}s播放，不循环")
+
+        _skip_transparent(placements[-1], getattr(entry, 'transparent_ranges', ()))
+    return placements
+
+
+def video_windows(placement: LayerPlacement):
+    """
+    叠加需要的模板视频片段 [(起点, 时长), ...]，起点和时长为None表示整段
+
+    每个片段单独作为一个带 -ss/-t 的输入，解码从片段起点附近开始，全透明部分不解码。
+    """
+    if placement.visible is not None:
+        return [(start, end - start) for start, end in placement.visible]
+    if placement.trim:
+        return [(placement.trim_start, placement.trim_duration)]
+    return [(None, None)]
+
+
+def audio_window(placement: LayerPlacement):
+    """模板音频需要的片段 (起点, 时长)，始终覆盖整个截取范围"""
+    if placement.trim:
+        return placement.trim_start, placement.trim_duration
+    return None, None
+
+
+def input_args(path, start=None, duration=None):
+    """模板输入参数，截取范围用输入级seek表达"""
+    args = []
+    if start:
+        args += ["-ss", f"{start:.3f}"]
+    if duration is not None:
+        args += ["-t", f"{duration:.3f}"]
+    return args + ["-i", path]
+
+
+def enable_window(start, duration):
+    """
+    overlay的时间门控 [start, start + duration)
+
+    窗口外overlay直接透传素材帧，不做格式转换和混合，也不再等待模板输入。
+    """
+    return f"enable='gte(t,{start:.3f})*lt(t,{start + duration:.3f})'"
+
+
+def build_overlay_filters(placements: Sequence[LayerPlacement], sources, base_video="0:v", base_audio="0:a",
+                          tag="", time_shift=0.0, graph_plan=None):
+    """
+    生成一条叠加链：模板逐层叠到素材上，模板音频按出现时间延迟后与素材混音
+
+    模板输入已按截取范围seek，时间戳归零后直接平移到出现时间，不再用trim丢弃前面的帧。
+
+    Args:
+        placements: 按叠加顺序排列的摆放方式
+        sources: 与 placements 一一对应的 ([各视频片段标签], 音频标签)，视频片段与 video_windows 对应
+        base_video / base_audio: 素材视频/音频的标签
+        tag: 标签后缀，同一滤镜图中有多条叠加链时区分
+        time_shift: 素材从该时间开始解码时，模板出现时间相应前移
+        graph_plan: graph_planner.GraphPlan，模板缩放后叠加位置同比例缩放，overlay格式固定
+
+    Returns:
+        tuple: (视频滤镜列表, 音频滤镜列表, 视频输出标签, 音频输出标签)
+    """
+    video_filters = []
+    overlay_filters = []
+    audio_filters = []
+    prev = base_video
+    vout = f"vout{tag}"
+    aout = f"aout{tag}"
+    audio_inputs = [f"[{base_audio}]"]
+    weights = ["1"]
+
+    # (片段标签, 叠加参数)，按顺序逐个叠加
+    clips = []
+    for n, (placement, (video_srcs, audio_src)) in enumerate(zip(placements, sources), start=1):
+        offset = placement.offset - time_shift
+        x, y = graph_plan.position(placement) if graph_plan is not None else (placement.x, placement.y)
+        position = f"{x}:{y}:"
+        if graph_plan is not None:
+            position += f"format={graph_plan.overlay_format}:"
+        window_start = placement.trim_start if placement.trim else 0
+        windows = video_windows(placement)
+        for i, ((seg_start, seg_duration), src) in enumerate(zip(windows, video_srcs)):
+            clip = f"clip{n}{tag}" if len(windows) == 1 else f"clip{n}s{i}{tag}"
+            # 可见片段按它在模板中的位置平移时间戳
+            seg_offset = offset + (seg_start or 0) - window_start
+            setpts = f"setpts=PTS-STARTPTS+{seg_offset:.3f}/TB" if seg_offset else "setpts=PTS-STARTPTS"
+            video_filters.append(f"[{src}]{setpts}[{clip}]")
+            if seg_duration is None:
+                # 标准模式短模板整段播放，可见时长即模板时长
+                seg_duration = placement.enable_until if placement.enable_until is not None else placement.trim_duration
+            clips.append((clip, position + enable_window(seg_offset, seg_duration) + ":"))
+
+        # 输入已seek到截取起点，归零时戳后需要延后出现时补前置静音
+        line = f"[{audio_src}]asetpts=PTS-STARTPTS"
+        trim_end = placement.trim_start + placement.trim_duration
+        if offset > 0:
+            line += f",adelay={int(round(offset * 1000))}:all=1"
+            print(f"🎵 {placement.layer} 音频：裁切{placement.trim_start}-{trim_end}s，延迟{offset:.2f}s")
+        else:
+            print(f"🎵 {placement.layer} 音频：裁切{placement.trim_start}-{trim_end}s，无延迟")
+        audio_filters.append(line + f"[a{n}{tag}]")
+        audio_inputs.append(f"[a{n}{tag}]")
+        weights.append(f"{placement.audio_weight:g}")
+
+    for n, (clip, params) in enumerate(clips, start=1):
+        dst = vout if n == len(clips) else f"tmp{n}{tag}"
+        overlay_filters.append(f"[{prev}][{clip}]overlay={params}eof_action=pass[{dst}]")
+        prev = dst
+    if not clips:
+        # 所有模板在素材范围内都全透明，只混音
+        overlay_filters.append(f"[{base_video}]null[{vout}]")
+
+    # 素材和模板音频平衡混合，时长以素材为准
+    audio_filters.append("".join(audio_inputs) +
+                         f"amix=inputs={len(audio_inputs)}:duration=first:weights={' '.join(weights)}[{aout}]")
+    return video_filters + overlay_filters, audio_filters, vout, aout
+
+
+def _window_key(path, start, duration):
+    return (path,
+            round(start, 3) if start else None,
+            round(duration, 3) if duration is not None else None)
+
+
+def build_layered_command(material_path, variants: Sequence[Sequence[LayerPlacement]], outputs: Sequence[str],
+                          output_args: Sequence[str], duration, material_seek: Optional[Tuple[float, float]] = None,
+                          time_shift=0.0, graph_plan=None):
+    """
+    构建一条ffmpeg命令：素材只解码一次，split后每个变体一条叠加链，写出多个文件
+
+    模板按 (文件, 截取起点, 时长) 作为输入，起点和时长用输入级 -ss/-t 表达；
+    同一片段被多处使用时只作为一个输入解码，再split给各条叠加链。
+
+    Args:
+        variants: 每个变体的摆放方式列表
+        outputs: 与 variants 一一对应的输出路径
+        output_args: 每个输出使用的编码参数
+        duration: 输出时长
+        material_seek: (起点, 时长)，只解码素材的这一段（输入级seek）
+        graph_plan: graph_planner.GraphPlan，素材和各模板输入在split之前先做帧率、缩放和像素格式转换
+
+    Returns:
+        tuple: (命令列表, filter_complex字符串)
+    """
+    cmd = ["ffmpeg", "-threads", "0"]
+    if material_seek is not None:
+        cmd += ["-ss", f"{material_seek[0]:.6f}", "-t", f"{material_seek[1]:.6f}"]
+    cmd += ["-i", material_path]
+
+    # 统计每个模板片段的视频/音频使用次数，相同片段只作为一个输入
+    video_uses = Counter()
+    audio_uses = Counter()
+    input_index: Dict[tuple, int] = {}
+
+    def register(key):
+        if key not in input_index:
+            input_index[key] = len(input_index) + 1
+            cmd.extend(input_args(*key))
+
+    for placements in variants:
+        for p in placements:
+            for start, length in video_windows(p):
+                key = _window_key(p.template_path, start, length)
+                register(key)
+                video_uses[key] += 1
+            key = _window_key(p.template_path, *audio_window(p))
+            register(key)
+            audio_uses[key] += 1
+
+    filters = []
+    video_labels = {}
+    for key, k in input_index.items():
+        video_labels[key] = f"{k}:v"
+        branch = graph_plan.branch_filters(key[0]) if graph_plan is not None and video_uses[key] else []
+        if branch:
+            # 尽早转换：每个输入只做一次，再split给各处使用
+            video_labels[key] = f"p{k}"
+            filters.append(f"[{k}:v]{','.join(branch)}[p{k}]")
+        if video_uses[key] > 1:
+            filters.append(f"[{video_labels[key]}]split={video_uses[key]}" +
+                           "".join(f"[t{k}v{i}]" for i in range(video_uses[key])))
+        if audio_uses[key] > 1:
+            filters.append(f"[{k}:a]asplit={audio_uses[key]}" + "".join(f"[t{k}a{i}]" for i in range(audio_uses[key])))
+
+    taken = Counter()
+
+    def source(key, kind):
+        k = input_index[key]
+        uses = video_uses if kind == "v" else audio_uses
+        if uses[key] == 1:
+            return video_labels[key] if kind == "v" else f"{k}:a"
+        i = taken[key, kind]
+        taken[key, kind] += 1
+        return f"t{k}{kind}{i}"
+
+    single = len(variants) == 1
+    material_filters = ",".join(graph_plan.material_filters) + "," if graph_plan is not None and graph_plan.material_filters else ""
+    base_video = "0:v"
+    if single and material_filters:
+        base_video = "base"
+        filters.append(f"[0:v]{material_filters[:-1]}[base]")
+    if not single:
+        filters.append(f"[0:v]{material_filters}split={len(variants)}" + "".join(f"[base{j}]" for j in range(len(variants))))
+        filters.append(f"[0:a]asplit={len(variants)}" + "".join(f"[abase{j}]" for j in range(len(variants))))
+
+    maps = []
+    audio_filters = []
+    for j, placements in enumerate(variants):
+        sources = [
+            ([source(_window_key(p.template_path, start, length), "v") for start, length in video_windows(p)],
+             source(_window_key(p.template_path, *audio_window(p)), "a"))
+            for p in placements
+        ]
+        if single:
+            video, audio, vout, aout = build_overlay_filters(placements, sources, base_video=base_video,
+                                                             time_shift=time_shift, graph_plan=graph_plan)
+        else:
+            video, audio, vout, aout = build_overlay_filters(
+                placements, sources, base_video=f"base{j}", base_audio=f"abase{j}", tag=f"_{j}",
+                time_shift=time_shift, graph_plan=graph_plan)
+        filters += video
+        audio_filters += audio
+        maps.append((vout, aout))
+
+    filter_complex = ";".join(filters + audio_filters)
+    cmd += ["-filter_complex", filter_complex, "-y"]
+    for (vout, aout), output in zip(maps, outputs):
+        cmd += ["-map", f"[{vout}]", "-map", f"[{aout}]"] + list(output_args) + ["-t", str(duration), output]
+    return cmd, filter_complex
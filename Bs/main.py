@@ -19,9 +19,26 @@ from typing import List, Dict, Optional
 import cv2
 from PIL import Image
 import numpy as np
-from utils import get_video_duration, check_video_has_alpha, compress_alpha_template, batch_compress_alpha_templates
+from utils import (get_video_duration, check_video_has_alpha, compress_alpha_template, batch_compress_alpha_templates,
+                   validate_video_file, probe_media, probe_media_cached, read_mp4_header,
+                   check_ffmpeg_installed)
 from config.config import Config
 from ffmpeg_processor import FFmpegProcessor
+from media_cache import configure_media_cache, get_media_cache
+from template_catalog import get_template_catalog, invalidate_template_catalog
+from media_index import MediaIndex
+from probe_service import configure_probe_service, get_probe_service
+from layer_graph import plan_layer_placements, build_layered_command
+from precomposite import plan_batch_precomposite
+from template_crop import crop_placements
+from graph_planner import plan_graph, describe_graph
+import numpy_compositor
+from frame_store import configure_frame_store, get_frame_store
+from process_supervisor import configure_supervisor, get_supervisor
+from retry_policy import RetryPolicy
+from smart_render import (plan_for_material as smart_render_plan_for_material,
+                          output_args as smart_render_output_args,
+                          assemble as smart_render_assemble)
 
 # 设置Gradio环境变量
 os.environ["GRADIO_ANALYTICS_ENABLED"] = "False"
@@ -46,15 +63,48 @@ ALPHA_TEMPLATES_DIR = BASE_DIR / Config.ALPHA_TEMPLATES_DIR
 RESOLUTION_CONVERTED_DIR = BASE_DIR / Config.RESOLUTION_CONVERTED_DIR
 TRIMMED_DIR = BASE_DIR / Config.TRIMMED_DIR
 SEGMENTS_DIR = BASE_DIR / Config.SEGMENTS_DIR
+# 预合成模板等临时中间文件，用到时才创建
+PRECOMPOSITE_DIR = BASE_DIR / Config.PRECOMPOSITE_DIR
+CROPPED_TEMPLATE_DIR = BASE_DIR / Config.CROPPED_TEMPLATE_DIR
+TEMPLATE_FRAME_STORE_DIR = BASE_DIR / Config.TEMPLATE_FRAME_STORE_DIR
 
-# 确保目录存在
-for d in [MATERIAL_DIR, OUTPUT_DIR, ALPHA_TEMPLATES_DIR, RESOLUTION_CONVERTED_DIR, TRIMMED_DIR, SEGMENTS_DIR]:
-    os.makedirs(d, exist_ok=True)
-for layer in ['top_layer', 'middle_layer', 'bottom_layer']:
-    os.makedirs(os.path.join(ALPHA_TEMPLATES_DIR, layer), exist_ok=True)
+# 目录内存索引，界面刷新和素材路径解析不再重复 listdir；
+# 数据目录在索引首次扫描时（启动后的后台线程里）才创建，导入和启动界面时不触碰磁盘
+MATERIAL_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi")
+media_index = MediaIndex(
+    dirs={
+        'material': MATERIAL_DIR,
+        'resolution': RESOLUTION_CONVERTED_DIR,
+        'trimmed': TRIMMED_DIR,
+        'segments': SEGMENTS_DIR,
+        'output': OUTPUT_DIR,
+        'top_layer': os.path.join(ALPHA_TEMPLATES_DIR, 'top_layer'),
+        'middle_layer': os.path.join(ALPHA_TEMPLATES_DIR, 'middle_layer'),
+        'bottom_layer': os.path.join(ALPHA_TEMPLATES_DIR, 'bottom_layer'),
+    },
+    extensions={
+        'material': MATERIAL_EXTENSIONS,
+        'resolution': MATERIAL_EXTENSIONS,
+        'trimmed': MATERIAL_EXTENSIONS,
+        'segments': MATERIAL_EXTENSIONS,
+        'output': VIDEO_EXTENSIONS,
+        'top_layer': VIDEO_EXTENSIONS,
+        'middle_layer': VIDEO_EXTENSIONS,
+        'bottom_layer': VIDEO_EXTENSIONS,
+    },
+    create_dirs=True
+)
+
+# 素材加工面板的来源标签 -> 索引键
+PROCESSING_SOURCES = [
+    ("[原始]", 'material'),
+    ("[分辨率转换]", 'resolution'),
+    ("[结尾裁剪]", 'trimmed'),
+    ("[视频切分]", 'segments'),
+]
+PROCESSING_SOURCE_KEYS = dict(PROCESSING_SOURCES)
 
-# 全局FFmpeg处理器实例
-global_ffmpeg_processor = FFmpegProcessor(max_retries=3, timeout=300)
 processing_cancelled = False
 
 # 全局进度状态
@@ -66,18 +116,26 @@ processing_status = {
     'results': [],
     'errors': [],
     'start_time': None,
+    'jobs': {},  # {输出文件名: ffmpeg编码统计}
     'end_time': None
 }
 
 # 参数预设功能
 PRESETS_FILE = os.path.join(BASE_DIR, "config", "presets.json")
 
+# 媒体元数据缓存，未变化的文件不再重复调用ffprobe
+MEDIA_CACHE_FILE = os.path.join(BASE_DIR, "config", Config.MEDIA_CACHE_DB)
+configure_media_cache(MEDIA_CACHE_FILE)
+configure_probe_service(max_concurrent=Config.PROBE_MAX_CONCURRENT, probe_timeout=Config.PROBE_TIMEOUT)
+configure_frame_store(str(TEMPLATE_FRAME_STORE_DIR), max_bytes=Config.TEMPLATE_FRAME_STORE_MAX_MB << 20)
+configure_supervisor(kill_grace=Config.PROCESS_KILL_GRACE)
+
 # ========== UI辅助函数 ========== #
 
 def list_materials():
     """获取所有素材视频文件名列表"""
     try:
-        return [f for f in os.listdir(MATERIAL_DIR) if f.lower().endswith((".mp4", ".mov", ".avi", ".mkv"))]
+        return media_index.names('material')
     except Exception as e:
         print(f"获取素材列表失败: {e}")
         return []
@@ -87,7 +145,7 @@ def list_materials_from_dir(directory):
     try:
         if not os.path.exists(directory):
             return []
-        return [f for f in os.listdir(directory) if f.lower().endswith((".mp4", ".mov", ".avi", ".mkv"))]
+        return [f for f in os.listdir(directory) if f.lower().endswith(MATERIAL_EXTENSIONS)]
     except Exception as e:
         print(f"获取目录 {directory} 素材列表失败: {e}")
         return []
@@ -96,21 +154,10 @@ def list_all_processing_materials():
     """获取所有处理文件夹的素材列表"""
     all_materials = []
     
-    # 原始素材
-    original_materials = [(f"[原始] {f}", f, str(MATERIAL_DIR)) for f in list_materials_from_dir(MATERIAL_DIR)]
-    all_materials.extend(original_materials)
-    
-    # 分辨率转换后的素材
-    resolution_materials = [(f"[分辨率转换] {f}", f, str(RESOLUTION_CONVERTED_DIR)) for f in list_materials_from_dir(RESOLUTION_CONVERTED_DIR)]
-    all_materials.extend(resolution_materials)
-    
-    # 裁剪后的素材
-    trimmed_materials = [(f"[结尾裁剪] {f}", f, str(TRIMMED_DIR)) for f in list_materials_from_dir(TRIMMED_DIR)]
-    all_materials.extend(trimmed_materials)
-    
-    # 切分后的素材
-    segment_materials = [(f"[视频切分] {f}", f, str(SEGMENTS_DIR)) for f in list_materials_from_dir(SEGMENTS_DIR)]
-    all_materials.extend(segment_materials)
+    # 原始素材、分辨率转换、结尾裁剪、视频切分
+    for label, key in PROCESSING_SOURCES:
+        folder_path = media_index.dirs[key]
+        all_materials.extend((f"{label} {f}", f, folder_path) for f in media_index.names(key))
     
     return all_materials
 
@@ -121,14 +168,15 @@ def get_material_choices_for_processing():
 
 def resolve_material_path(selected_materials):
     """解析选中的素材，返回实际文件路径列表"""
-    all_materials = list_all_processing_materials()
-    material_map = {display_name: (filename, folder_path) for display_name, filename, folder_path in all_materials}
-    
     resolved_paths = []
     for selected in selected_materials:
-        if selected in material_map:
-            filename, folder_path = material_map[selected]
-            full_path = os.path.join(folder_path, filename)
+        # 显示名格式为 "[来源] 文件名"，按标签直接查索引
+        label, _, filename = selected.partition(' ')
+        key = PROCESSING_SOURCE_KEYS.get(label)
+        if key is None:
+            continue
+        full_path = media_index.lookup(key, filename)
+        if full_path:
             resolved_paths.append(full_path)
     
     return resolved_paths
@@ -136,10 +184,7 @@ def resolve_material_path(selected_materials):
 def list_templates(layer):
     """获取指定层级的模板文件名列表"""
     try:
-        layer_dir = os.path.join(ALPHA_TEMPLATES_DIR, layer)
-        if not os.path.exists(layer_dir):
-            return []
-        return [f for f in os.listdir(layer_dir) if f.lower().endswith((".mp4", ".mov", ".avi"))]
+        return media_index.names(layer)
     except Exception as e:
         print(f"获取模板列表失败: {e}")
         return []
@@ -170,19 +215,14 @@ def emergency_stop():
     processing_cancelled = True
     
     try:
-        # 取消当前处理器的进程
-        cancelled = global_ffmpeg_processor.cancel_current_process()
-        
-        # 清理所有卡住的FFmpeg进程
-        killed_count = global_ffmpeg_processor.kill_stuck_ffmpeg_processes()
+        # 子进程登记处里的全部进程：合成编码、预处理、NumPy解码/编码、模板帧解码和ffprobe
+        stopped = get_supervisor().cancel_all()
         
         message = "🛑 紧急停止执行完成\n"
-        if cancelled:
-            message += "✅ 已取消当前FFmpeg进程\n"
-        if killed_count > 0:
-            message += f"🧹 清理了 {killed_count} 个卡住的FFmpeg进程\n"
+        if stopped > 0:
+            message += f"✅ 已停止 {stopped} 个FFmpeg进程\n"
         else:
-            message += "ℹ️ 未发现卡住的FFmpeg进程\n"
+            message += "ℹ️ 没有正在运行的FFmpeg进程\n"
             
         return message
         
@@ -193,6 +233,7 @@ def reset_processing_state():
     """重置处理状态"""
     global processing_cancelled
     processing_cancelled = False
+    get_supervisor().reset()
     return "✅ 处理状态已重置"
 
 def save_preset(name, preset_data):
@@ -287,7 +328,7 @@ def generate_video_thumbnail(video_path, timestamp=1.0):
             ]
             
             # 执行命令
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=10)
+            result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=10)
             
             if result.returncode != 0:
                 print(f"FFmpeg提取帧失败: {result.stderr}")
@@ -366,27 +407,22 @@ def upload_template(file, layer):
         # NamedString对象，直接复制文件
         import shutil
         shutil.copy2(file.name, target)
+    media_index.touch(target)
+    invalidate_template_catalog()
     return f"✅ 已上传 {filename} 到 {layer}"
 
 # 视频预览和下载功能
 def list_output_videos():
     """列出输出目录中的所有视频文件"""
     try:
-        if not os.path.exists(OUTPUT_DIR):
-            return []
-        
-        video_files = []
-        for file in os.listdir(OUTPUT_DIR):
-            if file.lower().endswith(('.mp4', '.mov', '.avi')):
-                video_files.append(file)
-        
-        return sorted(video_files, key=lambda x: os.path.getmtime(os.path.join(OUTPUT_DIR, x)), reverse=True)
+        # 索引中已记录mtime，排序时无需逐个stat
+        return media_index.names('output', order='mtime')
     except Exception as e:
         print(f"列出输出视频失败: {str(e)}")
         return []
 
-def get_video_preview_and_info(video_name):
-    """获取视频预览和信息"""
+async def get_video_preview_and_info(video_name):
+    """获取视频预览和信息（异步，探测不阻塞事件处理线程）"""
     if not video_name:
         return None, ""
     
@@ -396,15 +432,15 @@ def get_video_preview_and_info(video_name):
     
     try:
         # 获取视频信息
-        file_size = os.path.getsize(video_path)
-        file_size_mb = file_size / (1024 * 1024)
+        st = os.stat(video_path)
+        file_size_mb = st.st_size / (1024 * 1024)
         
-        # 获取视频时长
-        duration = get_video_duration(video_path)
+        # 获取视频时长，ffprobe由全局探测服务限流并合并重复请求
+        duration = await get_probe_service().duration(video_path, timeout=Config.PROBE_TIMEOUT)
         duration_str = f"{duration:.1f}秒" if duration else "未知"
         
         # 获取修改时间
-        mtime = os.path.getmtime(video_path)
+        mtime = st.st_mtime
         mtime_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
         
         info_text = f"文件大小: {file_size_mb:.1f} MB\n时长: {duration_str}\n创建时间: {mtime_str}"
@@ -424,6 +460,7 @@ def delete_output_video(video_name):
     
     try:
         os.remove(video_path)
+        media_index.touch(video_path)
         # 刷新视频列表
         new_choices = list_output_videos()
         return f"✅ 已删除视频: {video_name}", gr.update(choices=new_choices, value=None)
@@ -445,6 +482,34 @@ def randomize_timing_params():
 
 def get_video_info(video_path):
     """获取视频信息"""
+    # MP4/MOV 直接读文件头，其他容器再调用ffprobe
+    info = read_mp4_header(video_path)
+    if info is not None and info.video is not None:
+        return {
+            'width': info.width,
+            'height': info.height,
+            'fps': info.fps,
+            'duration': info.duration,
+            'frame_count': info.frame_count
+        }
+    
+    if check_ffmpeg_installed():
+        try:
+            info = probe_media_cached(video_path)
+            if info.video is None:
+                return None
+            return {
+                'width': info.width,
+                'height': info.height,
+                'fps': info.fps,
+                'duration': info.duration or 0,
+                'frame_count': info.frame_count
+            }
+        except Exception as e:
+            print(f"获取视频信息失败: {e}")
+            return None
+    
+    # 未安装FFmpeg时回退到OpenCV
     try:
         import cv2
         cap = cv2.VideoCapture(video_path)
@@ -476,6 +541,8 @@ def crop_and_scale_video(materials, output_path, crop_x, crop_y, crop_width, cro
         return "❌ 请选择要处理的素材"
     
     results = []
+    # 数据目录只在索引首次扫描时创建，不经界面调用时这里补上
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     
     try:
         for material in materials:
@@ -517,9 +584,10 @@ def crop_and_scale_video(materials, output_path, crop_x, crop_y, crop_width, cro
             ])
             
             # 执行命令
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
+            result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
             
             if result.returncode == 0:
+                media_index.touch(output_full_path)
                 results.append(f"✅ 处理完成: {output_filename}")
             else:
                 results.append(f"❌ 处理失败 {material}: {result.stderr}")
@@ -535,6 +603,7 @@ def batch_resolution_convert(materials, resolution="1080p", mode="stretch", pres
         return "❌ 请选择要处理的素材"
     
     results = []
+    os.makedirs(RESOLUTION_CONVERTED_DIR, exist_ok=True)
     
     # 根据分辨率设置目标尺寸
     if resolution == "720p":
@@ -619,9 +688,10 @@ def batch_resolution_convert(materials, resolution="1080p", mode="stretch", pres
                 output_path
             ])
             
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
+            result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
             
             if result.returncode == 0:
+                media_index.touch(output_path)
                 results.append(f"✅ {material_name} -> {output_filename}")
             else:
                 results.append(f"❌ {material_name}: {result.stderr[:100]}")
@@ -642,12 +712,12 @@ def trim_video_ending(materials, trim_seconds, preset="veryfast", crf=23):
         return "❌ 请选择要处理的素材"
     
     results = []
+    os.makedirs(TRIMMED_DIR, exist_ok=True)
     
-    for material in materials:
+    # 一次性解析全部选中素材，索引查找为O(1)
+    for material_path in resolve_material_path(materials):
+        material_name = os.path.basename(material_path)
         try:
-            # 解析素材路径
-            material_path, material_name = resolve_material_path([material])[0]
-            
             if not os.path.exists(material_path):
                 results.append(f"❌ {material_name}: 文件不存在")
                 continue
@@ -687,9 +757,10 @@ def trim_video_ending(materials, trim_seconds, preset="veryfast", crf=23):
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = get_supervisor().run(cmd, capture_output=True, text=True, timeout=300)
             
             if result.returncode == 0:
+                media_index.touch(output_path)
                 results.append(f"✅ {material_name} -> {output_filename} (删除{trim_seconds}秒)")
             else:
                 results.append(f"❌ {material_name}: {result.stderr[:100]}")
@@ -705,12 +776,12 @@ def split_video_segments(materials, segment_min=30, segment_max=90, preset="very
         return "❌ 请选择要处理的素材"
     
     results = []
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
     
-    for material in materials:
+    # 一次性解析全部选中素材，索引查找为O(1)
+    for material_path in resolve_material_path(materials):
+        material_name = os.path.basename(material_path)
         try:
-            # 解析素材路径
-            material_path, material_name = resolve_material_path([material])[0]
-            
             if not os.path.exists(material_path):
                 results.append(f"❌ {material_name}: 文件不存在")
                 continue
@@ -764,9 +835,10 @@ def split_video_segments(materials, segment_min=30, segment_max=90, preset="very
                     output_path
                 ]
                 
-                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
+                result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=300)
                 
                 if result.returncode == 0:
+                    media_index.touch(output_path)
                     segment_results.append(f"  ✅ 段{seg_num}: {start_time:.1f}s-{end_time:.1f}s -> {output_filename}")
                 else:
                     segment_results.append(f"  ❌ 段{seg_num}: 处理失败")
@@ -781,25 +853,6 @@ def split_video_segments(materials, segment_min=30, segment_max=90, preset="very
 
 # ========== 核心处理函数 ========== #
 
-def validate_video_file(video_path):
-    """验证视频文件完整性和可读性"""
-    try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration,format_name',
-             '-of', 'default=noprint_wrappers=1', video_path],
-            capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True
-        )
-        lines = result.stdout.splitlines()
-        has_format = any('format_name=' in l for l in lines)
-        has_duration = any('duration=' in l for l in lines)
-        if not has_format:
-            return False, "文件格式无法识别"
-        if not has_duration:
-            return False, "无法获取文件时长信息"
-        return True, "文件验证通过"
-    except Exception as e:
-        return False, f"验证过程出错: {e}"
-
 def sanitize_filename(filepath):
     name = os.path.basename(filepath)
     base, ext = os.path.splitext(name)
@@ -872,6 +925,32 @@ def update_progress(current, total, current_file, result=None, error=None):
     if error:
         processing_status['errors'].append(error)
 
+def _record_job_stats(job, stats):
+    """把ffmpeg -progress 的编码统计写入 processing_status，供界面显示和容量估算"""
+    jobs = processing_status.setdefault('jobs', {})
+    jobs[job] = {
+        **jobs.get(job, {}),
+        'progress': stats.percent,
+        'frame': stats.frame,
+        'fps': stats.fps,
+        'speed': stats.speed,
+        'out_time': stats.out_time,
+        'total_size': stats.total_size,
+        'done': stats.done,
+    }
+
+
+def get_encode_stats_summary():
+    """正在编码的任务数、总编码帧率和总倍速，没有任务时返回空字符串"""
+    running = [job for job in list(processing_status.get('jobs', {}).values())
+               if 'fps' in job and not job['done']]
+    if not running:
+        return ""
+    fps = sum(job['fps'] for job in running)
+    speed = sum(job['speed'] for job in running)
+    return f"⚡ {len(running)}路编码 {fps:.1f}fps {speed:.2f}x"
+
+
 def get_simple_progress_status():
     """获取简化的进度状态"""
     global processing_status
@@ -879,7 +958,8 @@ def get_simple_progress_status():
         if processing_status['current'] > 0:
             return f"✅ 处理完成 ({processing_status['current']}/{processing_status['total']})"
         return "⏸️ 等待开始"
-    return f"🔄 处理中 ({processing_status['current']}/{processing_status['total']})"
+    summary = get_encode_stats_summary()
+    return f"🔄 处理中 ({processing_status['current']}/{processing_status['total']})" + (f" {summary}" if summary else "")
 
 def format_time(seconds):
     """格式化时间显示"""
@@ -900,7 +980,7 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
                         exact_timing_enabled, top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
                         middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
                         bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration,
-                        preset, crf, audio_bitrate, max_workers):
+                        preset, crf, audio_bitrate, max_workers, smart_render=False, variants_per_material=1):
     """批量处理视频"""
     global processing_status, processing_cancelled
     
@@ -936,6 +1016,8 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
     
     # 重置状态
     processing_cancelled = False
+    get_supervisor().reset()
+    batch_id = f"batch-{time.time():.3f}"
     processing_status = {
         'current': 0,
         'total': len(materials),
@@ -944,7 +1026,8 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
         'results': [],
         'errors': [],
         'start_time': time.time(),
-        'end_time': None
+        'end_time': None,
+        'jobs': {}
     }
     
     if not materials:
@@ -964,8 +1047,38 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
         processing_status['is_processing'] = False
         return "❌ 请至少选择一个模板"
     
+    # 整个批次共享一份模板目录快照，避免每个素材重复扫描和探测模板
+    template_catalog = get_template_catalog(template_dirs, clean_filename=ensure_clean_filename)
+    if not template_catalog:
+        processing_status['is_processing'] = False
+        return "❌ 未找到有效的模板文件"
+    
     results = []
     
+    # 一次批量查询预热元数据缓存，已见过的素材不再启动ffprobe
+    get_media_cache().get_many([os.path.join(MATERIAL_DIR, m) for m in materials])
+    
+    # 标准/定点模式下每个素材叠加的模板和时间都相同时，多层模板只预合成一次
+    precomposite = None
+    if Config.PRECOMPOSITE_LAYERS:
+        material_durations = [get_video_duration(os.path.join(MATERIAL_DIR, m)) for m in materials]
+        precomposite = plan_batch_precomposite(
+            template_catalog,
+            [layer for layer in template_dirs if template_catalog.entries(layer)],
+            [d for d in material_durations if d],
+            str(PRECOMPOSITE_DIR),
+            alpha_clips=_alpha_clip_settings(
+                top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
+                middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
+                bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration
+            ),
+            keep=Config.PRECOMPOSITE_CACHE_FILES,
+            random_timing=random_timing_enabled, random_timing_window=random_timing_window,
+            random_timing_mode=random_timing_mode, random_timing_start=random_timing_start,
+            random_timing_end=random_timing_end, random_timing_exact=random_timing_exact,
+            exact_timing_enabled=exact_timing_enabled, advanced_timing_enabled=advanced_timing_enabled
+        )
+    
     try:
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # 提交所有任务
@@ -983,7 +1096,12 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
                     top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
                     middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
                     bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration,
-                    i + 1
+                    i + 1,
+                    template_catalog=template_catalog,
+                    smart_render=smart_render,
+                    variants=variants_per_material,
+                    precomposite=precomposite,
+                    batch_id=batch_id
                 )
                 future_to_material[future] = material
             
@@ -1022,6 +1140,8 @@ def process_batch_with_features(materials, top_template, middle_template, bottom
         total_time = processing_status['end_time'] - processing_status['start_time']
         final_report += f"⏱️ 总耗时: {format_time(total_time)}\n"
     
+    cache_stats = get_media_cache().stats()
+    final_report += f"🗂️ 元数据缓存: 命中 {cache_stats['hits']} 次，ffprobe调用 {cache_stats['probes']} 次\n"
     final_report += f"📁 输出目录: {OUTPUT_DIR}\n\n"
     final_report += "详细结果:\n" + "\n".join(results)
     
@@ -1034,7 +1154,8 @@ def process_single_video_wrapper(material, template_dirs, preset, crf, audio_bit
                                 top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
                                 middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
                                 bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration,
-                                task_number):
+                                task_number, template_catalog=None, smart_render=False, variants=1,
+                                precomposite=None, batch_id=None):
     """单个视频处理包装器"""
     global processing_cancelled
     
@@ -1043,411 +1164,92 @@ def process_single_video_wrapper(material, template_dirs, preset, crf, audio_bit
         return f"🛑 {material} 处理已取消"
     
     try:
-        material_path = os.path.join(MATERIAL_DIR, material)
-        
-        # 验证素材文件是否存在
-        if not os.path.exists(material_path):
-            return f"❌ {material} 文件不存在"
-        
-        # 验证模板文件是否存在
-        valid_templates = {}
-        for layer, template_dir in template_dirs.items():
-            if os.path.exists(template_dir):
-                template_files = [f for f in os.listdir(template_dir) if f.endswith(('.mp4', '.mov', '.avi'))]
-                if template_files:
-                    valid_templates[layer] = template_dir
-        
-        if not valid_templates:
-            return f"❌ {material} 未找到有效的模板文件"
-        
-        # 定义进度回调函数
-        def progress_callback(message):
-            if processing_cancelled:
-                return
-            print(f"[{material}] {message}")
-        
-        # 调用处理函数
-        process_video_with_layers(
-            material_path,
-            valid_templates,
-            OUTPUT_DIR,
-            progress_callback=progress_callback,
-            random_timing=random_timing_enabled,
-            random_timing_window=random_timing_window,
-            random_timing_mode=random_timing_mode,
-            random_timing_start=random_timing_start,
-            random_timing_end=random_timing_end,
-            random_timing_exact=random_timing_exact,
-            exact_timing_enabled=exact_timing_enabled,
-            advanced_timing_enabled=advanced_timing_enabled,
-            top_alpha_clip_enabled=top_alpha_clip_enabled,
-            top_alpha_clip_start=top_alpha_clip_start,
-            top_alpha_clip_duration=top_alpha_clip_duration,
-            middle_alpha_clip_enabled=middle_alpha_clip_enabled,
-            middle_alpha_clip_start=middle_alpha_clip_start,
-            middle_alpha_clip_duration=middle_alpha_clip_duration,
-            bottom_alpha_clip_enabled=bottom_alpha_clip_enabled,
-            bottom_alpha_clip_start=bottom_alpha_clip_start,
-            bottom_alpha_clip_duration=bottom_alpha_clip_duration,
-            preset=preset,
-            crf=crf,
-            audio_bitrate=audio_bitrate
-        )
+        # 这个素材启动的所有子进程记在 素材/批次 名下，停止批次时一并结束
+        with get_supervisor().scope(job=material, batch=batch_id):
+            material_path = os.path.join(MATERIAL_DIR, material)
+        
+            # 验证素材文件是否存在
+            if not os.path.exists(material_path):
+                return f"❌ {material} 文件不存在"
         
-        return f"✅ {material} 处理完成"
+            # 验证模板文件是否存在（使用批次共享的模板快照）
+            if template_catalog is None:
+                template_catalog = get_template_catalog(template_dirs, clean_filename=ensure_clean_filename)
+            valid_templates = {layer: template_dir for layer, template_dir in template_dirs.items()
+                               if template_catalog.entries(layer)}
+        
+            if not valid_templates:
+                return f"❌ {material} 未找到有效的模板文件"
+        
+            # 定义进度回调函数
+            def progress_callback(message):
+                if processing_cancelled:
+                    return
+                print(f"[{material}] {message}")
+        
+            # 调用处理函数
+            result = process_video_with_layers(
+                material_path,
+                valid_templates,
+                OUTPUT_DIR,
+                progress_callback=progress_callback,
+                random_timing=random_timing_enabled,
+                random_timing_window=random_timing_window,
+                random_timing_mode=random_timing_mode,
+                random_timing_start=random_timing_start,
+                random_timing_end=random_timing_end,
+                random_timing_exact=random_timing_exact,
+                exact_timing_enabled=exact_timing_enabled,
+                advanced_timing_enabled=advanced_timing_enabled,
+                top_alpha_clip_enabled=top_alpha_clip_enabled,
+                top_alpha_clip_start=top_alpha_clip_start,
+                top_alpha_clip_duration=top_alpha_clip_duration,
+                middle_alpha_clip_enabled=middle_alpha_clip_enabled,
+                middle_alpha_clip_start=middle_alpha_clip_start,
+                middle_alpha_clip_duration=middle_alpha_clip_duration,
+                bottom_alpha_clip_enabled=bottom_alpha_clip_enabled,
+                bottom_alpha_clip_start=bottom_alpha_clip_start,
+                bottom_alpha_clip_duration=bottom_alpha_clip_duration,
+                preset=preset,
+                crf=crf,
+                audio_bitrate=audio_bitrate,
+                template_catalog=template_catalog,
+                smart_render=smart_render,
+                variants=variants,
+                precomposite=precomposite
+            )
+        
+            if not result:
+                return f"❌ {material} 处理失败"
+            if result.get('variants'):
+                # 逐个变体报告结果，部分失败时整个素材计为失败
+                lines = [f"{'✅' if v['success'] else '❌'} 变体{v['variant']}: {v['message']}" for v in result['variants']]
+                status = "✅" if all(v['success'] for v in result['variants']) else "❌"
+                return f"{status} {material} {result['message']}\n    " + "\n    ".join(lines)
+            if not result.get('success'):
+                return f"❌ {material} 处理失败: {result.get('message', '')}"
+            return f"✅ {material} 处理完成"
         
     except Exception as e:
         return f"❌ {material} 处理失败: {str(e)}"
 
 
-def process_video_with_layers(material_path, template_dirs, output_dir,
-                              force_template=None, progress_callback=None,
-                              random_timing=False, random_timing_window=40,
-                              random_timing_mode="before_window", random_timing_start=0, random_timing_end=40, random_timing_exact=0,
-                              exact_timing_enabled=False, advanced_timing_enabled=False,
-                              top_alpha_clip_enabled=False, top_alpha_clip_start=0, top_alpha_clip_duration=5,
-                              middle_alpha_clip_enabled=False, middle_alpha_clip_start=0, middle_alpha_clip_duration=5,
-                              bottom_alpha_clip_enabled=False, bottom_alpha_clip_start=0, bottom_alpha_clip_duration=5,
-                              preset="veryfast", crf=25, audio_bitrate=192):
-    material_duration = get_video_duration(material_path)
-    if not material_duration:
-        print(f"无法获取素材时长：{material_path}")
-        return
-    
-    # 收集并验证模板
-    valid = {}
-    for layer, d in template_dirs.items():
-        if os.path.isdir(d):
-            for f in os.listdir(d):
-                if f.lower().endswith(('.mp4','.mov','.avi')):
-                    path = ensure_clean_filename(os.path.join(d, f))
-                    ok, msg = validate_video_file(path)
-                    if ok:
-                        valid.setdefault(layer, []).append(path)
-    if not valid:
-        print("❌ 未找到可用模板")
-        return
-    
-    # 随机/指定模板
-    chosen = {}
-    for layer, paths in valid.items():
-        if force_template:
-            pts = [p for p in paths if force_template in os.path.basename(p)]
-            chosen[layer] = pts[0] if pts else random.choice(paths)
-        else:
-            chosen[layer] = random.choice(paths)
-        print(f"{layer} 使用模板: {os.path.basename(chosen[layer])}")
-    
-    # 构建命令
-    cmd = ["ffmpeg", "-threads", "0", "-i", material_path]
-    idx = 1
-    filter_parts = []
-    overlay_parts = []
-    order = ['bottom_layer','middle_layer','top_layer']
-    
-    # --------------- 判断该走哪条分支 --------------
-    # 精确定点模式优先级最高，其次是随机模式，最后是标准覆盖模式
-    use_exact_timing = exact_timing_enabled
-    use_random_timing = (random_timing or advanced_timing_enabled) and not exact_timing_enabled
-    use_standard_mode = not use_exact_timing and not use_random_timing
-    
-    add_shortest_flag = False
-    
-    # 存储每个模板层的时间参数，用于音频同步
-    layer_timing_params = {}
-    # 建立输入索引到图层的映射，解决音频索引错位问题
-    input_map = {}  # 例如 {1: 'top_layer', 2: 'middle_layer', ...}
-    
-    for layer in order:
-        if layer in chosen:
-            template_path = chosen[layer]
-            cmd += ["-i", template_path]
-            # 记录当前输入索引对应的图层
-            input_map[idx] = layer
-            
-            # --------------- 计算模板持续 -----------------
-            template_dur = get_video_duration(template_path)
-            if not template_dur:
-                template_dur = material_duration
-            fps = 24
-            
-            # --------------- 应用Alpha截取设置 -----------------
-            clip_enabled = False
-            clip_start = 0
-            clip_duration = template_dur
-            
-            if layer == 'top_layer' and top_alpha_clip_enabled:
-                clip_enabled = True
-                clip_start = top_alpha_clip_start
-                clip_duration = top_alpha_clip_duration
-            elif layer == 'middle_layer' and middle_alpha_clip_enabled:
-                clip_enabled = True
-                clip_start = middle_alpha_clip_start
-                clip_duration = middle_alpha_clip_duration
-            elif layer == 'bottom_layer' and bottom_alpha_clip_enabled:
-                clip_enabled = True
-                clip_start = bottom_alpha_clip_start
-                clip_duration = bottom_alpha_clip_duration
-            
-            # 如果启用了截取，更新模板持续时间
-            if clip_enabled:
-                template_dur = clip_duration
-                print(f"🎬 {layer} 启用截取: 从{clip_start}秒开始，截取{clip_duration}秒")
-            
-            first_layer = (idx == 1)
-            last_layer = (layer == order[-1] and layer in chosen)
-            
-            if use_exact_timing:
-                # ===== 精确定点模式 =====
-                start = min(random_timing_exact, material_duration - template_dur)
-                start = max(0, start)  # 确保不小于0
-                end = start + template_dur
-                
-                # 存储时间参数供音频使用
-                layer_timing_params[layer] = {
-                    'timing_offset': start,
-                    'trim_start': clip_start if clip_enabled else 0,
-                    'trim_duration': clip_duration if clip_enabled else template_dur
-                }
-                
-                # 生成滤镜：trim + 时间戳平移（应用Alpha截取）
-                trim_start = clip_start if clip_enabled else 0
-                trim_duration = clip_duration if clip_enabled else template_dur
-                filter_parts.append(
-                    f"[{idx}:v]trim=start={trim_start}:duration={trim_duration},"
-                    f"setpts=PTS-STARTPTS+{start:.3f}/TB[clip{idx}]"
-                )
-                
-                src = "0:v" if first_layer else f"tmp{idx-1}"
-                dst = "vout" if last_layer else f"tmp{idx}"
-                
-                overlay_parts.append(
-                    f"[{src}][clip{idx}]overlay=0:0:eof_action=pass[{dst}]"
-                )
-                print(f"🎯 {layer} {start:.2f}–{end:.2f}s 精确定点播放（时间戳平移）")
-                
-            elif use_random_timing:
-                # ===== 随机时间点模式 =====
-                if advanced_timing_enabled:
-                    # 高级随机模式
-                    if random_timing_mode == "range":
-                        # N–M 范围随机
-                        lo = min(random_timing_start, random_timing_end)
-                        hi = max(random_timing_start, random_timing_end)
-                        # 移除模板时长限制，允许完整播放
-                        hi = min(hi, material_duration)
-                        lo = max(0, lo)
-                        if hi > lo:
-                            start = random.uniform(lo, hi)
-                        else:
-                            start = lo
-                    else:
-                        # 前 N 秒随机（窗口模式）
-                        # 移除模板时长限制，允许完整播放
-                        max_start = min(random_timing_window, material_duration)
-                        max_start = max(0, max_start)
-                        start = random.uniform(0, max_start)
-                else:
-                    # 基础随机窗口模式
-                    # 移除模板时长限制，允许完整播放
-                    max_start = min(random_timing_window, material_duration)
-                    max_start = max(0, max_start)
-                    start = random.uniform(0, max_start)
-                
-                end = start + template_dur
-                
-                # 存储时间参数供音频使用
-                layer_timing_params[layer] = {
-                    'timing_offset': start,
-                    'trim_start': clip_start if clip_enabled else 0,
-                    'trim_duration': clip_duration if clip_enabled else template_dur
-                }
-                
-                # 生成滤镜：trim + 时间戳平移（应用Alpha截取）
-                trim_start = clip_start if clip_enabled else 0
-                trim_duration = clip_duration if clip_enabled else template_dur
-                filter_parts.append(
-                    f"[{idx}:v]trim=start={trim_start}:duration={trim_duration},"
-                    f"setpts=PTS-STARTPTS+{start:.3f}/TB[clip{idx}]"
-                )
-                
-                src = "0:v" if first_layer else f"tmp{idx-1}"
-                dst = "vout" if last_layer else f"tmp{idx}"
-                
-                overlay_parts.append(
-                    f"[{src}][clip{idx}]overlay=0:0:eof_action=pass[{dst}]"
-                )
-                print(f"🕒 {layer} {start:.2f}–{end:.2f}s 随机播放（时间戳平移）")
-            else:
-                # ===== 标准覆盖分支 =====
-                prev = "0:v" if first_layer else f"tmp{idx-1}"
-                dst = "vout" if last_layer else f"tmp{idx}"
-                
-                # 应用Alpha截取设置到标准模式
-                trim_start = clip_start if clip_enabled else 0
-                trim_duration = clip_duration if clip_enabled else template_dur
-                
-                # 存储时间参数供音频使用（标准模式无时间偏移）
-                layer_timing_params[layer] = {
-                    'timing_offset': 0,
-                    'trim_start': trim_start,
-                    'trim_duration': trim_duration
-                }
-                
-                if template_dur >= material_duration:
-                    # 模板更长：裁成素材时长或截取时长
-                    final_duration = min(trim_duration, material_duration)
-                    filter_parts.append(
-                        f"[{idx}:v]trim=start={trim_start}:duration={final_duration},"
-                        f"setpts=PTS-STARTPTS[clip{idx}]"
-                    )
-                    overlay_parts.append(
-                        f"[{prev}][clip{idx}]overlay=0:0:eof_action=pass[{dst}]"
-                    )
-                    print(f"🔧 {layer} 标准模式（长模板）：从{trim_start}s开始trim到{final_duration:.2f}s")
-                else:
-                    # 模板更短：按截取时长播放，不循环
-                    if clip_enabled:
-                        filter_parts.append(
-                            f"[{idx}:v]trim=start={trim_start}:duration={trim_duration},"
-                            f"setpts=PTS-STARTPTS[clip{idx}]"
-                        )
-                        overlay_parts.append(
-                            f"[{prev}][clip{idx}]overlay=0:0:"
-                            f"enable='between(t,0,{trim_duration:.2f})':"
-                            "eof_action=pass"
-                            f"[{dst}]"
-                        )
-                        print(f"📹 {layer} 标准模式（短模板+截取）：从{trim_start}s开始播放{trim_duration:.2f}s")
-                    else:
-                        filter_parts.append(
-                            f"[{idx}:v]setpts=PTS-STARTPTS[clip{idx}]"
-                        )
-                        overlay_parts.append(
-                            f"[{prev}][clip{idx}]overlay=0:0:"
-                            f"enable='between(t,0,{template_dur:.2f})':"
-                            "eof_action=pass"
-                            f"[{dst}]"
-                        )
-                        print(f"📹 {layer} 标准模式（短模板）：按原时长{template_dur:.2f}s播放，不循环")
-            
-            idx += 1
-    
-    # 第三步：组合完整的filter_complex
-    if filter_parts and overlay_parts:
-        # 组合视频滤镜部分
-        filter_complex = ";".join(filter_parts) + ";" + ";".join(overlay_parts)
-        
-        # 构建音频混合滤镜 - 修复音频丢失和同步问题
-        audio_filter_parts = []
-        audio_inputs = []
-        
-        # 首先添加素材视频的音频（索引0）
-        audio_inputs.append("[0:a]")
-        
-        # 使用input_map精准对应每个模板输入索引到它的层
-        for i, layer_name in input_map.items():
-            # 拿到这层的视频时间参数
-            params = layer_timing_params.get(layer_name, None)
-            if not params:
-                # 没参数就把音轨简单归零时戳，至少不抢跑
-                audio_filter_parts.append(f"[{i}:a]asetpts=PTS-STARTPTS[a{i}]")
-                audio_inputs.append(f"[a{i}]")
-                print(f"🎵 {layer_name} 音频：使用默认处理（无参数）")
-                continue
-            
-            timing_offset = params['timing_offset']      # 秒
-            trim_start    = params['trim_start']         # 秒
-            trim_duration = params['trim_duration']      # 秒
-            
-            # 先裁切再归零时戳
-            line = (f"[{i}:a]atrim=start={trim_start}:duration={trim_duration},"
-                   f"asetpts=PTS-STARTPTS")
-            
-            # 若需要把这段放到素材的 timing_offset 秒再出现，就补静音
-            if timing_offset > 0:
-                delay_ms = int(round(timing_offset * 1000))
-                line += f",adelay={delay_ms}:all=1"  # 补前置静音
-                print(f"🎵 {layer_name} 音频：裁切{trim_start}-{trim_start+trim_duration}s，延迟{timing_offset:.2f}s")
-            else:
-                print(f"🎵 {layer_name} 音频：裁切{trim_start}-{trim_start+trim_duration}s，无延迟")
-            
-            line += f"[a{i}]"
-            audio_filter_parts.append(line)
-            audio_inputs.append(f"[a{i}]")
-        
-        # 添加音频混合命令
-        if audio_filter_parts:
-            # 先添加视频滤镜
-            if filter_complex:
-                filter_complex += ";"
-            filter_complex += ";".join(audio_filter_parts)
-            
-            # 构建音频混合命令，素材和模板音频平衡混合
-            if len(audio_inputs) > 1:
-                weights = " ".join(["1"] * len(audio_inputs))
-                filter_complex += ";" + "".join(audio_inputs) + f"amix=inputs={len(audio_inputs)}:duration=first:weights={weights}[aout]"
-            else:
-                filter_complex += ";[0:a]acopy[aout]"
-            
-            # 使用混合后的音频
-            cmd += ["-filter_complex", filter_complex, "-map", "[vout]", "-map", "[aout]"]
-        else:
-            # 只有素材视频，直接使用其音频，确保音频不丢失
-            cmd += ["-filter_complex", filter_complex, "-map", "[vout]", "-map", "0:a"]
-    elif overlay_parts:
-        filter_complex = ";".join(overlay_parts)
-        cmd += ["-filter_complex", filter_complex, "-map", "[vout]", "-map", "0:a"]
-    else:
-        filter_complex = "[0:v]copy[vout]"
-        cmd += ["-filter_complex", filter_complex, "-map", "[vout]", "-map", "0:a"]
-    
-    # 调试输出
-    print("\n调试信息:")
-    print(f"filter_parts: {filter_parts}")
-    print(f"overlay_parts: {overlay_parts}")
-    print(f"filter_complex: {filter_complex}")
-    
-    # 编码参数 - 修复音频编码和同步问题
-    # 处理音频比特率格式
-    if 'audio_bitrate' in locals():
-        audio_bitrate_str = f"{audio_bitrate}k" if isinstance(audio_bitrate, int) else str(audio_bitrate)
-        if not audio_bitrate_str.endswith('k'):
-            audio_bitrate_str += 'k'
-    else:
-        audio_bitrate_str = "192k"
-    
-    # 处理预设和CRF参数
-    preset_val = preset if 'preset' in locals() else "veryfast"
-    crf_val = str(crf) if 'crf' in locals() else "25"
-    
-    cmd += [
-        "-c:a", "aac",
-        "-b:a", audio_bitrate_str,
-        "-ar", "44100",  # 确保音频采样率一致
-        "-ac", "2",      # 确保立体声
-        "-c:v", "libx264",
-        "-preset", preset_val,
-        "-crf", crf_val,
-        "-movflags", "+faststart",
-        "-r", "24",
-        "-threads", "4",
-        "-avoid_negative_ts", "make_zero",  # 避免负时间戳
-        "-fflags", "+genpts"  # 生成时间戳
-    ]
-    
-    # 在标准模式下添加 -shortest 参数
-    if add_shortest_flag:
-        cmd.append("-shortest")
-    
-    # 添加时长限制，防止输出超过原始素材时长
-    cmd += ["-t", str(material_duration), "-y"]
-    # 输出
-    out = os.path.join(output_dir, f"layered_{os.path.splitext(os.path.basename(material_path))[0]}_"+
-                        "_".join(os.path.splitext(os.path.basename(p))[0] for p in chosen.values())+".mp4")
-    cmd.append(out)
-    print("执行命令:"," ".join(cmd))
-    # 进度回调函数 - 修复无限循环问题
+def _alpha_clip_settings(top_enabled, top_start, top_duration,
+                         middle_enabled, middle_start, middle_duration,
+                         bottom_enabled, bottom_start, bottom_duration):
+    """界面的Alpha截取设置 -> {图层: (截取起点, 截取时长)}，只包含启用的图层"""
+    alpha_clips = {}
+    if top_enabled:
+        alpha_clips['top_layer'] = (top_start, top_duration)
+    if middle_enabled:
+        alpha_clips['middle_layer'] = (middle_start, middle_duration)
+    if bottom_enabled:
+        alpha_clips['bottom_layer'] = (bottom_start, bottom_duration)
+    return alpha_clips
+
+
+def _make_progress_printer(prefix=""):
+    """生成命令行进度条回调，返回False表示应停止处理"""
     def show(progress, message=""):
         global processing_cancelled
         
@@ -1464,39 +1266,263 @@ def process_video_with_layers(material_path, template_dirs, output_dir,
             bar = '█' * filled_length + '-' * (bar_length - filled_length)
             
             # 优化进度显示，避免误判卡死
-            if progress >= 99.9:
+            if 99.9 <= progress < 100:
                 status_msg = f"{message} (正在完成最终处理)" if message else "(正在完成最终处理)"
             else:
                 status_msg = message
                 
-            print(f"\r进度 |{bar}| {progress:.1f}% {status_msg}", end='', flush=True)
+            print(f"\r{prefix}进度 |{bar}| {progress:.1f}% {status_msg}", end='', flush=True)
             if progress >= 100:
                 print()  # 完成时换行
                 return True  # 明确返回True表示完成
         else:
-            print(f"\r{message}", end='', flush=True)
+            print(f"\r{prefix}{message}", end='', flush=True)
         
         return True  # 继续处理
+    return show
+
+
+def _plan_filter_graph(material_path, placement_lists, output_fps):
+    """规划滤镜图的帧率、缩放和像素格式，拿不到素材信息时返回None（由ffmpeg自动协商）"""
+    if not Config.OPTIMIZE_FILTER_GRAPH:
+        return None
+    try:
+        material_info = probe_media_cached(material_path)
+    except Exception as e:
+        print(f"⚠️ 无法读取素材流信息，滤镜图交给ffmpeg自动协商: {e}")
+        return None
+    return plan_graph(material_info, [p for placements in placement_lists for p in placements], output_fps=output_fps,
+                      scale_templates=Config.SCALE_TEMPLATES)
+
+
+def _run_numpy_job(material_path, placements, output, output_args, duration, graph_plan, show,
+                   time_shift=0.0, material_seek=None):
+    """用NumPy后端合成一个输出，返回 (ok, msg)"""
+    return numpy_compositor.composite(
+        material_path, placements, output, output_args, duration, graph_plan,
+        blend_mode=Config.BLEND_MODE, batch_frames=Config.NUMPY_BATCH_FRAMES,
+        queue_batches=Config.NUMPY_QUEUE_BATCHES, progress_callback=show,
+        is_cancelled=lambda: processing_cancelled, time_shift=time_shift, material_seek=material_seek,
+        frame_store=get_frame_store() if Config.TEMPLATE_FRAME_STORE else None)
+
+
+def _run_ffmpeg_job(cmd, show, fallbacks=None, job=None):
+    """
+    运行一条合成命令，返回 (ok, msg, 尝试记录)，被取消时返回 (False, '处理已取消', 尝试记录)
+
+    fallbacks: 资源不足时可用的降级阶梯，None时用配置里的 RETRY_FALLBACK_LADDER
+    job: processing_status['jobs'] 里的任务名，默认用输出文件名
+    """
+    ladder = Config.RETRY_FALLBACK_LADDER if fallbacks is None else fallbacks
+    policy = RetryPolicy(ladder, transient_retries=Config.FFMPEG_TRANSIENT_RETRIES)
+    # 卡住由 -progress 看门狗按 FFMPEG_STALL_TIMEOUT 判断，总时长只留一个宽松的兜底上限，长视频不会被误杀
+    proc = FFmpegProcessor(max_retries=1 + len(ladder) + Config.FFMPEG_TRANSIENT_RETRIES,
+                           timeout=Config.FFMPEG_MAX_RUNTIME, stall_timeout=Config.FFMPEG_STALL_TIMEOUT,
+                           retry_policy=policy)
+    # 进度按命令里的输出时长（-t）计算，编码速度默认按输出文件名记录
+    job = job or os.path.basename(cmd[-1])
+    try:
+        ok, msg = proc.process_with_retry(cmd, show, stats_callback=lambda stats: _record_job_stats(job, stats))
+        # 每次尝试的看门狗决定、最长进度间隔、错误摘要和降级路径；被终止的任务没有 progress=end，这里标记结束
+        processing_status.setdefault('jobs', {}).setdefault(job, {}).update(
+            attempts=proc.attempt_metrics, attempt_path=proc.attempt_path, done=True)
+        # 检查是否因为取消而停止
+        if processing_cancelled:
+            return False, '处理已取消', proc.attempt_path
+        return ok, msg, proc.attempt_path
+    finally:
+        # 确保清理资源
+        try:
+            proc.cancel_current_process()
+        except:
+            pass
+
+
+def process_video_with_layers(material_path, template_dirs, output_dir,
+                              force_template=None, progress_callback=None,
+                              random_timing=False, random_timing_window=40,
+                              random_timing_mode="before_window", random_timing_start=0, random_timing_end=40, random_timing_exact=0,
+                              exact_timing_enabled=False, advanced_timing_enabled=False,
+                              top_alpha_clip_enabled=False, top_alpha_clip_start=0, top_alpha_clip_duration=5,
+                              middle_alpha_clip_enabled=False, middle_alpha_clip_start=0, middle_alpha_clip_duration=5,
+                              bottom_alpha_clip_enabled=False, bottom_alpha_clip_start=0, bottom_alpha_clip_duration=5,
+                              preset="veryfast", crf=25, audio_bitrate=192,
+                              template_catalog=None, smart_render=False, variants=1, precomposite=None,
+                              compositor=None):
+    """
+    把模板逐层叠加到素材上并编码输出
+    
+    variants > 1 时每个变体独立选择模板和出现时间，素材只解码一次，
+    一条ffmpeg命令同时写出全部变体。
+    precomposite 为批次预合成的多层模板，叠加计划一致时用一路叠加代替逐层叠加。
+    compositor 为 "numpy" 时单变体用NumPy后端混合，默认取 Config.COMPOSITOR。
+    
+    Returns:
+        dict: {'success', 'output', 'message'}，多变体时另含 'outputs' 和逐个变体的 'variants'
+    """
+    material_duration = get_video_duration(material_path)
+    if not material_duration:
+        print(f"无法获取素材时长：{material_path}")
+        return
+    # 不经界面调用时目录索引没有启动，输出目录可能还不存在
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 收集并验证模板（批处理时由调用方传入共享的模板快照）
+    if template_catalog is None:
+        template_catalog = get_template_catalog(template_dirs, clean_filename=ensure_clean_filename)
+    layers = [layer for layer in template_dirs if template_catalog.entries(layer)]
+    if not layers:
+        print("❌ 未找到可用模板")
+        return
+    
+    # Alpha截取设置
+    alpha_clips = _alpha_clip_settings(
+        top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
+        middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
+        bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration
+    )
+    timing = dict(
+        random_timing=random_timing, random_timing_window=random_timing_window,
+        random_timing_mode=random_timing_mode, random_timing_start=random_timing_start,
+        random_timing_end=random_timing_end, random_timing_exact=random_timing_exact,
+        exact_timing_enabled=exact_timing_enabled, advanced_timing_enabled=advanced_timing_enabled
+    )
+    
+    # 随机/指定模板，计算各层出现时间（每个变体独立）
+    variant_count = max(1, int(variants or 1))
+    plans = []
+    for v in range(variant_count):
+        if variant_count > 1:
+            print(f"—— 变体 {v + 1}/{variant_count} ——")
+        chosen_entries = {}
+        for layer in layers:
+            entry = template_catalog.choose(layer, force_template)
+            chosen_entries[layer] = entry
+            print(f"{layer} 使用模板: {entry.name}")
+        placements = plan_layer_placements(chosen_entries, material_duration, alpha_clips=alpha_clips, **timing)
+        plans.append((chosen_entries, placements))
+    
+    material_stem = os.path.splitext(os.path.basename(material_path))[0]
+    
+    def prepare_overlays(placements):
+        stacked = precomposite.match(placements, material_duration) if precomposite else None
+        if stacked is not None:
+            print(f"🧩 使用预合成模板：1路叠加代替{len(placements)}路")
+            placements = [stacked]
+        # 角标、字幕条等小面积模板只解码和叠加可见区域
+        if Config.CROP_TEMPLATES:
+            placements = crop_placements(placements, str(CROPPED_TEMPLATE_DIR), min_saving=Config.CROP_MIN_SAVING)
+        return placements
+    
+    def output_path(chosen_entries, suffix=""):
+        return os.path.join(output_dir, f"layered_{material_stem}_" +
+                            "_".join(os.path.splitext(e.name)[0] for e in chosen_entries.values()) + suffix + ".mp4")
+    
+    # 编码参数
+    audio_bitrate_str = f"{audio_bitrate}k" if isinstance(audio_bitrate, int) else str(audio_bitrate)
+    if not audio_bitrate_str.endswith('k'):
+        audio_bitrate_str += 'k'
+    encode_args = [
+        "-c:a", "aac",
+        "-b:a", audio_bitrate_str,
+        "-ar", "44100",  # 确保音频采样率一致
+        "-ac", "2",      # 确保立体声
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-crf", str(crf),
+        "-movflags", "+faststart",
+        "-r", str(Config.OUTPUT_FPS),
+        "-threads", "4",
+        "-avoid_negative_ts", "make_zero",  # 避免负时间戳
+        "-fflags", "+genpts"  # 生成时间戳
+    ]
     
     print(f"🎬 处理 {os.path.basename(material_path)}")
+    if variant_count > 1:
+        variant_plans = [(ce, prepare_overlays(p)) for ce, p in plans]
+        graph_plan = _plan_filter_graph(material_path, [p for _, p in variant_plans], Config.OUTPUT_FPS)
+        return _run_variant_job(material_path, variant_plans, [output_path(ce, f"_v{j + 1}") for j, (ce, _) in enumerate(plans)],
+                                encode_args, material_duration, graph_plan=graph_plan)
+    
+    chosen_entries, placements = plans[0]
+    out = output_path(chosen_entries)
+    
+    # --------------- 智能渲染：只重编码模板可见的时间段 -----------------
+    smart_plan = None
+    use_timed_mode = exact_timing_enabled or random_timing or advanced_timing_enabled
+    if smart_render and use_timed_mode:
+        windows = [(p.offset, p.end) for p in placements]
+        smart_plan, material_info, reason = smart_render_plan_for_material(material_path, material_duration, windows,
+                                                                           output_fps=Config.OUTPUT_FPS)
+        if smart_plan:
+            print(f"⚡ 智能渲染：重编码 {smart_plan.render_start:.2f}–{smart_plan.render_end:.2f}s "
+                  f"（占素材{smart_plan.ratio:.0%}），其余部分直接复制")
+        else:
+            print(f"ℹ️ 智能渲染未启用：{reason}")
+    placements = prepare_overlays(placements)
+    # 智能渲染的片段保持素材帧率，才能与复制的片段拼接
+    graph_plan = _plan_filter_graph(material_path, [placements], None if smart_plan else Config.OUTPUT_FPS)
+    
+    smart_workdir = None
+    if smart_plan:
+        # 临时片段放在输出目录下的隐藏子目录，拼接时无需跨磁盘复制
+        smart_workdir = tempfile.mkdtemp(prefix=".smart_", dir=output_dir)
+        render_target = os.path.join(smart_workdir, "render.mp4")
+        render_duration = smart_plan.render_duration
+        # 重编码片段的帧率、像素格式和音频参数必须与素材一致，才能与复制的片段拼接；
+        # 素材用输入级seek从关键帧开始解码，模板出现时间相应前移
+        render_args = smart_render_output_args(material_info, preset, crf, audio_bitrate_str) + ["-threads", "4"]
+        material_seek = (smart_plan.render_start, render_duration)
+        time_shift = smart_plan.render_start
+    else:
+        render_target = out
+        render_duration = material_duration
+        render_args = encode_args
+        material_seek = None
+        time_shift = 0.0
+    cmd, filter_complex = build_layered_command(material_path, [placements], [render_target], render_args,
+                                                render_duration, material_seek=material_seek,
+                                                time_shift=time_shift, graph_plan=graph_plan)
+    
+    # NumPy后端需要全部模板的流信息（画面尺寸），拿不到时用滤镜图
+    use_numpy = (compositor or Config.COMPOSITOR) == "numpy"
+    if use_numpy and (graph_plan is None or any(p.template_path not in graph_plan.branches for p in placements)):
+        print("⚠️ 缺少流信息，NumPy合成不可用，改用ffmpeg滤镜图")
+        use_numpy = False
     
-    # 使用全局处理器实例，设置合理的超时时间
-    timeout_duration = min(int(material_duration * 10), 600)  # 最多10分钟
-    proc = FFmpegProcessor(max_retries=2, timeout=timeout_duration)
+    # 调试输出
+    print("\n调试信息:")
+    print(f"filter_complex:\n{describe_graph(filter_complex, graph_plan)}")
+    print("执行命令:"," ".join(cmd))
     
+    attempts = []
     try:
-        ok, msg = proc.process_with_retry(cmd, show)
-        
-        # 检查是否因为取消而停止
+        if use_numpy:
+            print(f"🧮 NumPy合成（{Config.BLEND_MODE}，每批{Config.NUMPY_BATCH_FRAMES}帧）")
+            ok, msg = _run_numpy_job(material_path, placements, render_target, render_args, render_duration,
+                                     graph_plan, _make_progress_printer(), time_shift=time_shift,
+                                     material_seek=material_seek)
+            if not ok and not processing_cancelled:
+                print(f"⚠️ NumPy合成失败，改用ffmpeg滤镜图: {msg}")
+                use_numpy = False
+        if not use_numpy:
+            # 智能渲染的片段要与复制的片段拼接，不能降低分辨率
+            fallbacks = [f for f in Config.RETRY_FALLBACK_LADDER if not (smart_plan and f == "lower_resolution")]
+            ok, msg, attempts = _run_ffmpeg_job(cmd, _make_progress_printer(), fallbacks)
         if processing_cancelled:
             return {'success': False, 'output': None, 'message': '处理已取消'}
+        
+        if ok and smart_plan:
+            ok, msg = smart_render_assemble(material_path, smart_plan, render_target, out, smart_workdir)
             
         if ok:
+            media_index.touch(out)
             print("✅ 完成", out)
-            return {'success': True, 'output': out, 'message': f'成功生成: {os.path.basename(out)}'}
+            return {'success': True, 'output': out, 'message': f'成功生成: {os.path.basename(out)}',
+                    'attempts': attempts}
         else:
             print("❌ 失败", msg)
-            return {'success': False, 'output': None, 'message': msg}
+            return {'success': False, 'output': None, 'message': msg, 'attempts': attempts}
             
     except Exception as e:
         error_msg = f"处理异常: {str(e)}"
@@ -1504,11 +1530,101 @@ def process_video_with_layers(material_path, template_dirs, output_dir,
         return {'success': False, 'output': None, 'message': error_msg}
     
     finally:
-        # 确保清理资源
-        try:
-            proc.cancel_current_process()
-        except:
-            pass
+        if smart_workdir:
+            shutil.rmtree(smart_workdir, ignore_errors=True)
+
+
+def _run_variant_job(material_path, plans, outputs, encode_args, material_duration, graph_plan=None):
+    """
+    一条ffmpeg命令合成全部变体；整体失败时逐个变体单独重试，
+    一个变体的模板有问题不会连累其他变体
+
+    每个变体在 processing_status['jobs'] 里按输出文件名有自己的进度记录；
+    回退到逐个重试时记录 shared_decode=False 和回退原因
+    """
+    variant_results = [
+        {'variant': j + 1, 'success': False, 'output': None, 'progress': 0.0, 'message': '等待处理'}
+        for j in range(len(plans))
+    ]
+    names = [os.path.basename(output) for output in outputs]
+    # 合成命令的编码统计单独记一个任务，变体记录不带fps，不会重复计入编码路数
+    shared_job = f"{os.path.basename(material_path)} [{len(plans)}个变体]"
+    jobs = processing_status.setdefault('jobs', {})
+    for name in names:
+        jobs[name] = {'progress': 0.0, 'done': False, 'shared_decode': True, 'shared_job': shared_job}
+    
+    printer = _make_progress_printer(f"[{len(plans)}个变体] ")
+    
+    def set_progress(j, progress):
+        variant_results[j]['progress'] = min(progress, 100.0)
+        jobs.setdefault(names[j], {})['progress'] = variant_results[j]['progress']
+    
+    def show_all(progress, message=""):
+        # 同一条命令里各输出同步编码，-progress 只有整条命令的时间线，各变体按它计算
+        if isinstance(progress, (int, float)):
+            for j in range(len(plans)):
+                set_progress(j, progress)
+        return printer(progress, message)
+    
+    def show_one(j):
+        single_printer = _make_progress_printer(f"[变体{j + 1}] ")
+        
+        def show(progress, message=""):
+            if isinstance(progress, (int, float)):
+                set_progress(j, progress)
+            return single_printer(progress, message)
+        return show
+    
+    def finish(j, ok, msg, attempts):
+        result = variant_results[j]
+        result['attempts'] = attempts
+        output = outputs[j]
+        if ok and os.path.exists(output) and os.path.getsize(output) > 0:
+            media_index.touch(output)
+            result.update(success=True, output=output, progress=100.0, message=f'成功生成: {os.path.basename(output)}')
+        else:
+            result.update(success=False, message=msg if not ok else '输出文件为空')
+        jobs.setdefault(names[j], {}).update(progress=result['progress'], done=True, success=result['success'])
+    
+    try:
+        cmd, filter_complex = build_layered_command(material_path, [p for _, p in plans], outputs,
+                                                    encode_args, material_duration, graph_plan=graph_plan)
+        print("\n调试信息:")
+        print(f"filter_complex:\n{describe_graph(filter_complex, graph_plan)}")
+        print("执行命令:", " ".join(cmd))
+        ok, msg, attempts = _run_ffmpeg_job(cmd, show_all, job=shared_job)
+        for j in range(len(plans)):
+            finish(j, ok, msg, attempts)
+        
+        if not ok and not processing_cancelled:
+            # 逐个重试每个变体都要重新解码素材，失去一次解码的好处，记下来便于排查
+            print(f"⚠️ 多变体合成失败，放弃共用解码，逐个变体重试（{len(plans)}次解码）: {msg}")
+            jobs.setdefault(shared_job, {}).update(fallback='per_variant', fallback_reason=msg)
+            for j, (_, placements) in enumerate(plans):
+                if processing_cancelled:
+                    break
+                jobs[names[j]].update(shared_decode=False, fallback_reason=msg, progress=0.0, done=False)
+                variant_results[j]['progress'] = 0.0
+                single_cmd, _ = build_layered_command(material_path, [placements], [outputs[j]],
+                                                      encode_args, material_duration, graph_plan=graph_plan)
+                ok_j, msg_j, attempts_j = _run_ffmpeg_job(single_cmd, show_one(j))
+                finish(j, ok_j, msg_j, attempts + attempts_j)
+    except Exception as e:
+        for result in variant_results:
+            if not result['success']:
+                result['message'] = f"处理异常: {str(e)}"
+    
+    succeeded = [r for r in variant_results if r['success']]
+    for result in variant_results:
+        status = "✅" if result['success'] else "❌"
+        print(f"{status} 变体{result['variant']}: {result['message']}")
+    return {
+        'success': bool(succeeded),
+        'output': succeeded[0]['output'] if succeeded else None,
+        'outputs': [r['output'] for r in succeeded],
+        'variants': variant_results,
+        'message': f"{len(succeeded)}/{len(variant_results)} 个变体成功"
+    }
 
 # CLI
 # ========== 进度更新和状态管理 ========== #
@@ -1541,7 +1657,8 @@ def get_progress_status():
         return "🚀 准备开始处理..."
     
     progress_percent = (current / total) * 100 if total > 0 else 0
-    return f"📹 处理中 ({current}/{total}) - {progress_percent:.1f}% - {current_file}"
+    summary = get_encode_stats_summary()
+    return f"📹 处理中 ({current}/{total}) - {progress_percent:.1f}% - {current_file}" + (f" - {summary}" if summary else "")
 
 # ========== 批量处理功能 ========== #
 
@@ -1751,7 +1868,7 @@ def create_gradio_interface():
                         gr.Markdown("## 📹 素材选择")
                         with gr.Row():
                             materials = gr.CheckboxGroup(
-                                choices=list_materials(),
+                                choices=media_index.cached_names('material'),
                                 label="原素材（可多选）",
                                 value=[]
                             )
@@ -1772,7 +1889,7 @@ def create_gradio_interface():
                         
                         with gr.Row():
                             preset_dropdown = gr.Dropdown(
-                                choices=list_presets(),
+                                choices=[],
                                 label="选择预设",
                                 scale=2
                             )
@@ -1788,17 +1905,17 @@ def create_gradio_interface():
                         # Alpha模板配置
                         gr.Markdown("## 🎭 Alpha模板配置")
                         top_template = gr.Dropdown(
-                            choices=["无"] + list_templates("top_layer"), 
+                            choices=["无"] + media_index.cached_names("top_layer"), 
                             value="无", 
                             label="顶层模板"
                         )
                         middle_template = gr.Dropdown(
-                            choices=["无"] + list_templates("middle_layer"), 
+                            choices=["无"] + media_index.cached_names("middle_layer"), 
                             value="无", 
                             label="中层模板"
                         )
                         bottom_template = gr.Dropdown(
-                            choices=["无"] + list_templates("bottom_layer"), 
+                            choices=["无"] + media_index.cached_names("bottom_layer"), 
                             value="无", 
                             label="底层模板"
                         )
@@ -1920,6 +2037,10 @@ def create_gradio_interface():
                                     minimum=128, maximum=320, value=Config.DEFAULT_AUDIO_BITRATE, step=32, 
                                     label="音频比特率 (kbps)"
                                 )
+                            smart_render = gr.Checkbox(
+                                value=Config.SMART_RENDER,
+                                label="⚡ 智能渲染（定点/随机模式只重编码模板出现的片段，其余直接复制；复制部分保留素材原编码）"
+                            )
                         
                         # 并行处理设置
                         with gr.Accordion("🔧 并行处理设置", open=False):
@@ -1927,6 +2048,10 @@ def create_gradio_interface():
                                 minimum=1, maximum=8, value=2, step=1,
                                 label="最大并行任务数"
                             )
+                            variants_per_material = gr.Slider(
+                                minimum=1, maximum=Config.MAX_VARIANTS_PER_MATERIAL, value=1, step=1,
+                                label="每个素材生成变体数（素材只解码一次，同时输出多个版本）"
+                            )
                     
                     with gr.Column():
                         # 控制按钮
@@ -1957,7 +2082,7 @@ def create_gradio_interface():
                         gr.Markdown("## 🎬 视频预览与下载")
                         with gr.Row():
                             output_videos = gr.Dropdown(
-                                choices=list_output_videos(),
+                                choices=media_index.cached_names('output', order='mtime'),
                                 label="输出视频列表",
                                 interactive=True
                             )
@@ -2010,7 +2135,7 @@ def create_gradio_interface():
                         
                         # 素材选择
                         processing_materials = gr.CheckboxGroup(
-                            choices=get_material_choices_for_processing(),
+                            choices=[],
                             label="选择要处理的素材（支持从不同文件夹选择）",
                             interactive=True
                         )
@@ -2133,14 +2258,14 @@ def create_gradio_interface():
                         gr.Markdown("### 当前素材列表")
                         materials_list_display = gr.Textbox(
                             label="素材文件列表",
-                            value="\n".join(list_materials()),
+                            value="\n".join(media_index.cached_names('material')),
                             lines=10,
                             interactive=False
                         )
                         
                         # 删除素材功能
                         material_to_delete = gr.Dropdown(
-                            choices=list_materials(),
+                            choices=media_index.cached_names('material'),
                             label="选择要删除的素材",
                             interactive=True
                         )
@@ -2194,7 +2319,7 @@ def create_gradio_interface():
                         gr.Markdown("### 顶层模板")
                         top_templates_list = gr.Textbox(
                             label="顶层模板列表",
-                            value="\n".join(list_templates("top_layer")),
+                            value="\n".join(media_index.cached_names("top_layer")),
                             lines=3,
                             interactive=False
                         )
@@ -2202,7 +2327,7 @@ def create_gradio_interface():
                         gr.Markdown("### 中层模板")
                         middle_templates_list = gr.Textbox(
                             label="中层模板列表",
-                            value="\n".join(list_templates("middle_layer")),
+                            value="\n".join(media_index.cached_names("middle_layer")),
                             lines=3,
                             interactive=False
                         )
@@ -2210,7 +2335,7 @@ def create_gradio_interface():
                         gr.Markdown("### 底层模板")
                         bottom_templates_list = gr.Textbox(
                             label="底层模板列表",
-                            value="\n".join(list_templates("bottom_layer")),
+                            value="\n".join(media_index.cached_names("bottom_layer")),
                             lines=3,
                             interactive=False
                         )
@@ -2410,6 +2535,7 @@ def create_gradio_interface():
                         
                         # 复制文件
                         shutil.copy2(file.name, target_path)
+                        media_index.touch(target_path)
                         uploaded_files.append(file_name)
                         
                     except Exception as e:
@@ -2454,6 +2580,7 @@ def create_gradio_interface():
                     return "❌ 文件不存在", gr.update()
                 
                 os.remove(material_path)
+                media_index.touch(material_path)
                 
                 # 刷新列表
                 updated_materials = list_materials()
@@ -2479,6 +2606,7 @@ def create_gradio_interface():
                     if os.path.exists(material_path):
                         try:
                             os.remove(material_path)
+                            media_index.touch(material_path)
                             deleted_files.append(material_name)
                         except Exception as e:
                             failed_files.append(f"{material_name}: {str(e)}")
@@ -2525,6 +2653,7 @@ def create_gradio_interface():
                     if os.path.exists(material_path):
                         try:
                             os.remove(material_path)
+                            media_index.touch(material_path)
                             deleted_files.append(material_name)
                         except Exception as e:
                             failed_files.append(f"{material_name}: {str(e)}")
@@ -2620,6 +2749,8 @@ def create_gradio_interface():
                 
                 # 复制文件
                 shutil.copy2(file.name, target_path)
+                media_index.touch(target_path)
+                invalidate_template_catalog()
                 
                 return f"✅ 模板上传成功！\n📁 类型: {template_type}\n📄 文件: {file_name}\n📍 路径: {target_path}"
                 
@@ -2658,7 +2789,7 @@ def create_gradio_interface():
                 exact_timing_enabled, top_alpha_clip_enabled, top_alpha_clip_start, top_alpha_clip_duration,
                 middle_alpha_clip_enabled, middle_alpha_clip_start, middle_alpha_clip_duration,
                 bottom_alpha_clip_enabled, bottom_alpha_clip_start, bottom_alpha_clip_duration,
-                preset, crf, audio_bitrate, max_workers
+                preset, crf, audio_bitrate, max_workers, smart_render, variants_per_material
             ],
             outputs=[batch_result]
         )
@@ -2945,6 +3076,7 @@ def create_gradio_interface():
                         
                         # 复制文件
                         shutil.copy2(file.name, target_path)
+                        media_index.touch(target_path)
                         uploaded_files.append(file_name)
                         
                     except Exception as e:
@@ -3002,6 +3134,34 @@ def create_gradio_interface():
             inputs=[],
             outputs=[processing_result, processing_materials]
         )
+        
+        # 页面加载后再填充各列表，界面构建和端口启动不依赖磁盘上的文件数量
+        def load_initial_choices():
+            materials_list = list_materials()
+            top_list = list_templates("top_layer")
+            middle_list = list_templates("middle_layer")
+            bottom_list = list_templates("bottom_layer")
+            return (
+                gr.update(choices=materials_list),
+                gr.update(choices=list_presets()),
+                gr.update(choices=["无"] + top_list),
+                gr.update(choices=["无"] + middle_list),
+                gr.update(choices=["无"] + bottom_list),
+                gr.update(choices=list_output_videos()),
+                gr.update(choices=get_material_choices_for_processing()),
+                gr.update(value="\n".join(materials_list)),
+                gr.update(choices=materials_list),
+                gr.update(value="\n".join(top_list)),
+                gr.update(value="\n".join(middle_list)),
+                gr.update(value="\n".join(bottom_list))
+            )
+        
+        demo.load(
+            fn=load_initial_choices,
+            outputs=[materials, preset_dropdown, top_template, middle_template, bottom_template,
+                     output_videos, processing_materials, materials_list_display, material_to_delete,
+                     top_templates_list, middle_templates_list, bottom_templates_list]
+        )
     
     return demo
 
@@ -3026,6 +3186,8 @@ if __name__ == '__main__':
     print("🚀 启动批量Alpha视频合成工具 - Web界面模式")
     
     try:
+        # 索引在后台扫描，界面先以空列表启动，页面加载后再填充
+        media_index.start(background=True)
         demo = create_gradio_interface()
         port = args.port or find_free_port()
         
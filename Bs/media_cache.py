@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Optional, Dict
+
+from utils import MediaInfo, StreamInfo, probe_media
+
+# 内容哈希只读取文件首尾各1MB，避免整文件读取
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class MediaCache:
+    """媒体元数据缓存：SQLite持久化 + 进程内LRU
+
+    以(绝对路径, 文件大小, mtime_ns)为键，文件被修改后键不再匹配，
+    缓存自动失效。启用内容哈希后，被touch或改名但内容未变的文件也能命中。
+    """
+
+    def __init__(self, db_path, lru_size=2048, hash_content=False):
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self.hash_content = hash_content
+        self.hits = 0
+        self.misses = 0
+        self.probes = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        """延迟打开数据库，首次使用时才建表"""
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS media_meta ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " content_hash TEXT,"
+                " info TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_media_meta_hash ON media_meta(content_hash)")
+            # 体积较大的派生数据（关键帧索引等）按种类单独存放，不进入LRU
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS media_blobs ("
+                " path TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " data BLOB NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (path, kind))"
+            )
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _file_key(path):
+        """返回(绝对路径, 大小, mtime_ns)，文件不存在时返回None"""
+        abs_path = os.path.abspath(path)
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return None
+        return abs_path, st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def content_hash(path, size=None):
+        """计算文件首尾各1MB加文件大小的快速内容哈希"""
+        if size is None:
+            size = os.path.getsize(path)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(size).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read(HASH_CHUNK_SIZE))
+            if size > HASH_CHUNK_SIZE * 2:
+                f.seek(-HASH_CHUNK_SIZE, os.SEEK_END)
+                digest.update(f.read(HASH_CHUNK_SIZE))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _dump(info):
+        data = asdict(info)
+        data.pop('path', None)
+        return json.dumps(data, ensure_ascii=False)
+
+    @staticmethod
+    def _load(path, payload):
+        data = json.loads(payload)
+        streams = [StreamInfo(**s) for s in data.pop('streams', [])]
+        return MediaInfo(path=path, streams=streams, **data)
+
+    def _lru_get(self, key):
+        entry = self._lru.get(key[0])
+        if entry is not None and entry[0] == key[1] and entry[1] == key[2]:
+            self._lru.move_to_end(key[0])
+            return entry[2]
+        return None
+
+    def _lru_put(self, key, info):
+        self._lru[key[0]] = (key[1], key[2], info)
+        self._lru.move_to_end(key[0])
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _lookup_by_hash(self, conn, key):
+        """按内容哈希查找已缓存的同内容文件"""
+        try:
+            digest = self.content_hash(key[0], key[1])
+        except OSError:
+            return None, None
+        row = conn.execute(
+            "SELECT info FROM media_meta WHERE content_hash=? AND size=? LIMIT 1",
+            (digest, key[1])
+        ).fetchone()
+        return digest, (self._load(key[0], row[0]) if row else None)
+
+    def _store(self, conn, key, info, digest=None):
+        conn.execute(
+            "INSERT OR REPLACE INTO media_meta (path, size, mtime_ns, content_hash, info, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key[0], key[1], key[2], digest, self._dump(info), time.time())
+        )
+        conn.commit()
+
+    def get(self, path) -> Optional[MediaInfo]:
+        """读取缓存，未命中或文件已变化时返回None"""
+        key = self._file_key(path)
+        if key is None:
+            return None
+        with self._lock:
+            info = self._lru_get(key)
+            if info is not None:
+                self.hits += 1
+                return info
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT size, mtime_ns, info FROM media_meta WHERE path=?", (key[0],)
+            ).fetchone()
+            if row and row[0] == key[1] and row[1] == key[2]:
+                info = self._load(key[0], row[2])
+            elif self.hash_content:
+                digest, info = self._lookup_by_hash(conn, key)
+                if info is not None:
+                    self._store(conn, key, info, digest)
+            if info is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru_put(key, info)
+            return info
+
+    def get_many(self, paths) -> Dict[str, MediaInfo]:
+        """批量读取缓存，一次SQL查询取回所有LRU未命中的条目
+
+        Returns:
+            dict: {原始路径: MediaInfo}，只包含命中的文件
+        """
+        keys = {}
+        for path in paths:
+            key = self._file_key(path)
+            if key is not None:
+                keys[path] = key
+
+        found = {}
+        with self._lock:
+            pending = {}
+            for path, key in keys.items():
+                info = self._lru_get(key)
+                if info is not None:
+                    found[path] = info
+                else:
+                    pending[path] = key
+
+            if pending:
+                conn = self._connect()
+                rows = {}
+                abs_paths = list({key[0] for key in pending.values()})
+                # SQLite单条语句的参数个数有限，分批查询
+                for i in range(0, len(abs_paths), 500):
+                    chunk = abs_paths[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    for row in conn.execute(
+                        f"SELECT path, size, mtime_ns, info FROM media_meta WHERE path IN ({placeholders})",
+                        chunk
+                    ):
+                        rows[row[0]] = row
+                for path, key in pending.items():
+                    row = rows.get(key[0])
+                    if row and row[1] == key[1] and row[2] == key[2]:
+                        info = self._load(key[0], row[3])
+                        self._lru_put(key, info)
+                        found[path] = info
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, path, info):
+        """写入缓存"""
+        key = self._file_key(path)
+        if key is None:
+            return
+        with self._lock:
+            digest = None
+            if self.hash_content:
+                try:
+                    digest = self.content_hash(key[0], key[1])
+                except OSError:
+                    pass
+            self._store(self._connect(), key, info, digest)
+            self._lru_put(key, info)
+
+    def probe(self, path) -> MediaInfo:
+        """读取缓存，未命中时调用ffprobe并写回缓存
+
+        Raises:
+            与 utils.probe_media 相同
+        """
+        info = self.get(path)
+        if info is not None:
+            return info
+        self.probes += 1
+        info = probe_media(path)
+        self.put(path, info)
+        return info
+
+    def probe_many(self, paths) -> Dict[str, MediaInfo]:
+        """批量探测，已缓存的文件不再启动ffprobe，探测失败的文件不出现在结果中"""
+        found = self.get_many(paths)
+        for path in paths:
+            if path in found:
+                continue
+            try:
+                self.probes += 1
+                info = probe_media(path)
+            except Exception:
+                continue
+            self.put(path, info)
+            found[path] = info
+        return found
+
+    def get_blob(self, path, kind) -> Optional[bytes]:
+        """读取与文件绑定的派生数据，文件已变化时返回None"""
+        key = self._file_key(path)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, mtime_ns, data FROM media_blobs WHERE path=? AND kind=?", (key[0], kind)
+            ).fetchone()
+        if row and row[0] == key[1] and row[1] == key[2]:
+            return bytes(row[2])
+        return None
+
+    def put_blob(self, path, kind, data):
+        """写入与文件绑定的派生数据"""
+        key = self._file_key(path)
+        if key is None:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO media_blobs (path, kind, size, mtime_ns, data, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key[0], kind, key[1], key[2], sqlite3.Binary(data), time.time())
+            )
+            conn.commit()
+
+    def invalidate(self, path):
+        """删除指定文件的缓存条目"""
+        abs_path = os.path.abspath(path)
+        with self._lock:
+            self._lru.pop(abs_path, None)
+            conn = self._connect()
+            conn.execute("DELETE FROM media_meta WHERE path=?", (abs_path,))
+            conn.execute("DELETE FROM media_blobs WHERE path=?", (abs_path,))
+            conn.commit()
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._lru.clear()
+            conn = self._connect()
+            conn.execute("DELETE FROM media_meta")
+            conn.execute("DELETE FROM media_blobs")
+            conn.commit()
+
+    def stats(self):
+        """命中/未命中计数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'probes': self.probes,
+                'hit_rate': self.hits / total if total else 0.0,
+                'lru_entries': len(self._lru)
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def configure_media_cache(db_path, lru_size=2048, hash_content=False):
+    """设置全局元数据缓存的数据库位置，应在首次探测前调用"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is not None:
+            _default_cache.close()
+        _default_cache = MediaCache(db_path, lru_size=lru_size, hash_content=hash_content)
+    return _default_cache
+
+
+def get_media_cache() -> MediaCache:
+    """获取全局元数据缓存，未配置时存放在 config/media_cache.db"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "media_cache.db")
+            _default_cache = MediaCache(db_path)
+        return _default_cache
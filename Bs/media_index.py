@@ -0,0 +1,331 @@
+import os
+import sys
+import errno
+import select
+import struct
+import threading
+from typing import Dict, List, Optional
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+               | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """通过ctypes调用libc的inotify，不引入额外依赖"""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        return wd if wd >= 0 else None
+
+    def read_events(self, timeout):
+        """等待事件，返回[(wd, mask, name)]"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class MediaIndex:
+    """素材/模板/输出目录的内存索引
+
+    每个目录保存 {文件名: (完整路径, mtime)}，提供O(1)的文件名查找和
+    缓存的排序视图。Linux上由inotify驱动增量更新，其他平台定期用scandir
+    检查目录mtime，有变化才重新扫描。
+    """
+
+    def __init__(self, dirs: Dict[str, str], extensions: Dict[str, tuple], poll_interval=2.0,
+                 create_dirs=False):
+        """
+        Args:
+            dirs: {索引键: 目录路径}
+            extensions: {索引键: 允许的扩展名元组}
+            poll_interval: 回退轮询的间隔（秒）
+            create_dirs: 为True时在首次扫描前创建不存在的目录
+        """
+        self.dirs = {key: str(d) for key, d in dirs.items()}
+        self.extensions = {key: tuple(ext.lower() for ext in exts) for key, exts in extensions.items()}
+        self.poll_interval = poll_interval
+        self.create_dirs = create_dirs
+        self.backend = None
+        self._entries = {key: {} for key in self.dirs}
+        self._dir_mtime = {}
+        self._sorted = {}
+        self._versions = {key: 0 for key in self.dirs}
+        self._lock = threading.RLock()
+        self._started = False
+        self._ready = threading.Event()
+        self.start_error = None         # 启动失败的原因，此后每次查询直接扫描
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- 扫描与增量更新 ----------
+
+    def _accepts(self, key, name):
+        return name.lower().endswith(self.extensions.get(key, ())) and not name.startswith('.')
+
+    def _changed(self, key):
+        self._versions[key] += 1
+        for cache_key in [k for k in self._sorted if k[0] == key]:
+            del self._sorted[cache_key]
+
+    def rescan(self, key=None):
+        """用一次scandir重建目录索引，key为None时扫描全部目录"""
+        keys = [key] if key is not None else list(self.dirs)
+        for k in keys:
+            d = self.dirs[k]
+            entries = {}
+            try:
+                dir_mtime = os.stat(d).st_mtime_ns
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if self._accepts(k, entry.name):
+                            try:
+                                if entry.is_file():
+                                    entries[entry.name] = (entry.path, entry.stat().st_mtime)
+                            except OSError:
+                                continue
+            except OSError:
+                dir_mtime = None
+            with self._lock:
+                self._dir_mtime[k] = dir_mtime
+                if entries != self._entries[k]:
+                    self._entries[k] = entries
+                    self._changed(k)
+        if key is None:
+            self._ready.set()
+
+    def touch(self, path):
+        """立即同步单个文件的增删改，供本程序自己写入/删除文件后调用"""
+        d, name = os.path.split(os.path.abspath(str(path)))
+        for key, watched in self.dirs.items():
+            if os.path.abspath(watched) == d:
+                self._apply(key, name)
+
+    def _apply(self, key, name):
+        if not self._accepts(key, name):
+            return
+        path = os.path.join(self.dirs[key], name)
+        try:
+            st = os.stat(path)
+            value = (path, st.st_mtime) if os.path.isfile(path) else None
+        except OSError:
+            value = None
+        with self._lock:
+            entries = self._entries[key]
+            if value is None:
+                if entries.pop(name, None) is not None:
+                    self._changed(key)
+            elif entries.get(name) != value:
+                entries[name] = value
+                self._changed(key)
+
+    # ---------- 后台监听 ----------
+
+    def start(self, background=False):
+        """
+        首次扫描并启动后台监听线程，重复调用无副作用
+
+        Args:
+            background: 为True时首次扫描也放到后台线程，调用立即返回
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if background:
+            threading.Thread(target=self._start, name="media-index-init", daemon=True).start()
+        else:
+            self._start()
+
+    @property
+    def ready(self):
+        """首次扫描是否已完成"""
+        return self._ready.is_set()
+
+    def _start(self):
+        try:
+            self._start_watching()
+        except Exception as e:
+            self.start_error = e
+            print(f"⚠️ 目录索引启动失败，改为每次查询时直接扫描: {e}")
+        finally:
+            # 无论成败都要放行，否则查询会一直等待
+            self._ready.set()
+
+    def _start_watching(self):
+        if self.create_dirs:
+            for d in self.dirs.values():
+                try:
+                    os.makedirs(d, exist_ok=True)
+                except OSError as e:
+                    # 建不了的目录按缺失处理，之后出现时再建立监听
+                    print(f"⚠️ 无法创建目录 {d}: {e}")
+        inotify = None
+        watches = {}
+        if sys.platform.startswith('linux'):
+            try:
+                inotify = _Inotify()
+                # 先建立监听再扫描，扫描期间新增的文件也不会漏掉
+                self._add_watches(inotify, watches)
+            except Exception as e:
+                print(f"⚠️ inotify不可用，改用轮询: {e}")
+                inotify = None
+        self.rescan()
+        if inotify is not None:
+            self.backend = 'inotify'
+            target, args = self._inotify_loop, (inotify, watches)
+        else:
+            self.backend = 'poll'
+            target, args = self._poll_loop, ()
+        # 先启动再赋值：首次扫描完成后stop()可能立即被调用
+        thread = threading.Thread(target=target, args=args, name="media-index", daemon=True)
+        thread.start()
+        self._thread = thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _ensure_started(self):
+        if not self._started:
+            self.start()
+        self._ready.wait()
+        if self.start_error is not None:
+            # 没有后台线程维护索引，退回每次查询前扫描一遍
+            self.rescan()
+
+    def _add_watches(self, inotify, watches):
+        """为还没有监听的目录建立监听，返回本次新建立监听的目录"""
+        watched = set(watches.values())
+        added = []
+        for key, d in self.dirs.items():
+            if key in watched:
+                continue
+            wd = inotify.add_watch(d)
+            if wd is not None:
+                watches[wd] = key
+                added.append(key)
+        return added
+
+    def _inotify_loop(self, inotify, watches):
+        try:
+            while not self._stop.is_set():
+                events = inotify.read_events(self.poll_interval)
+                if len(watches) < len(self.dirs):
+                    # 目录被删除或尚未创建时重新建立监听，只重扫刚建立监听的目录；
+                    # 仍不存在的目录在失去监听时已清空，不必每轮重扫
+                    for key in self._add_watches(inotify, watches):
+                        self.rescan(key)
+                for wd, mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        self.rescan()
+                        continue
+                    key = watches.get(wd)
+                    if key is None:
+                        continue
+                    if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                        watches.pop(wd, None)
+                        self.rescan(key)
+                    elif name:
+                        self._apply(key, name)
+        finally:
+            inotify.close()
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            for key, d in self.dirs.items():
+                try:
+                    mtime = os.stat(d).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if mtime != self._dir_mtime.get(key):
+                    self.rescan(key)
+
+    # ---------- 查询 ----------
+
+    def version(self, key):
+        """目录内容每变化一次版本号加一，可用于判断是否需要刷新界面"""
+        self._ensure_started()
+        return self._versions[key]
+
+    def names(self, key, order='name') -> List[str]:
+        """
+        返回目录中的文件名列表
+
+        Args:
+            order: 'name' 按文件名排序，'mtime' 按修改时间从新到旧
+        """
+        self._ensure_started()
+        with self._lock:
+            cached = self._sorted.get((key, order))
+            if cached is None:
+                entries = self._entries[key]
+                if order == 'mtime':
+                    cached = sorted(entries, key=lambda n: entries[n][1], reverse=True)
+                else:
+                    cached = sorted(entries)
+                self._sorted[(key, order)] = cached
+            return list(cached)
+
+    def cached_names(self, key, order='name') -> List[str]:
+        """不等待首次扫描：索引就绪前返回空列表，供界面构建时使用"""
+        if not self.ready:
+            return []
+        return self.names(key, order)
+
+    def lookup(self, key, name) -> Optional[str]:
+        """按文件名查找完整路径，O(1)"""
+        self._ensure_started()
+        with self._lock:
+            entry = self._entries[key].get(name)
+        return entry[0] if entry else None
+
+    def __contains__(self, item):
+        key, name = item
+        return self.lookup(key, name) is not None
@@ -0,0 +1,394 @@
+import os
+import math
+import queue
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from process_supervisor import get_supervisor
+from ffmpeg_log import StderrLog
+from layer_graph import LayerPlacement, video_windows, audio_window, input_args, build_overlay_filters
+
+# 每批帧数和每路队列最多缓存的批数：队列满时解码进程阻塞在管道写入上
+BATCH_FRAMES = 8
+QUEUE_BATCHES = 4
+# 帧边界比较容差（帧）
+_EPS = 1e-6
+# 保留编码器stderr的最后几行，失败时作为错误信息
+_STDERR_LINES = 20
+
+
+def premultiply(frames):
+    """rgba uint8 -> (预乘后的rgb, alpha)，均为uint16，便于后续混合不溢出"""
+    alpha = frames[..., 3:4].astype(np.uint16)
+    rgb = frames[..., :3].astype(np.uint16)
+    rgb *= alpha
+    rgb += 127
+    rgb //= 255
+    return rgb, alpha
+
+
+def _blend_normal(dst, src, alpha):
+    return src + (dst * (255 - alpha) + 127) // 255
+
+
+def _blend_add(dst, src, alpha):
+    return np.minimum(dst + src, 255)
+
+
+def _blend_screen(dst, src, alpha):
+    return dst + src - (dst * src + 127) // 255
+
+
+def _blend_multiply(dst, src, alpha):
+    return (src * dst + dst * (255 - alpha) + 127) // 255
+
+
+# 预乘alpha下的混合模式，dst为不透明素材，均为uint16
+BLEND_MODES: Dict[str, Callable] = {
+    'normal': _blend_normal,
+    'add': _blend_add,
+    'screen': _blend_screen,
+    'multiply': _blend_multiply,
+}
+
+
+@dataclass
+class LayerClip:
+    """模板的一个视频片段在输出上的位置：覆盖输出帧 [first_frame, end_frame)"""
+    layer: str
+    path: str
+    seek: Optional[float]
+    duration: float
+    first_frame: int
+    end_frame: int
+    x: int
+    y: int
+    width: int
+    height: int
+    filters: List[str]
+
+
+def plan_clips(placements: Sequence[LayerPlacement], graph_plan, time_shift=0.0) -> List[LayerClip]:
+    """
+    按与滤镜图相同的时间语义把各层拆成片段
+
+    overlay 的 enable 窗口 [S, S + D) 对应输出帧 ceil(S * fps) 到 ceil((S + D) * fps)，
+    模板片段从窗口第一帧开始逐帧对应。
+
+    Raises:
+        ValueError: 模板没有流信息（无法确定画面尺寸）
+    """
+    fps = graph_plan.fps
+    clips = []
+    for placement in placements:
+        branch = graph_plan.branches.get(placement.template_path)
+        if branch is None:
+            raise ValueError(f"没有模板流信息: {placement.template_path}")
+        offset = placement.offset - time_shift
+        window_start = placement.trim_start if placement.trim else 0
+        x, y = graph_plan.position(placement)
+        # 解码端统一帧率和尺寸，输出rgba交给NumPy预乘
+        filters = [f"fps={fps:g}"] + [f for f in branch.filters if f.startswith("scale=")] + ["format=rgba"]
+        for seg_start, seg_duration in video_windows(placement):
+            seg_offset = offset + (seg_start or 0) - window_start
+            if seg_duration is None:
+                seg_duration = placement.enable_until if placement.enable_until is not None else placement.trim_duration
+            first = max(0, math.ceil(seg_offset * fps - _EPS))
+            end = math.ceil((seg_offset + seg_duration) * fps - _EPS)
+            if end <= first:
+                continue
+            clips.append(LayerClip(placement.layer, placement.template_path, seg_start, seg_duration,
+                                   first, end, x, y, branch.size[0], branch.size[1], filters))
+    return clips
+
+
+class FrameReader:
+    """
+    ffmpeg解码到rawvideo管道，后台线程按批读取
+
+    每批读入一个新的bytearray，用 np.frombuffer 直接包成 (N, H, W, C) 数组，不再复制；
+    队列有上限，消费跟不上时读线程阻塞，解码进程随之阻塞在管道上。
+    解码进程读完后非零退出时 error 为 CalledProcessError（stderr 为错误摘要），
+    在最后一批之后才结束 batches()，消费方据此区分正常结束和解码失败。
+    """
+
+    def __init__(self, cmd, width, height, channels, batch_frames=BATCH_FRAMES, queue_batches=QUEUE_BATCHES,
+                 transform=None):
+        self.frame_size = width * height * channels
+        self.shape = (height, width, channels)
+        self.batch_frames = batch_frames
+        self.transform = transform
+        self.queue = queue.Queue(maxsize=queue_batches)
+        self.error = None
+        self.cmd = cmd
+        self.log = StderrLog(_STDERR_LINES)
+        self._stopped = threading.Event()
+        self.process = get_supervisor().popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        self._drain = threading.Thread(target=self.log.drain, args=(self.process.stderr,), daemon=True)
+        self._drain.start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _read_batch(self):
+        buf = bytearray(self.frame_size * self.batch_frames)
+        view = memoryview(buf)
+        filled = 0
+        while filled < len(buf):
+            n = self.process.stdout.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        frames = filled // self.frame_size
+        if not frames:
+            return None
+        return np.frombuffer(buf, dtype=np.uint8, count=frames * self.frame_size).reshape((frames,) + self.shape)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                batch = self._read_batch()
+                if batch is None:
+                    break
+                if not self._put(self.transform(batch) if self.transform else batch):
+                    return
+            # 管道读完：进程正在退出，检查退出码（被 close() 停止的不算失败）
+            returncode = self.process.wait()
+            if returncode != 0 and not self._stopped.is_set():
+                self._drain.join(timeout=5)
+                self.error = subprocess.CalledProcessError(returncode, self.cmd, stderr=self.log.summary())
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def batches(self):
+        """按顺序取出各批，读完（或解码进程退出）时结束"""
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            yield batch
+
+    def close(self):
+        self._stopped.set()
+        if self.process.poll() is None:
+            get_supervisor().stop([self.process])
+        self.process.wait()
+        get_supervisor().release(self.process)
+        self._thread.join(timeout=5)
+
+
+class StoredFrameReader:
+    """从模板帧仓库按批取帧：memmap切片不复制，只在混合前转成uint16"""
+
+    def __init__(self, stored, batch_frames=BATCH_FRAMES):
+        self.stored = stored
+        self.batch_frames = batch_frames
+        self.error = None
+
+    def batches(self):
+        frames = self.stored.frames
+        for start in range(0, len(frames), self.batch_frames):
+            batch = frames[start:start + self.batch_frames]
+            yield batch[..., :3].astype(np.uint16), batch[..., 3:4].astype(np.uint16)
+
+    def close(self):
+        pass
+
+
+class ClipStream:
+    """按输出帧号取出模板片段的帧，跨批时分段返回"""
+
+    def __init__(self, clip: LayerClip, reader):
+        self.clip = clip
+        self.reader = reader
+        self._batches = reader.batches()
+        self._pending = deque()        # [(起始输出帧号, 预乘rgb, alpha)]
+        self._next = clip.first_frame
+        self.exhausted = False
+
+    def _fill(self, upto):
+        while self._next < upto and not self.exhausted:
+            batch = next(self._batches, None)
+            if batch is None:
+                if self.reader.error is not None:
+                    # 解码失败不能当作模板结束，否则叠加层会悄悄消失
+                    raise self.reader.error
+                # 模板帧提前耗尽时按透明处理（对应 eof_action=pass）
+                self.exhausted = True
+                break
+            rgb, alpha = batch
+            self._pending.append((self._next, rgb, alpha))
+            self._next += len(rgb)
+
+    def chunks(self, lo, hi):
+        """输出帧 [lo, hi) 与片段重叠的部分：[(lo, hi, 预乘rgb, alpha)]"""
+        lo = max(lo, self.clip.first_frame)
+        hi = min(hi, self.clip.end_frame)
+        if lo >= hi:
+            return []
+        self._fill(hi)
+        result = []
+        for start, rgb, alpha in self._pending:
+            a, b = max(lo, start), min(hi, start + len(rgb))
+            if a < b:
+                result.append((a, b, rgb[a - start:b - start], alpha[a - start:b - start]))
+        # 已经用过的批次不再需要
+        while self._pending and self._pending[0][0] + len(self._pending[0][1]) <= hi:
+            self._pending.popleft()
+        return result
+
+
+def _describe_error(error):
+    if isinstance(error, subprocess.CalledProcessError):
+        return f"解码进程退出码 {error.returncode}: {error.stderr}"
+    return str(error)
+
+
+def _decode_cmd(path, seek, duration, filters, pix_fmt):
+    return (["ffmpeg", "-v", "error", "-nostdin"] + input_args(path, seek, duration) +
+            ["-map", "0:v:0", "-vf", ",".join(filters), "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"])
+
+
+def build_encoder_command(material_path, placements, output_path, output_args, width, height, fps, duration,
+                          time_shift=0.0, material_seek=None):
+    """编码进程：标准输入是合成好的rgb24帧，音频仍由ffmpeg按叠加时间混合"""
+    cmd = ["ffmpeg", "-v", "error", "-y",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", f"{fps:g}", "-i", "-"]
+    if material_seek is not None:
+        cmd += ["-ss", f"{material_seek[0]:.6f}", "-t", f"{material_seek[1]:.6f}"]
+    cmd += ["-i", material_path]
+    sources = []
+    for k, placement in enumerate(placements, start=2):
+        cmd += input_args(placement.template_path, *audio_window(placement))
+        sources.append(([], f"{k}:a"))
+    _, audio, _, aout = build_overlay_filters(placements, sources, base_audio="1:a", time_shift=time_shift)
+    # 输出参数里的 -pix_fmt 会覆盖这里的默认值
+    cmd += ["-filter_complex", ";".join(audio), "-map", "0:v", "-map", f"[{aout}]", "-pix_fmt", "yuv420p"]
+    return cmd + list(output_args) + ["-t", str(duration), output_path]
+
+
+def composite(material_path, placements: Sequence[LayerPlacement], output_path, output_args, duration, graph_plan,
+              blend_mode='normal', batch_frames=BATCH_FRAMES, queue_batches=QUEUE_BATCHES,
+              progress_callback=None, is_cancelled=None, time_shift=0.0, material_seek=None, frame_store=None):
+    """
+    用NumPy逐批合成各层并编码输出
+
+    素材和每个模板片段各一个解码进程（rawvideo管道），按批在主线程混合，结果写入编码进程。
+    时间语义与 build_layered_command 一致：输入级seek、时间戳平移、enable窗口、跳过全透明片段。
+
+    Args:
+        graph_plan: graph_planner.GraphPlan，提供输出帧率、画面尺寸、模板缩放和叠加位置
+        blend_mode: BLEND_MODES 中的混合模式
+        progress_callback: callback(百分比, 消息)，返回False时停止
+        is_cancelled: 返回True时停止，取消或失败时删除写了一半的输出文件
+        frame_store: frame_store.FrameStore，模板片段只解码一次，之后从内存映射文件读取
+
+    Returns:
+        tuple: (ok, msg)
+    """
+    blend = BLEND_MODES[blend_mode]
+    width, height, fps = graph_plan.width, graph_plan.height, graph_plan.fps
+    total_frames = math.ceil(duration * fps - _EPS)
+    clips = plan_clips(placements, graph_plan, time_shift)
+
+    material_cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+    if material_seek is not None:
+        material_cmd += ["-ss", f"{material_seek[0]:.6f}", "-t", f"{material_seek[1]:.6f}"]
+    material_cmd += ["-i", material_path, "-map", "0:v:0", "-vf", f"fps={fps:g},format=rgb24",
+                     "-frames:v", str(total_frames), "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+    readers = []
+    encoder = None
+    ok = False
+    stderr_log = StderrLog(_STDERR_LINES)
+    try:
+        material = FrameReader(material_cmd, width, height, 3, batch_frames, queue_batches)
+        readers.append(material)
+        sources = [('素材', material)]
+        streams = []
+        for clip in clips:
+            if frame_store is not None:
+                stored = frame_store.get(clip.path, clip.seek, clip.duration, fps, clip.width, clip.height, clip.filters)
+                reader = StoredFrameReader(stored, batch_frames)
+            else:
+                reader = FrameReader(_decode_cmd(clip.path, clip.seek, clip.duration, clip.filters, "rgba"),
+                                     clip.width, clip.height, 4, batch_frames, queue_batches, transform=premultiply)
+            readers.append(reader)
+            sources.append((clip.layer, reader))
+            streams.append(ClipStream(clip, reader))
+
+        encoder_cmd = build_encoder_command(material_path, placements, output_path, output_args,
+                                            width, height, fps, duration, time_shift, material_seek)
+        encoder = get_supervisor().popen(encoder_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        drain = threading.Thread(target=stderr_log.drain, args=(encoder.stderr,), daemon=True)
+        drain.start()
+
+        done = 0
+        for frames in material.batches():
+            lo, hi = done, done + len(frames)
+            for stream in streams:
+                clip = stream.clip
+                # 叠加区域超出画面时只混合重叠部分
+                w = min(clip.width, width - clip.x)
+                h = min(clip.height, height - clip.y)
+                if w <= 0 or h <= 0:
+                    continue
+                try:
+                    chunks = stream.chunks(lo, hi)
+                except subprocess.CalledProcessError as e:
+                    return False, f"读取{clip.layer}帧失败: {_describe_error(e)}"
+                for a, b, rgb, alpha in chunks:
+                    n = min(b - a, len(rgb))
+                    region = frames[a - lo:a - lo + n, clip.y:clip.y + h, clip.x:clip.x + w]
+                    region[...] = blend(region.astype(np.uint16), rgb[:n, :h, :w], alpha[:n, :h, :w])
+            try:
+                encoder.stdin.write(memoryview(frames))
+            except BrokenPipeError:
+                break
+            done = hi
+            if is_cancelled and is_cancelled():
+                return False, '处理已取消'
+            if progress_callback and progress_callback(min(done / total_frames * 100, 99.9),
+                                                       f"NumPy合成 {done}/{total_frames}帧") is False:
+                return False, '处理已取消'
+
+        for label, reader in sources:
+            if reader.error is not None:
+                return False, f"读取{label}帧失败: {_describe_error(reader.error)}"
+        encoder.stdin.close()
+        returncode = encoder.wait()
+        drain.join(timeout=5)
+        if returncode != 0:
+            return False, f"编码进程退出码 {returncode}: {stderr_log.summary()}"
+        if done == 0:
+            return False, "素材没有解码出任何帧"
+        if progress_callback:
+            progress_callback(100, "完成")
+        ok = True
+        return True, f"NumPy合成 {done} 帧"
+    finally:
+        for reader in readers:
+            reader.close()
+        if encoder is not None:
+            if encoder.poll() is None:
+                get_supervisor().stop([encoder])
+                encoder.wait()
+            get_supervisor().release(encoder)
+            if not ok and os.path.exists(output_path):
+                os.remove(output_path)
@@ -0,0 +1,206 @@
+import os
+import json
+import hashlib
+import subprocess
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from utils import probe_media_cached
+from process_supervisor import get_supervisor
+from layer_graph import LayerPlacement, plan_layer_placements, input_args, enable_window
+
+# 缓存文件格式变化时修改版本号
+PRECOMPOSITE_VERSION = 1
+# 时间比较容差（秒）
+_EPS = 1e-3
+
+
+@dataclass(frozen=True)
+class LayerSpan:
+    """图层在叠加结果中实际可见的部分：模板从 source_start 起播放 duration 秒，出现在 offset"""
+    path: str
+    source_start: float
+    offset: float
+    duration: float
+
+
+def layer_spans(placements: Sequence[LayerPlacement]) -> Tuple[float, List[LayerSpan]]:
+    """
+    把摆放方式归一化为可见片段，offset 相对最早出现的图层
+
+    Returns:
+        tuple: (最早出现时间, 片段列表)
+    """
+    base = min(p.offset for p in placements)
+    spans = []
+    for p in placements:
+        duration = p.trim_duration
+        if p.enable_until is not None:
+            duration = min(duration, p.enable_until)
+        spans.append(LayerSpan(p.template_path, p.trim_start if p.trim else 0.0, p.offset - base, duration))
+    return base, spans
+
+
+@dataclass
+class PrecompositeStack:
+    """
+    预先合成好的多层模板：一个带alpha的中间文件，音频已混好
+
+    各素材的叠加计划与 spans 一致时，可用一路叠加代替逐层叠加。
+    """
+    path: str
+    spans: Tuple[LayerSpan, ...]
+    duration: float
+
+    def match(self, placements: Sequence[LayerPlacement], material_duration) -> Optional[LayerPlacement]:
+        """
+        素材的叠加计划与预合成一致时返回替代用的单层摆放，否则返回None
+
+        图层因素材较短被截断时也视为一致：超出素材结尾的部分本来就会被裁掉。
+        """
+        if len(placements) != len(self.spans):
+            return None
+        base, spans = layer_spans(placements)
+        for stacked, span in zip(self.spans, spans):
+            if (stacked.path != span.path
+                    or abs(stacked.source_start - span.source_start) > _EPS
+                    or abs(stacked.offset - span.offset) > _EPS):
+                return None
+            if abs(stacked.duration - span.duration) <= _EPS:
+                continue
+            truncated = base + span.offset + span.duration >= material_duration - _EPS
+            if not (truncated and stacked.duration > span.duration):
+                return None
+        return LayerPlacement('stack', self.path, base, 0, self.duration, audio_weight=len(self.spans))
+
+
+def _cache_key(spans, width, height, fps):
+    files = []
+    for span in spans:
+        st = os.stat(span.path)
+        files.append([span.path, st.st_size, st.st_mtime_ns])
+    payload = json.dumps({
+        'version': PRECOMPOSITE_VERSION,
+        'spans': [[s.path, s.source_start, s.offset, s.duration] for s in spans],
+        'files': files,
+        'canvas': [width, height, fps],
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def build_precomposite_command(spans: Sequence[LayerSpan], output_path, width, height, fps, duration):
+    """
+    在透明画布上按顺序叠加各层，输出带alpha的qtrle视频，音频按出现时间延迟后混合
+
+    音频混合只做平均，最终与素材混音时按图层数加权，各模板的音量与逐层叠加时一致。
+    """
+    cmd = ["ffmpeg", "-v", "error", "-y",
+           "-f", "lavfi", "-i", f"color=c=black@0.0:s={width}x{height}:r={fps:g}:d={duration:.3f},format=rgba"]
+    # 每层按可见片段输入级seek，不解码片段之前的帧
+    for span in spans:
+        cmd += input_args(span.path, span.source_start, span.duration)
+
+    video = []
+    audio = []
+    prev = "0:v"
+    for n, span in enumerate(spans, start=1):
+        setpts = f"setpts=PTS-STARTPTS+{span.offset:.3f}/TB" if span.offset else "setpts=PTS-STARTPTS"
+        video.append(f"[{n}:v]{setpts}[c{n}]")
+        dst = f"s{n}"
+        # format=rgb：叠加结果保留alpha
+        video.append(f"[{prev}][c{n}]overlay=0:0:format=rgb:"
+                     f"{enable_window(span.offset, span.duration)}:eof_action=pass[{dst}]")
+        prev = dst
+        line = f"[{n}:a]asetpts=PTS-STARTPTS"
+        if span.offset > 0:
+            line += f",adelay={int(round(span.offset * 1000))}:all=1"
+        audio.append(line + f"[a{n}]")
+    video.append(f"[{prev}]format=rgba[vout]")
+    audio.append("".join(f"[a{n}]" for n in range(1, len(spans) + 1)) +
+                 f"amix=inputs={len(spans)}:duration=longest[aout]")
+
+    cmd += ["-filter_complex", ";".join(video + audio),
+            "-map", "[vout]", "-map", "[aout]",
+            "-c:v", "qtrle", "-c:a", "pcm_s16le", "-ar", "44100", "-ac", "2",
+            "-t", f"{duration:.3f}",
+            "-f", "mov", output_path]
+    return cmd
+
+
+def _prune(cache_dir, keep):
+    """只保留最近使用的 keep 个中间文件"""
+    try:
+        files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+                 if f.startswith("stack_") and f.endswith(".mov")]
+    except FileNotFoundError:
+        return
+    files.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+    for path in files[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def build_precomposite(spans: Sequence[LayerSpan], cache_dir, keep=16) -> PrecompositeStack:
+    """
+    生成（或复用缓存的）预合成文件
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg合成失败
+    """
+    infos = [probe_media_cached(span.path) for span in spans]
+    width = max(info.width or 0 for info in infos)
+    height = max(info.height or 0 for info in infos)
+    fps = max((info.fps or 0 for info in infos), default=0) or 25.0
+    duration = max(span.offset + span.duration for span in spans)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"stack_{_cache_key(spans, width, height, fps)}.mov")
+    if os.path.exists(path):
+        os.utime(path)
+        print(f"♻️ 复用预合成模板: {os.path.basename(path)}")
+    else:
+        tmp_path = path + ".part"
+        cmd = build_precomposite_command(spans, tmp_path, width, height, fps, duration)
+        result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        if result.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+        os.replace(tmp_path, path)
+        print(f"🧩 已预合成 {len(spans)} 层模板: {os.path.basename(path)}")
+        _prune(cache_dir, keep)
+    return PrecompositeStack(path=path, spans=tuple(spans), duration=duration)
+
+
+def plan_batch_precomposite(template_catalog, layers, material_durations, cache_dir, alpha_clips=None,
+                            keep=16, **timing) -> Optional[PrecompositeStack]:
+    """
+    批次中每个素材的模板和出现时间都相同时，预先把多层模板合成为一个文件
+
+    只在标准模式或精确定点模式、每层只有一个可选模板、至少两层时启用；
+    随机模式每个素材时间不同，无法共用。
+
+    Returns:
+        PrecompositeStack 或 None（不适用或合成失败，按逐层叠加处理）
+    """
+    if timing.get('random_timing') or timing.get('advanced_timing_enabled'):
+        return None
+    if len(layers) < 2 or not material_durations:
+        return None
+    chosen = {}
+    for layer in layers:
+        entries = template_catalog.entries(layer)
+        if len(entries) != 1:
+            return None
+        chosen[layer] = template_catalog.analyzed(entries[0])
+
+    # 以最长的素材作参考：较短素材上图层只会被截断，match 时视为一致
+    placements = plan_layer_placements(chosen, max(material_durations), alpha_clips=alpha_clips, **timing)
+    _, spans = layer_spans(placements)
+    try:
+        return build_precomposite(spans, cache_dir, keep=keep)
+    except Exception as e:
+        print(f"⚠️ 预合成失败，按逐层叠加处理: {e}")
+        return None
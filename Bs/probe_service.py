@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import subprocess
+import threading
+import weakref
+from typing import Optional
+
+from utils import MediaInfo, MP4_EXTENSIONS, _parse_media_info, read_mp4_header
+from utils import configure_probe_slots, probe_slots, probe_slot_limit
+from media_cache import get_media_cache
+from process_supervisor import get_supervisor, group_kwargs
+
+
+class ProbeService:
+    """
+    供Gradio异步事件使用的ffprobe服务
+
+    - 同时运行的ffprobe进程数受进程内共用名额限制，与同步的 probe_media 共用同一上限
+    - 同一路径的并发请求共享同一次探测
+    - 每个请求可设置等待超时，探测本身超过 probe_timeout 会被终止
+    - 探测结果写入元数据缓存，与同步代码共用
+    """
+
+    def __init__(self, max_concurrent=None, probe_timeout=30.0, ffprobe="ffprobe", cache=None):
+        # 默认用 utils.probe_slots() 的共用名额；单独给出上限时只限制本服务
+        if max_concurrent is None:
+            self.slots, self.max_concurrent = probe_slots(), probe_slot_limit()
+        else:
+            self.slots, self.max_concurrent = threading.BoundedSemaphore(max_concurrent), max_concurrent
+        self.probe_timeout = probe_timeout
+        self.ffprobe = ffprobe
+        self._cache = cache
+        # 进行中的探测任务绑定事件循环，每个循环各保存一份
+        self._loops = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self.spawned = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.running = 0
+        self.peak_running = 0
+
+    @property
+    def cache(self):
+        return self._cache if self._cache is not None else get_media_cache()
+
+    def _inflight(self):
+        loop = asyncio.get_running_loop()
+        inflight = self._loops.get(loop)
+        if inflight is None:
+            inflight = self._loops[loop] = {}
+        return inflight
+
+    async def _acquire_slot(self):
+        # 名额是线程信号量；非阻塞轮询，不占线程池，任务被取消时也不会漏还名额
+        while not self.slots.acquire(blocking=False):
+            await asyncio.sleep(0.02)
+
+    async def probe(self, path, timeout: Optional[float] = None) -> MediaInfo:
+        """
+        异步探测媒体信息
+
+        Args:
+            path: 媒体文件路径
+            timeout: 本次请求最多等待的秒数，None表示等到探测结束
+
+        Raises:
+            asyncio.TimeoutError: 等待超时或ffprobe运行超时
+            subprocess.CalledProcessError: ffprobe返回非零
+        """
+        path = str(path)
+        # 缓存读SQLite并持有线程锁，放到线程里避免阻塞事件循环
+        info = await asyncio.to_thread(self.cache.get, path)
+        if info is not None:
+            return info
+
+        inflight = self._inflight()
+        task = inflight.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._run_probe(path))
+            inflight[path] = task
+            task.add_done_callback(lambda _t, p=path: inflight.pop(p, None))
+        else:
+            self.coalesced += 1
+        # shield: 单个请求超时不影响共享同一探测的其他请求
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    async def duration(self, path, timeout: Optional[float] = None) -> Optional[float]:
+        """获取时长，MP4/MOV先读文件头，失败返回None"""
+        path = str(path)
+        if path.lower().endswith(MP4_EXTENSIONS):
+            info = await asyncio.to_thread(read_mp4_header, path)
+            if info is not None:
+                return info.duration
+        try:
+            info = await self.probe(path, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⏰ 获取视频时长超时: {os.path.basename(path)}")
+            return None
+        except Exception as e:
+            print(f"获取视频时长失败: {e}")
+            return None
+        return info.duration
+
+    async def _run_probe(self, path) -> MediaInfo:
+        await self._acquire_slot()
+        try:
+            # 排队期间可能已被同步代码写入缓存
+            info = await asyncio.to_thread(self.cache.get, path)
+            if info is not None:
+                return info
+            with self._stats_lock:
+                self.spawned += 1
+                self.running += 1
+                self.peak_running = max(self.peak_running, self.running)
+            try:
+                stdout, stderr, returncode = await self._exec(path)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+        finally:
+            self.slots.release()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.ffprobe, stdout, stderr)
+        info = _parse_media_info(path, json.loads(stdout.decode('utf-8', errors='ignore') or '{}'))
+        await asyncio.to_thread(self.cache.put, path, info)
+        return info
+
+    async def _exec(self, path):
+        proc = await asyncio.create_subprocess_exec(
+            self.ffprobe, "-v", "error",
+            "-show_format", "-show_streams",
+            "-of", "json",
+            path,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **group_kwargs()
+        )
+        supervisor = get_supervisor()
+        supervisor.register(proc)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), self.probe_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # 经登记处停止整个进程组；放到线程里，等待宽限期时事件循环仍能回收子进程
+            await asyncio.to_thread(supervisor.stop, [proc])
+            await proc.wait()
+            print(f"⏰ ffprobe超时已终止: {os.path.basename(path)}")
+            raise
+        finally:
+            supervisor.release(proc)
+        return stdout, stderr, proc.returncode
+
+    def stats(self):
+        return {
+            'spawned': self.spawned,
+            'coalesced': self.coalesced,
+            'timeouts': self.timeouts,
+            'running': self.running,
+            'peak_running': self.peak_running,
+            'max_concurrent': self.max_concurrent,
+        }
+
+
+_default_service = None
+_service_lock = threading.Lock()
+
+
+def configure_probe_service(max_concurrent=4, probe_timeout=30.0, **kwargs):
+    """设置全局探测服务；max_concurrent 是整个进程的ffprobe上限，同步探测同样受限"""
+    global _default_service
+    with _service_lock:
+        configure_probe_slots(max_concurrent)
+        _default_service = ProbeService(probe_timeout=probe_timeout, **kwargs)
+    return _default_service
+
+
+def get_probe_service():
+    """获取全局探测服务，未配置时使用默认参数创建"""
+    global _default_service
+    with _service_lock:
+        if _default_service is None:
+            _default_service = ProbeService()
+        return _default_service
@@ -0,0 +1,271 @@
+import os
+import time
+import signal
+import atexit
+import threading
+import subprocess
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+_IS_WINDOWS = os.name == 'nt'
+
+# 当前线程（或asyncio任务）所属的任务和批次，由 scope() 设置，popen 时自动带上
+_current_job = contextvars.ContextVar('supervisor_job', default=None)
+_current_batch = contextvars.ContextVar('supervisor_batch', default=None)
+
+
+class ProcessCancelled(RuntimeError):
+    """所属任务或批次已被取消，不再启动新进程"""
+
+
+def group_kwargs():
+    """让子进程自成一个进程组的 Popen 参数，信号发给整组"""
+    if _IS_WINDOWS:
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+@dataclass(eq=False)
+class Child:
+    """登记中的子进程"""
+    process: object                 # subprocess.Popen 或 asyncio.subprocess.Process
+    job: Optional[str] = None
+    batch: Optional[str] = None
+    grouped: bool = True            # 是否自成进程组（由 popen 或 group_kwargs() 启动）
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def alive(self):
+        poll = getattr(self.process, 'poll', None)
+        return (poll() if poll else self.process.returncode) is None
+
+
+class ProcessSupervisor:
+    """
+    所有ffmpeg/ffprobe子进程的登记处
+
+    每个子进程自成一个进程组，按 pid、任务、批次三张表登记，取消一个任务或批次只查一次表。
+    停止时先向整组发 SIGTERM，kill_grace 秒内没退出的再发 SIGKILL。
+    任务或批次被取消后，其中的 popen 直接抛出 ProcessCancelled，避免取消后又启动新进程。
+    """
+
+    def __init__(self, kill_grace=0.5):
+        self.kill_grace = kill_grace
+        self._lock = threading.Lock()
+        self._children: Dict[int, Child] = {}
+        self._by_job: Dict[str, Set[int]] = {}
+        self._by_batch: Dict[str, Set[int]] = {}
+        self._scopes: Dict[tuple, int] = {}         # 正在运行的 ('job'/'batch', id) -> 嵌套层数
+        self._cancelled: Set[tuple] = set()
+
+    # ---------- 任务范围 ----------
+
+    @contextmanager
+    def scope(self, job=None, batch=None):
+        """在此范围内启动的子进程记到 job/batch 名下，未指定的沿用外层"""
+        job = job if job is not None else _current_job.get()
+        batch = batch if batch is not None else _current_batch.get()
+        keys = [k for k in (('job', job), ('batch', batch)) if k[1] is not None]
+        tokens = (_current_job.set(job), _current_batch.set(batch))
+        with self._lock:
+            for key in keys:
+                self._scopes[key] = self._scopes.get(key, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._scopes[key] -= 1
+                    if not self._scopes[key]:
+                        del self._scopes[key]
+            _current_batch.reset(tokens[1])
+            _current_job.reset(tokens[0])
+
+    def is_cancelled(self, job=None, batch=None):
+        job = job if job is not None else _current_job.get()
+        batch = batch if batch is not None else _current_batch.get()
+        return self._is_cancelled(job, batch)
+
+    def _is_cancelled(self, job, batch):
+        return ('job', job) in self._cancelled or ('batch', batch) in self._cancelled
+
+    # ---------- 启动和登记 ----------
+
+    def popen(self, command, job=None, batch=None, **kwargs) -> subprocess.Popen:
+        """启动并登记一个子进程，参数同 subprocess.Popen"""
+        job = job if job is not None else _current_job.get()
+        batch = batch if batch is not None else _current_batch.get()
+        with self._lock:
+            if self._is_cancelled(job, batch):
+                raise ProcessCancelled(f"任务已取消: {job or batch}")
+        # 启动进程可能很慢，不占着锁，其他线程的登记和取消不必等待
+        process = subprocess.Popen(command, **group_kwargs(), **kwargs)
+        child = Child(process, job, batch)
+        with self._lock:
+            self._add(child)
+            cancelled = self._is_cancelled(job, batch)
+        if cancelled:
+            # 启动期间被取消：取消时还没登记，没被停止，这里补上
+            self._stop_children([child])
+            process.wait()
+            self.release(process)
+            raise ProcessCancelled(f"任务已取消: {job or batch}")
+        return process
+
+    def run(self, command, timeout=None, check=False, capture_output=False, input=None,
+            job=None, batch=None, **kwargs) -> subprocess.CompletedProcess:
+        """subprocess.run 的替代，超时或异常时停止整个进程组"""
+        if capture_output:
+            kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+        if input is not None:
+            kwargs['stdin'] = subprocess.PIPE
+        process = self.popen(command, job=job, batch=batch, **kwargs)
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except BaseException:
+            self.stop([process])
+            process.wait()
+            raise
+        finally:
+            self.release(process)
+        result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+        if check:
+            result.check_returncode()
+        return result
+
+    def register(self, process, job=None, batch=None):
+        """登记由别处启动的子进程（如asyncio子进程），启动时需带上 group_kwargs()"""
+        job = job if job is not None else _current_job.get()
+        batch = batch if batch is not None else _current_batch.get()
+        with self._lock:
+            self._add(Child(process, job, batch))
+        return process
+
+    def release(self, process):
+        """子进程结束后注销"""
+        with self._lock:
+            child = self._children.pop(process.pid, None)
+            if child is None or child.process is not process:
+                if child is not None:
+                    self._children[child.pid] = child
+                return
+            for table, key in ((self._by_job, child.job), (self._by_batch, child.batch)):
+                pids = table.get(key)
+                if pids is not None:
+                    pids.discard(child.pid)
+                    if not pids:
+                        del table[key]
+
+    def _add(self, child):
+        self._children[child.pid] = child
+        if child.job is not None:
+            self._by_job.setdefault(child.job, set()).add(child.pid)
+        if child.batch is not None:
+            self._by_batch.setdefault(child.batch, set()).add(child.pid)
+
+    def children(self, job=None, batch=None) -> List[Child]:
+        """登记中的子进程，可按任务或批次筛选"""
+        with self._lock:
+            if job is not None:
+                pids = self._by_job.get(job, ())
+            elif batch is not None:
+                pids = self._by_batch.get(batch, ())
+            else:
+                pids = self._children
+            return [self._children[pid] for pid in pids]
+
+    # ---------- 取消 ----------
+
+    def cancel_job(self, job):
+        """取消一个任务：停止其全部子进程，之后不再为它启动新进程"""
+        with self._lock:
+            self._cancelled.add(('job', job))
+            targets = [self._children[pid] for pid in self._by_job.get(job, ())]
+        return self._stop_children(targets)
+
+    def cancel_batch(self, batch):
+        """取消一个批次的全部任务"""
+        with self._lock:
+            self._cancelled.add(('batch', batch))
+            targets = [self._children[pid] for pid in self._by_batch.get(batch, ())]
+        return self._stop_children(targets)
+
+    def cancel_all(self):
+        """紧急停止：取消所有正在运行的任务和批次，停止全部登记的子进程"""
+        with self._lock:
+            self._cancelled.update(self._scopes)
+            targets = list(self._children.values())
+        return self._stop_children(targets)
+
+    def reset(self):
+        """清除取消标记，新的处理开始前调用"""
+        with self._lock:
+            self._cancelled.clear()
+
+    def stop(self, processes):
+        """停止指定的子进程（整组），返回被停止的数量"""
+        with self._lock:
+            targets = [self._child(p) for p in processes]
+        return self._stop_children(targets)
+
+    def signal(self, process, sig):
+        """向子进程发一个信号后立即返回，登记过的发给整组；由调用方自己决定何时升级"""
+        with self._lock:
+            child = self._child(process)
+        self._signal(child, sig)
+
+    def _child(self, process):
+        # 未登记的进程（或pid已被复用）只能发给它自己
+        child = self._children.get(getattr(process, 'pid', None))
+        if child is None or child.process is not process:
+            return Child(process, grouped=False)
+        return child
+
+    def _stop_children(self, children):
+        alive = [c for c in children if c.alive()]
+        for child in alive:
+            self._signal(child, signal.SIGTERM)
+        deadline = time.monotonic() + self.kill_grace
+        pending = alive
+        while pending and time.monotonic() < deadline:
+            time.sleep(0.02)
+            pending = [c for c in pending if c.alive()]
+        for child in pending:
+            self._signal(child, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        if alive:
+            print(f"🛑 已停止 {len(alive)} 个子进程（强制结束 {len(pending)} 个）")
+        return len(alive)
+
+    @staticmethod
+    def _signal(child, sig):
+        try:
+            if child.grouped and not _IS_WINDOWS:
+                os.killpg(child.pid, sig)
+            elif sig == signal.SIGTERM:
+                child.process.terminate()
+            else:
+                child.process.kill()
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+
+
+_default_supervisor = ProcessSupervisor()
+# 子进程各自成组，不再随终端的 Ctrl+C 一起退出，解释器退出时统一停止
+atexit.register(lambda: _default_supervisor.cancel_all())
+
+
+def configure_supervisor(kill_grace=None):
+    """设置全局子进程登记处的参数"""
+    if kill_grace is not None:
+        _default_supervisor.kill_grace = kill_grace
+    return _default_supervisor
+
+
+def get_supervisor() -> ProcessSupervisor:
+    """获取全局子进程登记处"""
+    return _default_supervisor
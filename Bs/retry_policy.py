@@ -0,0 +1,171 @@
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+# 失败类别
+PERMANENT = 'permanent'     # 输入缺失、格式损坏、滤镜图或编码参数错误：重试结果不会变
+RESOURCE = 'resource'       # 内存不足、被系统杀掉、卡住或超时：降级后重试
+TRANSIENT = 'transient'     # 原因不明：原样重试
+
+PERMANENT_ERRORS = {'missing_file', 'permission', 'disk_full', 'invalid_data', 'filter_graph', 'encoder'}
+RESOURCE_ERRORS = {'memory'}
+
+# x264预设从快到慢
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast",
+                "medium", "slow", "slower", "veryslow", "placebo"]
+# 降低分辨率时的缩放比例，宽高保持偶数
+SCALE_FACTOR = 0.75
+DEFAULT_LADDER = ("faster_preset", "fewer_threads", "lower_resolution")
+
+
+def classify_failure(attempt) -> str:
+    """
+    按一次尝试的统计（看门狗决定、错误类别、退出码）判断失败类别
+
+    被信号杀掉（退出码为负或137，通常是内存不足被系统终止）视为资源不足。
+    """
+    if attempt.get('verdict') in ('stall', 'timeout'):
+        return RESOURCE
+    error_class = attempt.get('error_class')
+    if error_class in PERMANENT_ERRORS:
+        return PERMANENT
+    if error_class in RESOURCE_ERRORS:
+        return RESOURCE
+    returncode = attempt.get('returncode')
+    if returncode is not None and (returncode < 0 or returncode == 137):
+        return RESOURCE
+    return TRANSIENT
+
+
+def _last_input(args):
+    return max((i for i, arg in enumerate(args) if arg == "-i"), default=-1)
+
+
+def faster_preset(command) -> Optional[List[str]]:
+    """x264预设加快两档，已是 ultrafast 或没有 -preset 时返回None"""
+    args = list(command)
+    changed = False
+    for i in range(len(args) - 1):
+        if args[i] == "-preset" and args[i + 1] in X264_PRESETS:
+            level = X264_PRESETS.index(args[i + 1])
+            if level > 0:
+                args[i + 1] = X264_PRESETS[max(level - 2, 0)]
+                changed = True
+    return args if changed else None
+
+
+def fewer_threads(command) -> Optional[List[str]]:
+    """输出级编码线程减半（自动时改为CPU核数的一半），已是1时返回None"""
+    args = list(command)
+    half_cpus = max(1, (os.cpu_count() or 2) // 2)
+    changed = False
+    positions = [i for i in range(_last_input(args) + 1, len(args) - 1) if args[i] == "-threads"]
+    for i in positions:
+        try:
+            threads = int(args[i + 1])
+        except ValueError:
+            continue
+        fewer = half_cpus if threads == 0 else max(1, threads // 2)
+        if fewer < threads or threads == 0:
+            args[i + 1] = str(fewer)
+            changed = True
+    if not positions:
+        args[-1:-1] = ["-threads", str(half_cpus)]
+        changed = True
+    return args if changed else None
+
+
+def lower_resolution(command, factor=SCALE_FACTOR) -> Optional[List[str]]:
+    """
+    输出画面按比例缩小
+
+    有 -filter_complex 时缩放每个输出的第一个 -map 标签（本项目的命令里视频总是先映射）；
+    有 -vf 时追加 scale；两者都没有时加一个 -vf。复制视频流（-c:v copy）时返回None。
+    """
+    args = list(command)
+    if any(args[i] in ("-c:v", "-vcodec") and args[i + 1] == "copy" for i in range(len(args) - 1)):
+        return None
+    scale = f"scale=trunc(iw*{factor:g}/2)*2:trunc(ih*{factor:g}/2)*2"
+    if "-filter_complex" in args:
+        graph_at = args.index("-filter_complex") + 1
+        extra = []
+        for i in range(graph_at + 1, len(args) - 1):
+            # 每个输出的 -map 连在一起，连续一组里的第一个是视频
+            if args[i] != "-map" or args[i - 2] == "-map":
+                continue
+            label = args[i + 1]
+            if label.startswith("[") and label.endswith("]"):
+                scaled = f"{label[1:-1]}_lowres"
+                extra.append(f"{label}{scale}[{scaled}]")
+                args[i + 1] = f"[{scaled}]"
+        if not extra:
+            return None
+        args[graph_at] = ";".join([args[graph_at]] + extra)
+        return args
+    for i in range(len(args) - 1):
+        if args[i] in ("-vf", "-filter:v"):
+            args[i + 1] = f"{args[i + 1]},{scale}"
+            return args
+    args[-1:-1] = ["-vf", scale]
+    return args
+
+
+FALLBACKS = {
+    'faster_preset': faster_preset,
+    'fewer_threads': fewer_threads,
+    'lower_resolution': lower_resolution,
+}
+
+
+@dataclass
+class RetryDecision:
+    """一次失败后的决定"""
+    retry: bool
+    command: Optional[List[str]] = None
+    fallback: Optional[str] = None      # 这次重试新加的降级，原样重试时为None
+    wait: float = 0.0
+    reason: str = ""
+
+
+@dataclass
+class RetryState:
+    """一个任务已经做过的尝试"""
+    attempts: int = 0
+    transient_retries: int = 0
+    rung: int = 0                               # 降级阶梯下一级的位置
+    fallbacks: List[str] = field(default_factory=list)
+
+
+class RetryPolicy:
+    """
+    按失败类别决定是否重试
+
+    - 永久性错误：不重试
+    - 资源不足：沿降级阶梯（更快的x264预设、更少的线程、更低的分辨率）逐级叠加后重试，
+      不适用于当前命令的一级直接跳过；阶梯用完后按原因不明处理
+    - 原因不明：原样重试最多 transient_retries 次，指数退避
+    """
+
+    def __init__(self, ladder: Sequence[str] = DEFAULT_LADDER, transient_retries=1, backoff=1.0):
+        unknown = [name for name in ladder if name not in FALLBACKS]
+        if unknown:
+            raise ValueError(f"未知的降级方式: {unknown}")
+        self.ladder = list(ladder)
+        self.transient_retries = transient_retries
+        self.backoff = backoff
+
+    def decide(self, failure, command, state: RetryState) -> RetryDecision:
+        if failure == PERMANENT:
+            return RetryDecision(False, reason="永久性错误，不重试")
+        if failure == RESOURCE:
+            while state.rung < len(self.ladder):
+                name = self.ladder[state.rung]
+                state.rung += 1
+                degraded = FALLBACKS[name](command)
+                if degraded is not None:
+                    return RetryDecision(True, degraded, name, self.backoff, f"资源不足，降级: {name}")
+        if state.transient_retries < self.transient_retries:
+            wait = self.backoff * 2 ** state.transient_retries
+            state.transient_retries += 1
+            return RetryDecision(True, list(command), None, wait, "原样重试")
+        return RetryDecision(False, reason="重试次数已用完")
@@ -0,0 +1,205 @@
+import os
+import glob
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from utils import MediaInfo, probe_media_cached
+from process_supervisor import get_supervisor
+from keyframe_index import KeyframeIndex, get_keyframe_index
+
+# 重编码片段要与直接复制的片段无缝拼接，只支持这些源格式
+SMART_RENDER_VIDEO_CODECS = ('h264',)
+SMART_RENDER_PIX_FMTS = ('yuv420p', 'yuvj420p')
+SMART_RENDER_AUDIO_CODECS = ('aac',)
+# 重编码区间超过素材时长的该比例时，整段编码更简单，收益也不大
+MAX_RENDER_RATIO = 0.6
+
+
+@dataclass
+class SmartRenderPlan:
+    """
+    智能渲染计划：只重编码 [render_start, render_end)，其余部分直接复制
+
+    render_start 为关键帧时间（或0），render_end 为关键帧时间（或素材结尾）。
+    """
+    render_start: float
+    render_end: float
+    duration: float
+
+    @property
+    def render_duration(self):
+        return self.render_end - self.render_start
+
+    @property
+    def has_head(self):
+        return self.render_start > 0
+
+    @property
+    def has_tail(self):
+        return self.render_end < self.duration
+
+    @property
+    def ratio(self):
+        return self.render_duration / self.duration if self.duration else 1.0
+
+
+def merge_windows(windows, duration) -> List[Tuple[float, float]]:
+    """把各层的 [开始, 结束) 时间窗裁剪到素材范围内并合并重叠部分"""
+    clipped = sorted((max(0.0, s), min(duration, e)) for s, e in windows if min(duration, e) > max(0.0, s))
+    merged = []
+    for start, end in clipped:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def check_source(info: MediaInfo) -> Optional[str]:
+    """检查素材能否与重编码片段直接拼接，可以时返回None，否则返回原因"""
+    video = info.video
+    if video is None:
+        return "素材没有视频流"
+    if video.codec_name not in SMART_RENDER_VIDEO_CODECS:
+        return f"视频编码 {video.codec_name} 不支持直接复制拼接"
+    if video.pix_fmt not in SMART_RENDER_PIX_FMTS:
+        return f"像素格式 {video.pix_fmt or '未知'} 不支持直接复制拼接"
+    audio = info.audio
+    if audio is not None:
+        if audio.codec_name not in SMART_RENDER_AUDIO_CODECS:
+            return f"音频编码 {audio.codec_name} 不支持直接复制拼接"
+        if not audio.sample_rate or not audio.channels:
+            return "无法获取音频采样率和声道数"
+    return None
+
+
+def plan_smart_render(windows, duration, keyframes: KeyframeIndex,
+                      max_ratio=MAX_RENDER_RATIO) -> Tuple[Optional[SmartRenderPlan], str]:
+    """
+    根据各层叠加时间窗计算重编码区间，向外对齐到关键帧
+
+    多个时间窗取整体范围，只重编码一段。
+
+    Returns:
+        tuple: (计划, 原因)，不适合智能渲染时计划为None
+    """
+    merged = merge_windows(windows, duration)
+    if not merged:
+        return None, "没有需要叠加的时间段"
+    first, last = merged[0][0], merged[-1][1]
+    start = keyframes.nearest_keyframe_before(first) or 0.0
+    end = keyframes.nearest_keyframe_after(last)
+    if end is None or end >= duration:
+        end = duration
+    plan = SmartRenderPlan(render_start=start, render_end=end, duration=duration)
+    if not plan.has_head and not plan.has_tail:
+        return None, "叠加时间段覆盖整段素材"
+    if plan.ratio > max_ratio:
+        return None, f"重编码区间占素材{plan.ratio:.0%}，直接整段编码"
+    return plan, ""
+
+
+def plan_for_material(material_path, duration, windows, max_ratio=MAX_RENDER_RATIO,
+                      output_fps=None) -> Tuple[Optional[SmartRenderPlan], Optional[MediaInfo], str]:
+    """
+    探测素材（走缓存）、读取关键帧索引（走缓存）并计算智能渲染计划
+
+    output_fps 为整段编码时的输出帧率：直接复制的片段保持素材帧率，
+    两者不同时不做智能渲染，免得同一批输出帧率不一致。
+    """
+    try:
+        info = probe_media_cached(material_path)
+    except Exception as e:
+        return None, None, f"素材探测失败: {e}"
+    reason = check_source(info)
+    if reason:
+        return None, info, reason
+    if output_fps and (not info.fps or abs(info.fps - output_fps) > 0.01):
+        return None, info, f"素材帧率 {info.fps or '未知'} 与输出帧率 {output_fps:g} 不同"
+    try:
+        keyframes = get_keyframe_index(material_path)
+    except Exception as e:
+        return None, info, f"关键帧索引失败: {e}"
+    if not len(keyframes):
+        return None, info, "素材没有关键帧信息"
+    plan, reason = plan_smart_render(windows, duration, keyframes, max_ratio=max_ratio)
+    return plan, info, reason
+
+
+def output_args(info: MediaInfo, preset, crf, audio_bitrate):
+    """重编码片段的编码参数，帧率、像素格式、采样率、声道与素材一致才能直接拼接"""
+    args = [
+        "-c:v", "libx264",
+        "-preset", str(preset),
+        "-crf", str(crf),
+        "-pix_fmt", info.video.pix_fmt,
+    ]
+    audio = info.audio
+    if audio is not None:
+        args += [
+            "-c:a", "aac",
+            "-b:a", audio_bitrate,
+            "-ar", str(audio.sample_rate),
+            "-ac", str(audio.channels),
+        ]
+    return args
+
+
+def _concat_line(path):
+    # concat列表中单引号需要转义
+    return "file '" + os.path.abspath(path).replace("'", "'\\''") + "'\n"
+
+
+def assemble(material_path, plan: SmartRenderPlan, rendered_path, output_path, workdir):
+    """
+    用segment复用器在关键帧处把素材直接复制切开，替换中间片段后用concat复用器拼接
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    split_times = []
+    if plan.has_head:
+        split_times.append(plan.render_start)
+    if plan.has_tail:
+        split_times.append(plan.render_end)
+    split_cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-i", material_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_times", ",".join(f"{t:.6f}" for t in split_times),
+        "-segment_format", "mp4",
+        "-reset_timestamps", "1",
+        os.path.join(workdir, "seg%03d.mp4")
+    ]
+    result = get_supervisor().run(split_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.returncode != 0:
+        return False, f"素材切分失败: {result.stderr[-300:]}"
+    segments = sorted(glob.glob(os.path.join(workdir, "seg*.mp4")))
+    if len(segments) != len(split_times) + 1:
+        return False, f"素材切分结果异常: 期望{len(split_times) + 1}段，实际{len(segments)}段"
+
+    parts = []
+    if plan.has_head:
+        parts.append(segments[0])
+    parts.append(rendered_path)
+    if plan.has_tail:
+        parts.append(segments[-1])
+    list_path = os.path.join(workdir, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.writelines(_concat_line(p) for p in parts)
+
+    concat_cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "concat", "-safe", "0",
+        "-i", list_path,
+        "-map", "0",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        output_path
+    ]
+    result = get_supervisor().run(concat_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.returncode != 0:
+        return False, f"片段拼接失败: {result.stderr[-300:]}"
+    return True, "拼接完成"
@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+from utils import probe_media_cached
+from alpha_analyzer import get_alpha_profile
+
+TEMPLATE_EXTENSIONS = ('.mp4', '.mov', '.avi')
+# 短于该时长的全透明片段不单独跳过，拆分叠加的开销反而更大
+MIN_TRANSPARENT_RANGE = 0.5
+
+
+@dataclass(frozen=True)
+class TemplateEntry:
+    """已验证的模板文件及其探测信息"""
+    layer: str
+    path: str
+    duration: float
+    has_alpha: bool
+    width: int
+    height: int
+    transparent_ranges: Tuple[Tuple[float, float], ...] = ()  # 全透明的时间段
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+
+def transparent_ranges(path, info, min_duration=MIN_TRANSPARENT_RANGE):
+    """按模板帧率逐帧分析alpha，返回全透明的时间段，无alpha或分析失败时返回空"""
+    if not info.has_alpha:
+        return ()
+    try:
+        profile = get_alpha_profile(path, sample_fps=info.fps or 25.0)
+    except Exception as e:
+        print(f"⚠️ 模板透明度分析失败 {os.path.basename(path)}: {e}")
+        return ()
+    return tuple(profile.transparent_ranges(min_duration))
+
+
+class TemplateCatalog:
+    """
+    模板目录快照，每批次构建一次，构建后只读，可被多个工作线程共享
+
+    全透明片段不在构建时分析：整个模板库逐帧解码alpha太慢，且多数模板本批次用不到。
+    任务选中模板时（choose / analyzed）才分析，每个模板只分析一次。
+    """
+
+    def __init__(self, layers: Dict[str, Tuple[TemplateEntry, ...]], signature=None, generation=0,
+                 analyze_transparency=False):
+        self._layers = dict(layers)
+        self._by_path = {entry.path: entry for entries in self._layers.values() for entry in entries}
+        self.signature = signature
+        self.generation = generation
+        self.analyze_transparency = analyze_transparency
+        self._analyzed: Dict[str, TemplateEntry] = {}
+        self._analyze_locks: Dict[str, threading.Lock] = {}
+        self._analyze_guard = threading.Lock()
+
+    @staticmethod
+    def dir_signature(template_dirs):
+        """各模板目录的(路径, mtime_ns)，目录内增删文件后签名会变化"""
+        signature = []
+        for layer in sorted(template_dirs):
+            d = str(template_dirs[layer])
+            try:
+                mtime_ns = os.stat(d).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            signature.append((layer, d, mtime_ns))
+        return tuple(signature)
+
+    @classmethod
+    def build(cls, template_dirs, clean_filename=None, generation=0, analyze_transparency=True):
+        """
+        扫描模板目录并验证每个模板（探测结果走元数据缓存）
+
+        Args:
+            template_dirs: {图层名: 模板目录}
+            clean_filename: 可选的文件名清理函数，返回清理后的路径
+            generation: 构建时的失效代数
+            analyze_transparency: 选中带alpha的模板时是否分析全透明片段（分析结果走元数据缓存）
+        """
+        signature = cls.dir_signature(template_dirs)
+        layers = {}
+        for layer, d in template_dirs.items():
+            if not os.path.isdir(d):
+                continue
+            entries = []
+            for f in sorted(os.listdir(d)):
+                if not f.lower().endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                path = os.path.join(d, f)
+                if clean_filename is not None:
+                    path = clean_filename(path)
+                try:
+                    info = probe_media_cached(path)
+                except Exception as e:
+                    print(f"⚠️ 模板验证失败 {f}: {e}")
+                    continue
+                if not info.container or info.duration is None:
+                    print(f"⚠️ 模板验证失败 {f}: 无法获取格式或时长信息")
+                    continue
+                entries.append(TemplateEntry(
+                    layer=layer,
+                    path=path,
+                    duration=info.duration,
+                    has_alpha=info.has_alpha,
+                    width=info.width,
+                    height=info.height
+                ))
+            if entries:
+                layers[layer] = tuple(entries)
+        # 重命名文件会改变目录mtime，按构建后的状态记录签名
+        if clean_filename is not None:
+            signature = cls.dir_signature(template_dirs)
+        return cls(layers, signature=signature, generation=generation,
+                   analyze_transparency=analyze_transparency)
+
+    def layers(self):
+        return list(self._layers)
+
+    def entries(self, layer):
+        return self._layers.get(layer, ())
+
+    def get(self, path) -> Optional[TemplateEntry]:
+        return self._by_path.get(path)
+
+    def analyzed(self, entry: TemplateEntry) -> TemplateEntry:
+        """带上全透明片段的模板条目，第一次用到时才分析"""
+        if not self.analyze_transparency or not entry.has_alpha:
+            return entry
+        with self._analyze_guard:
+            done = self._analyzed.get(entry.path)
+            if done is not None:
+                return done
+            lock = self._analyze_locks.setdefault(entry.path, threading.Lock())
+        # 多个任务同时选中同一个模板时只分析一次
+        with lock:
+            done = self._analyzed.get(entry.path)
+            if done is None:
+                try:
+                    info = probe_media_cached(entry.path)
+                except Exception as e:
+                    print(f"⚠️ 模板透明度分析失败 {entry.name}: {e}")
+                    done = entry
+                else:
+                    done = replace(entry, transparent_ranges=transparent_ranges(entry.path, info))
+                with self._analyze_guard:
+                    self._analyzed[entry.path] = done
+        return done
+
+    def choose(self, layer, force_template=None):
+        """随机选择一个模板，force_template 匹配文件名时优先使用"""
+        entries = self.entries(layer)
+        if not entries:
+            return None
+        if force_template:
+            matched = [e for e in entries if force_template in e.name]
+            if matched:
+                return self.analyzed(matched[0])
+        return self.analyzed(random.choice(entries))
+
+    def __bool__(self):
+        return bool(self._layers)
+
+
+_catalog = None
+_generation = 0
+_catalog_lock = threading.Lock()
+
+
+def invalidate_template_catalog():
+    """上传或压缩模板后调用，下次获取时重新构建"""
+    global _catalog, _generation
+    with _catalog_lock:
+        _generation += 1
+        _catalog = None
+
+
+def get_template_catalog(template_dirs, clean_filename=None):
+    """
+    获取模板目录快照，未失效且目录未变化时直接复用上次构建的结果
+    """
+    global _catalog
+    with _catalog_lock:
+        catalog = _catalog
+        generation = _generation
+        if (catalog is not None and catalog.generation == generation
+                and catalog.signature == TemplateCatalog.dir_signature(template_dirs)):
+            return catalog
+
+    catalog = TemplateCatalog.build(template_dirs, clean_filename=clean_filename, generation=generation)
+    with _catalog_lock:
+        if generation == _generation:
+            _catalog = catalog
+    return catalog
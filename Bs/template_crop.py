@@ -0,0 +1,129 @@
+import os
+import hashlib
+import threading
+import subprocess
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Sequence
+
+from utils import probe_media_cached
+from process_supervisor import get_supervisor
+from alpha_analyzer import get_alpha_profile
+from layer_graph import LayerPlacement
+
+# 缓存文件格式变化时修改版本号
+CROP_VERSION = 1
+# 可见区域面积占整帧超过 1 - MIN_SAVING 时不裁剪
+MIN_SAVING = 0.2
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+@dataclass
+class CroppedTemplate:
+    """裁剪到可见区域的模板，叠加时放在 (x, y)"""
+    path: str
+    x: int
+    y: int
+    width: int
+    height: int
+    canvas_width: int             # 原模板画面尺寸，缩放到素材尺寸时按它计算比例
+    canvas_height: int
+
+
+def _even_bbox(bbox, width, height):
+    """包围盒向外扩到偶数坐标和尺寸，避免yuv420叠加时色度错位"""
+    x, y, w, h = bbox
+    x0 = x - x % 2
+    y0 = y - y % 2
+    x1 = min(width, x + w + (x + w) % 2)
+    y1 = min(height, y + h + (y + h) % 2)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def crop_box(template_path, min_saving=MIN_SAVING):
+    """
+    逐帧分析alpha，返回整段模板可见区域的并集 (x, y, w, h)
+
+    没有alpha通道、全程透明、无法分析或裁剪收益太小时返回None。
+    """
+    info = probe_media_cached(template_path)
+    # 不透明模板没有可裁剪的透明区域，也不必启动alpha分析
+    if not info.has_alpha:
+        return None
+    # 按模板自身帧率逐帧分析，采样会漏掉一闪而过的画面
+    profile = get_alpha_profile(template_path, sample_fps=info.fps or 25.0)
+    bbox = profile.union_bbox
+    if bbox is None:
+        return None
+    x, y, w, h = _even_bbox(bbox, profile.width, profile.height)
+    if w * h > (1 - min_saving) * profile.width * profile.height:
+        return None
+    return x, y, w, h
+
+
+def _cropped_path(template_path, box, cache_dir):
+    st = os.stat(template_path)
+    key = f"{CROP_VERSION}|{template_path}|{st.st_size}|{st.st_mtime_ns}|{box}"
+    stem = os.path.splitext(os.path.basename(template_path))[0]
+    return os.path.join(cache_dir, f"{stem}_crop_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.mov")
+
+
+def _path_lock(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def get_cropped_template(template_path, cache_dir, min_saving=MIN_SAVING) -> Optional[CroppedTemplate]:
+    """
+    获取裁剪后的模板（走缓存），不适合裁剪时返回None
+
+    Raises:
+        subprocess.CalledProcessError: alpha分析或裁剪失败
+    """
+    # 多个任务同时用到同一个模板时只裁剪一次
+    with _path_lock(template_path):
+        box = crop_box(template_path, min_saving=min_saving)
+        if box is None:
+            return None
+        x, y, w, h = box
+        path = _cropped_path(template_path, box, cache_dir)
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path + ".part"
+            cmd = [
+                "ffmpeg", "-v", "error", "-y",
+                "-i", template_path,
+                "-map", "0:v:0", "-map", "0:a?",
+                "-vf", f"crop={w}:{h}:{x}:{y}",
+                "-c:v", "qtrle", "-pix_fmt", "argb",
+                "-c:a", "copy",
+                "-f", "mov", tmp_path
+            ]
+            result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+            if result.returncode != 0:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+            os.replace(tmp_path, path)
+            print(f"✂️ 模板已裁剪到可见区域 {w}x{h}+{x}+{y}: {os.path.basename(template_path)}")
+        info = probe_media_cached(template_path)
+        return CroppedTemplate(path=path, x=x, y=y, width=w, height=h,
+                               canvas_width=info.width, canvas_height=info.height)
+
+
+def crop_placements(placements: Sequence[LayerPlacement], cache_dir, min_saving=MIN_SAVING):
+    """把各层换成裁剪后的模板并设置叠加位置，失败的图层保持原样"""
+    result = []
+    for placement in placements:
+        try:
+            cropped = get_cropped_template(placement.template_path, cache_dir, min_saving=min_saving)
+        except Exception as e:
+            print(f"⚠️ {placement.layer} 模板裁剪失败，按整帧叠加: {e}")
+            cropped = None
+        if cropped is None:
+            result.append(placement)
+        else:
+            result.append(replace(placement, template_path=cropped.path, x=cropped.x, y=cropped.y,
+                                  canvas=(cropped.canvas_width, cropped.canvas_height)))
+    return result
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滤镜图规划基准：对比ffmpeg自动协商与 graph_planner 规划后的滤镜图
+
+场景：720p 25fps 素材 + 1080p 30fps rgba 模板，输出 24fps，3个变体。
+统计 -v debug 日志中的 swscale 转换环节，按各环节的输入尺寸和帧率折算每个输出帧的转换像素，
+并取3次运行的最短耗时。默认规划（不缩放模板）与开启 SCALE_TEMPLATES 的结果分开列出，
+后者改变了画面，不算转换上的节省。
+
+用法：python test/bench_filter_graph.py
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from layer_graph import LayerPlacement, build_layered_command
+from graph_planner import plan_graph, describe_graph
+
+DURATION = 10.0
+OUTPUT_FPS = 24
+VARIANTS = 3
+RUNS = 3
+
+# [auto_scale_0 @ 0x..] w:1920 h:1080 fmt:argb ... -> w:1280 h:720 fmt:yuva420p ...
+_SCALE_RE = re.compile(r"\[(\w+) @ [^\]]+\] w:(\d+) h:(\d+) fmt:(\w+) .*-> w:(\d+) h:(\d+) fmt:(\w+)")
+
+
+def make_inputs(work_dir):
+    material = os.path.join(work_dir, "material.mp4")
+    template = os.path.join(work_dir, "template.mov")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=s=1280x720:r=25:d={DURATION}",
+        "-f", "lavfi", "-i", f"sine=d={DURATION}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", material
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"color=red@0.5:s=1920x1080:r=30:d={DURATION},format=rgba",
+        "-f", "lavfi", "-i", f"sine=f=880:d={DURATION}",
+        "-c:v", "qtrle", "-c:a", "pcm_s16le", "-shortest", template
+    ], check=True)
+    material_info = MediaInfo(path=material, container="mov", duration=DURATION, streams=[
+        StreamInfo(0, "video", "h264", "yuv420p", 1280, 720, 25.0),
+        StreamInfo(1, "audio", "aac", sample_rate=44100, channels=1)])
+    template_info = MediaInfo(path=template, container="mov", duration=DURATION, streams=[
+        StreamInfo(0, "video", "qtrle", "argb", 1920, 1080, 30.0),
+        StreamInfo(1, "audio", "pcm_s16le", sample_rate=44100, channels=1)])
+    return material_info, template_info
+
+
+def scale_stages(stderr):
+    """从debug日志中取出实际发生转换的swscale环节"""
+    stages = []
+    for line in stderr.splitlines():
+        m = _SCALE_RE.search(line)
+        if m and m.group(2, 3, 4) != m.group(5, 6, 7):
+            stages.append((m.group(1), int(m.group(2)), int(m.group(3)), m.group(4), m.group(7)))
+    return stages
+
+
+def run(material_info, template_info, graph_plan):
+    placements = [LayerPlacement("top_layer", template_info.path, 0.0, 0.0, DURATION)]
+    cmd, filter_complex = build_layered_command(
+        material_info.path, [placements] * VARIANTS, ["-"] * VARIANTS,
+        ["-r", str(OUTPUT_FPS), "-c:v", "rawvideo", "-c:a", "pcm_s16le", "-f", "null"], DURATION,
+        graph_plan=graph_plan)
+    cmd = [cmd[0], "-v", "debug"] + cmd[1:]
+    best = None
+    stderr = ""
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="ignore")
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr[-2000:])
+        best = elapsed if best is None else min(best, elapsed)
+        stderr = result.stderr
+    return filter_complex, scale_stages(stderr), best
+
+
+def report(name, filter_complex, stages, elapsed, template_fps, plan=None):
+    print(f"\n=== {name} ===")
+    print(describe_graph(filter_complex, plan))
+    pixels = 0
+    for label, w, h, src, dst in stages:
+        # 模板分支上的转换：规划后在fps滤镜之后，按输出帧率计；否则按模板帧率计
+        fps = OUTPUT_FPS if plan is not None else template_fps
+        pixels += w * h * fps
+        print(f"  swscale {label}: {w}x{h} {src} -> {dst} @ {fps}fps")
+    per_frame = pixels / OUTPUT_FPS / 1e6
+    print(f"  转换环节: {len(stages)}，每输出帧转换 {per_frame:.2f} MP，最短耗时 {elapsed:.2f}s")
+    return per_frame, elapsed
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="bench_graph_")
+    try:
+        material_info, template_info = make_inputs(work_dir)
+        placements = [LayerPlacement("top_layer", template_info.path, 0.0, 0.0, DURATION)]
+        infos = {template_info.path: template_info}
+        plan = plan_graph(material_info, placements, output_fps=OUTPUT_FPS, infos=infos)
+        scaled_plan = plan_graph(material_info, placements, output_fps=OUTPUT_FPS, infos=infos, scale_templates=True)
+
+        naive = report("自动协商", *run(material_info, template_info, None), template_info.fps)
+        planned = report("规划后", *run(material_info, template_info, plan), template_info.fps, plan)
+        scaled = report("规划后 + 模板缩放", *run(material_info, template_info, scaled_plan),
+                        template_info.fps, scaled_plan)
+        print(f"\n每输出帧转换像素: {naive[0]:.2f} MP -> {planned[0]:.2f} MP；"
+              f"耗时: {naive[1]:.2f}s -> {planned[1]:.2f}s（开启模板缩放 {scaled[1]:.2f}s）")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
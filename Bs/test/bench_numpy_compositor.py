@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy合成后端基准：与ffmpeg滤镜图对比同一组三层叠加
+
+场景：720p 25fps 素材 10秒，底层整帧半透明、中层和顶层为720p局部不透明模板，输出 24fps。
+两条路径都输出到 null（rawvideo），只比较解码、混合和管道开销，各取2次运行的最短耗时。
+
+最后一行为模板帧仓库预热后（模板不再解码，只读内存映射文件）的耗时。
+
+用法：python test/bench_numpy_compositor.py [每批帧数...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from layer_graph import LayerPlacement, build_layered_command
+from graph_planner import plan_graph
+from numpy_compositor import composite
+from frame_store import FrameStore
+
+DURATION = 10.0
+OUTPUT_FPS = 24
+RUNS = 2
+OUTPUT_ARGS = ["-c:v", "rawvideo", "-c:a", "pcm_s16le", "-f", "null"]
+
+
+def _info(path, codec, pix_fmt, width, height, fps, duration):
+    return MediaInfo(path=path, container="mov", duration=duration, streams=[
+        StreamInfo(0, "video", codec, pix_fmt, width, height, fps),
+        StreamInfo(1, "audio", "aac", sample_rate=44100, channels=1)])
+
+
+def make_inputs(work_dir):
+    material = os.path.join(work_dir, "material.mp4")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=s=1280x720:r=25:d={DURATION}",
+        "-f", "lavfi", "-i", f"sine=d={DURATION}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", material
+    ], check=True)
+    layers = {
+        "bottom_layer": "color=blue@0.4:s=1280x720:r=25:d={d},format=rgba",
+        "middle_layer": "color=black@0.0:s=1280x720:r=25:d={d},format=rgba,drawbox=x=100:y=100:w=400:h=200:c=red@0.8:t=fill",
+        "top_layer": "color=black@0.0:s=1280x720:r=25:d={d},format=rgba,drawbox=x=900:y=500:w=300:h=150:c=white:t=fill",
+    }
+    infos = {material: _info(material, "h264", "yuv420p", 1280, 720, 25.0, DURATION)}
+    placements = []
+    for n, (layer, source) in enumerate(layers.items()):
+        path = os.path.join(work_dir, f"{layer}.mov")
+        duration = DURATION - 2 * n
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", source.format(d=duration),
+            "-f", "lavfi", "-i", f"sine=f={440 * (n + 2)}:d={duration}",
+            "-c:v", "qtrle", "-c:a", "pcm_s16le", "-shortest", path
+        ], check=True)
+        infos[path] = _info(path, "qtrle", "argb", 1280, 720, 25.0, duration)
+        placements.append(LayerPlacement(layer, path, float(n), 0, duration))
+    return material, placements, infos
+
+
+def best_of(func):
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    batch_sizes = [int(arg) for arg in sys.argv[1:]] or [1, 8, 32]
+    work_dir = tempfile.mkdtemp(prefix="bench_numpy_")
+    try:
+        material, placements, infos = make_inputs(work_dir)
+        plan = plan_graph(infos[material], placements, output_fps=OUTPUT_FPS, infos=infos)
+
+        cmd, _ = build_layered_command(material, [placements], ["-"], OUTPUT_ARGS, DURATION, graph_plan=plan)
+        cmd = cmd[:1] + ["-v", "error"] + cmd[1:]
+        filter_time = best_of(lambda: subprocess.run(cmd, check=True, capture_output=True))
+        frames = int(DURATION * OUTPUT_FPS)
+        print(f"\nffmpeg滤镜图: {filter_time:.2f}s（{frames / filter_time:.1f} fps）")
+
+        for batch in batch_sizes:
+            def run():
+                ok, msg = composite(material, placements, "-", OUTPUT_ARGS, DURATION, plan, batch_frames=batch)
+                if not ok:
+                    raise RuntimeError(msg)
+            numpy_time = best_of(run)
+            print(f"NumPy 每批{batch:>3}帧: {numpy_time:.2f}s（{frames / numpy_time:.1f} fps，"
+                  f"滤镜图的 {numpy_time / filter_time:.1f} 倍耗时）")
+
+        store = FrameStore(os.path.join(work_dir, "frames"))
+        start = time.perf_counter()
+        composite(material, placements, "-", OUTPUT_ARGS, DURATION, plan, frame_store=store)
+        cold = time.perf_counter() - start
+        warm = best_of(lambda: composite(material, placements, "-", OUTPUT_ARGS, DURATION, plan, frame_store=store))
+        print(f"NumPy + 模板帧仓库: 首次 {cold:.2f}s，预热后 {warm:.2f}s（{frames / warm:.1f} fps，"
+              f"仓库 {store.total_bytes() / 2**20:.0f} MB）")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,8 @@
     python check_alpha.py -d 目录路径               # 检查目录中的所有视频文件
     python check_alpha.py -d 目录路径 -r            # 递归检查目录及其子目录中的所有视频文件
     python check_alpha.py -d 目录路径 -e mp4,mov    # 指定要检查的视频文件扩展名
+    python check_alpha.py -d 目录路径 -r -j 8       # 8个文件并发探测，结果随到随打
+    python check_alpha.py -d 目录路径 --no-coverage # 只检查像素格式，不解码alpha平面
 """
 
 import os
@@ -25,6 +27,9 @@ def main():
     group.add_argument("-d", "--directory", help="要检查的目录路径")
     parser.add_argument("-r", "--recursive", action="store_true", help="递归检查子目录")
     parser.add_argument("-e", "--extensions", default="mp4,mov,avi", help="要检查的视频文件扩展名，用逗号分隔")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并发探测数，默认为CPU核数")
+    parser.add_argument("--no-coverage", action="store_true", help="不统计alpha平面的真实覆盖率")
+    parser.add_argument("--sample-fps", type=float, default=2.0, help="覆盖率分析的采样帧率")
     
     args = parser.parse_args()
     
@@ -55,7 +60,10 @@ def main():
         results = check_directory_for_alpha_videos(
             args.directory,
             recursive=args.recursive,
-            video_extensions=extensions
+            video_extensions=extensions,
+            max_workers=args.jobs,
+            analyze_coverage=not args.no_coverage,
+            sample_fps=args.sample_fps
         )
         
         # 返回状态码：如果至少有一个视频包含alpha通道，则返回0，否则返回1
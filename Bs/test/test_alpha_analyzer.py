@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试alpha平面分析（覆盖率、包围盒、缓存）
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from media_cache import MediaCache
+from alpha_analyzer import AlphaProfile, frame_alpha_stats, get_alpha_profile
+
+
+def test_frame_stats():
+    """测试单帧覆盖率和包围盒"""
+    alpha = np.zeros((36, 64), dtype=np.uint8)
+    assert frame_alpha_stats(alpha) == (0.0, (0, 0, 0, 0))
+    alpha[10:20, 5:15] = 255
+    coverage, bbox = frame_alpha_stats(alpha)
+    assert bbox == (5, 10, 10, 10)
+    assert abs(coverage - 100 / (36 * 64)) < 1e-9
+    print("✅ 单帧统计正确")
+
+
+def test_transparent_ranges():
+    """测试全透明时间段按帧边界计算，过短的片段被忽略"""
+    coverage = np.array([0, 0, 0.2, 0.3, 0, 0.1, 0, 0, 0, 0], dtype=np.float32)
+    profile = AlphaProfile(64, 36, 10.0, np.arange(10, dtype=np.float32) / 10, coverage,
+                           np.zeros((10, 4), dtype=np.int32))
+    assert profile.transparent_ranges() == [(0.0, 0.2), (0.4, 0.5), (0.6, 1.0)]
+    assert profile.transparent_ranges(min_duration=0.2) == [(0.0, 0.2), (0.6, 1.0)]
+    print("✅ 全透明时间段正确")
+
+
+def _write_template(path, fps=10):
+    """前1秒全透明，后1秒右下角有一个方块"""
+    frames = np.zeros((2 * fps, 36, 64, 4), dtype=np.uint8)
+    frames[fps:, 20:30, 40:60] = 255
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '64x36',
+           '-r', str(fps), '-i', 'pipe:0', '-c:v', 'qtrle', '-pix_fmt', 'argb', path]
+    subprocess.run(cmd, input=frames.tobytes(), check=True)
+
+
+def test_analyze_template():
+    """测试通过rawvideo管道分析真实模板，并复用缓存"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未安装FFmpeg，跳过")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "template.mov")
+        _write_template(path)
+        cache = MediaCache(os.path.join(tmp, "cache.db"))
+
+        profile = get_alpha_profile(path, sample_fps=4, cache=cache)
+        assert (profile.width, profile.height) == (64, 36)
+        assert profile.frames == 8
+        assert abs(profile.transparent_ratio - 0.5) < 1e-6
+        assert profile.union_bbox == (40, 20, 20, 10)
+        assert profile.opaque_ratio == 0.0
+
+        cached = get_alpha_profile(path, sample_fps=4, cache=cache)
+        assert np.array_equal(cached.coverage, profile.coverage)
+        assert cached.union_bbox == profile.union_bbox
+        assert isinstance(AlphaProfile.from_bytes(profile.to_bytes()), AlphaProfile)
+        cache.close()
+    print("✅ 模板alpha分析正确")
+
+
+if __name__ == "__main__":
+    test_frame_stats()
+    test_transparent_ranges()
+    test_analyze_template()
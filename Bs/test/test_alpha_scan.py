@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试并发目录alpha扫描的流式结果和汇总
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_cache
+from media_cache import configure_media_cache
+from utils import MediaInfo, StreamInfo, scan_directory_for_alpha_videos
+
+
+def test_streaming_scan_summary():
+    """测试生成器逐个产出结果并在结束时返回汇总"""
+    previous_cache = media_cache._default_cache
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = configure_media_cache(os.path.join(tmp, "cache.db"))
+        videos = os.path.join(tmp, "videos")
+        os.makedirs(os.path.join(videos, "sub"))
+
+        expected_alpha = []
+        for i in range(6):
+            sub = "sub" if i % 2 else ""
+            path = os.path.join(videos, sub, f"{i}.mov")
+            with open(path, "wb") as f:
+                f.write(bytes([i]))
+            pix_fmt = "yuva444p10le" if i < 4 else "yuv420p"
+            if i < 4:
+                expected_alpha.append(path)
+            # 第5个文件不写缓存，没有ffprobe时视为检查失败
+            if i != 5:
+                cache.put(path, MediaInfo(path=path, container="mov", duration=1.0, streams=[
+                    StreamInfo(index=0, codec_type="video", pix_fmt=pix_fmt)
+                ]))
+
+        scanner = scan_directory_for_alpha_videos(videos, recursive=True, max_workers=2)
+        items = []
+        while True:
+            try:
+                items.append(next(scanner))
+            except StopIteration as stop:
+                summary = stop.value
+                break
+
+        assert len(items) == 6
+        assert sorted(item['index'] for item in items) == list(range(1, 7))
+        assert summary['total'] == 6
+        assert sorted(summary['alpha_videos']) == sorted(expected_alpha)
+        assert summary['without_alpha'] + summary['failed'] == 2
+        cache.close()
+    media_cache._default_cache = previous_cache
+    print("✅ 并发扫描结果正确")
+
+
+if __name__ == "__main__":
+    test_streaming_scan_summary()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ffmpeg标准错误环形缓冲：行数上限、重复行合并、错误分类和处理器错误摘要
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_log import StderrLog, MAX_LINE_CHARS
+from ffmpeg_processor import FFmpegProcessor
+
+
+def test_ring_buffer():
+    """测试只保留最近几行，重复行合并，超长行截断"""
+    log = StderrLog(max_lines=5)
+    for n in range(100):
+        log.feed(f"[h264] frame {n} warning\n")
+    assert log.total_lines == 100 and len(log.tail()) == 5
+    assert log.tail(1) == ["[h264] frame 99 warning"]
+
+    log = StderrLog(max_lines=5)
+    stream = io.BytesIO(b"Past duration 0.99 too large\n" * 1000 + b"x" * 20000 + b"\ndone\n")
+    log.drain(stream)
+    tail = log.tail()
+    assert tail[0] == "Past duration 0.99 too large" and tail[1] == "（上一行又重复 999 次）"
+    # 没有换行的超长输出分块读取，每块截断
+    assert all(len(line) <= MAX_LINE_CHARS + 1 for line in tail)
+    assert tail[-1] == "done" and log.error_class is None
+    print("✅ 环形缓冲正确")
+
+
+def test_classification():
+    """测试按关键字分类，摘要取优先级最高的类别和首条原文"""
+    log = StderrLog()
+    for line in ("Input #0, lavfi",
+                 "[Parsed_overlay_1] Failed to configure input pad on Parsed_overlay_1",
+                 "missing.mov: No such file or directory",
+                 "Error initializing filter 'overlay'"):
+        log.feed(line)
+    assert log.error_class == 'missing_file'
+    assert log.errors['filter_graph'].count == 2
+    assert log.summary() == "文件不存在或路径错误: missing.mov: No such file or directory"
+    stats = log.to_dict(tail_lines=2)
+    assert stats['errors'] == {'filter_graph': 2, 'missing_file': 1} and len(stats['stderr_tail']) == 2
+    assert StderrLog().summary() == "未知错误"
+    print("✅ 错误分类正确")
+
+
+def test_processor_error_summary():
+    """测试处理器返回分类后的错误，并在每次尝试的统计里记录摘要"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        processor = FFmpegProcessor(max_retries=1, timeout=60, stderr_lines=10)
+        ok, msg = processor.process_with_retry(
+            ['ffmpeg', '-y', '-i', os.path.join(workdir, 'missing.mov'), os.path.join(workdir, 'out.mp4')])
+        assert not ok and "文件不存在或路径错误: " in msg
+        assert processor.attempt_metrics[0]['error_class'] == 'missing_file'
+
+        # 大量日志输出时只保留最后10行
+        ok, _ = processor.process_with_retry(
+            ['ffmpeg', '-y', '-loglevel', 'debug', '-f', 'lavfi', '-i', 'testsrc2=s=64x36:r=25', '-t', '2',
+             '-f', 'null', os.devnull])
+        assert ok
+        attempt = processor.attempt_metrics[0]
+        assert attempt['stderr_lines'] > 50 and len(processor.last_log.tail()) == 10
+        assert attempt['error_class'] is None
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 处理器错误摘要正确")
+
+
+def test_callback_error_stops_process():
+    """测试读取进度时回调出错，ffmpeg进程在返回前被停止"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    from process_supervisor import ProcessSupervisor
+    supervisor = ProcessSupervisor(kill_grace=0.5)
+    processor = FFmpegProcessor(max_retries=1, timeout=60, supervisor=supervisor)
+    seen = []
+
+    def broken_stats(snapshot):
+        seen.append(processor.current_process)
+        raise ValueError("回调出错")
+
+    ok, msg = processor.process_with_retry(
+        ['ffmpeg', '-y', '-re', '-f', 'lavfi', '-i', 'testsrc2=s=64x36:r=25', '-t', '60',
+         '-f', 'null', os.devnull], stats_callback=broken_stats)
+    assert not ok and "回调出错" in msg
+    assert seen[0].poll() is not None
+    assert supervisor.children() == [] and processor.current_process is None
+    print("✅ 回调出错时进程被停止")
+
+
+if __name__ == "__main__":
+    print("🧪 测试ffmpeg标准错误缓冲...")
+    test_ring_buffer()
+    test_classification()
+    test_processor_error_summary()
+    test_callback_error_stops_process()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ffmpeg -progress 解析：快照字段、百分比、输出时长和命令改写
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_progress import ProgressParser, output_duration, with_progress
+from ffmpeg_processor import FFmpegProcessor
+
+BLOCKS = """frame=0
+fps=0.00
+stream_0_0_q=0.0
+bitrate=N/A
+total_size=48
+out_time_us=N/A
+out_time_ms=N/A
+out_time=N/A
+dup_frames=0
+drop_frames=0
+speed=N/A
+progress=continue
+frame=120
+fps=48.0
+total_size=262192
+out_time_us=5000000
+out_time_ms=5000000
+out_time=00:00:05.000000
+speed=1.93x
+progress=continue
+frame=240
+fps=47.5
+total_size=524336
+out_time_us=10000000
+out_time_ms=10000000
+speed=1.91x
+progress=end
+"""
+
+
+def test_parser():
+    """测试逐块解析和百分比"""
+    parser = ProgressParser(duration=10.0)
+    snapshots = [s for s in (parser.feed(line) for line in BLOCKS.splitlines()) if s is not None]
+    assert len(snapshots) == 3
+    first, middle, last = snapshots
+    assert (first.frame, first.out_time, first.speed, first.percent) == (0, 0.0, 0.0, 0.0)
+    assert (middle.frame, middle.fps, middle.speed, middle.total_size) == (120, 48.0, 1.93, 262192)
+    assert middle.percent == 50.0 and not middle.done
+    assert last.done and last.percent == 100.0
+    assert middle.describe() == "帧120 · 48.0fps · 1.93x"
+
+    # 未结束时最多99.9%；时长未知时没有百分比
+    parser = ProgressParser(duration=4.0)
+    for line in ("out_time_us=5000000", "progress=continue"):
+        snapshot = parser.feed(line)
+    assert snapshot.percent == 99.9
+    parser = ProgressParser()
+    for line in ("out_time_ms=2500000", "progress=continue"):
+        snapshot = parser.feed(line)
+    assert snapshot.out_time == 2.5 and snapshot.percent is None
+    print("✅ 进度解析正确")
+
+
+def test_command_helpers():
+    """测试输出时长提取和 -progress 注入"""
+    cmd = ["ffmpeg", "-ss", "1", "-t", "3", "-i", "a.mp4", "-t", "2.5", "-i", "b.mov",
+           "-filter_complex", "x", "-y", "-map", "[v]", "-t", "8.0", "out.mp4"]
+    assert output_duration(cmd) == 8.0
+    assert output_duration(["ffmpeg", "-t", "3", "-i", "a.mp4", "out.mp4"]) is None
+    assert with_progress(cmd)[:4] == ["ffmpeg", "-progress", "pipe:1", "-nostats"]
+    assert with_progress(cmd)[4:] == cmd[1:]
+    # 输出到标准输出时不能占用管道
+    piped = ["ffmpeg", "-i", "a.mp4", "-f", "rawvideo", "-"]
+    assert with_progress(piped) == piped
+    print("✅ 命令处理正确")
+
+
+def test_processor_progress():
+    """测试FFmpegProcessor回调真实进度和编码速度"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        output = os.path.join(workdir, 'out.mp4')
+        cmd = ['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc2=s=320x180:r=25', '-c:v', 'libx264',
+               '-preset', 'ultrafast', '-t', '4', output]
+        updates, stats = [], []
+        processor = FFmpegProcessor(max_retries=1, timeout=60)
+        ok, _ = processor.process_with_retry(cmd, lambda p, m: updates.append((p, m)), stats_callback=stats.append)
+        assert ok and os.path.getsize(output) > 0
+        assert stats and stats[-1].done and stats[-1].frame == 100 and stats[-1].total_size > 0
+        assert processor.last_progress is stats[-1]
+        assert updates[-1][0] == 100
+        percents = [p for p, _ in updates]
+        assert percents == sorted(percents)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 处理器进度回调正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试ffmpeg进度解析...")
+    test_parser()
+    test_command_helpers()
+    test_processor_progress()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ffmpeg看门狗：按 out_time 是否增长判定卡住，超时和终止决定记录在任务统计中
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_progress import FFmpegProgress
+from ffmpeg_watchdog import Watchdog
+from ffmpeg_processor import FFmpegProcessor
+from process_supervisor import ProcessSupervisor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProcess:
+    def __init__(self, exits_on_terminate=True):
+        self.returncode = None
+        self.exits_on_terminate = exits_on_terminate
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.signals.append('terminate')
+        if self.exits_on_terminate:
+            self.returncode = -15
+
+    def kill(self):
+        self.signals.append('kill')
+        self.returncode = -9
+
+
+def test_stall_detection():
+    """测试 out_time 不增长时判定卡住，慢但有进展的任务不受影响"""
+    clock = FakeClock()
+    watchdog = Watchdog(interval=3600, kill_grace=5, clock=clock)
+    slow, stuck = FakeProcess(), FakeProcess(exits_on_terminate=False)
+    slow_job = watchdog.watch(slow, timeout=1000, stall_timeout=30)
+    stuck_job = watchdog.watch(stuck, timeout=1000, stall_timeout=30)
+    for t in range(0, 50, 10):
+        clock.now = t
+        # 慢任务每10秒只前进0.1秒；卡住的任务10秒后一直重复同一个 out_time
+        slow_job.observe(FFmpegProgress(out_time=t / 100))
+        stuck_job.observe(FFmpegProgress(out_time=min(t, 10) / 10))
+        watchdog.check()
+    assert slow.signals == [] and slow_job.verdict is None
+    assert stuck_job.verdict == 'stall' and stuck.signals == ['terminate']
+    assert stuck_job.events[0].action == 'stall' and stuck_job.events[0].elapsed == 40
+    assert 'out_time停在1.00s' in stuck_job.events[0].detail
+
+    # terminate 后不退出，宽限期过后kill一次
+    clock.now = 100
+    watchdog.check()
+    clock.now = 200
+    watchdog.check()
+    assert stuck.signals == ['terminate', 'kill']
+    metrics = stuck_job.metrics()
+    assert [e['action'] for e in metrics['events']] == ['stall', 'terminate', 'kill']
+    assert metrics['verdict'] == 'stall' and metrics['max_progress_gap'] >= 30
+    print("✅ 卡住判定正确")
+
+
+def test_timeout_and_release():
+    """测试总时长超时、没有进度输出时不判定卡住、释放后不再检查"""
+    clock = FakeClock()
+    watchdog = Watchdog(interval=3600, clock=clock)
+    timed, no_progress, released = FakeProcess(), FakeProcess(), FakeProcess()
+    timed_job = watchdog.watch(timed, timeout=50, stall_timeout=None)
+    watchdog.watch(no_progress, timeout=None, stall_timeout=None)
+    released_job = watchdog.watch(released, timeout=10, stall_timeout=5)
+    watchdog.release(released_job)
+    clock.now = 60
+    watchdog.check()
+    assert timed_job.verdict == 'timeout' and timed.signals == ['terminate']
+    assert no_progress.signals == [] and released.signals == []
+    print("✅ 超时和释放正确")
+
+
+def _gone(pid):
+    """进程已退出（不存在或只剩僵尸）"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except FileNotFoundError:
+        return True
+
+
+def test_group_signal():
+    """测试看门狗经登记处向整个进程组发信号，子进程派生的进程一并结束"""
+    if not os.path.isdir('/proc') or shutil.which('sh') is None:
+        print("⚠️ 不支持进程组检查，跳过")
+        return
+    supervisor = ProcessSupervisor(kill_grace=0.5)
+    watchdog = Watchdog(interval=0.05, kill_grace=0.5, supervisor=supervisor)
+    # sh 在 wait 中收到SIGTERM不会转发给后台的 sleep，只发给sh自己时 sleep 会残留
+    process = supervisor.popen(['sh', '-c', 'sleep 60 & echo $!; wait'], stdout=subprocess.PIPE)
+    try:
+        grandchild = int(process.stdout.readline())
+        job = watchdog.watch(process, timeout=0.1)
+        process.wait(timeout=5)
+        deadline = time.monotonic() + 5
+        while not _gone(grandchild) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert job.verdict == 'timeout' and _gone(grandchild)
+        watchdog.release(job)
+    finally:
+        supervisor.cancel_all()
+        supervisor.release(process)
+    print("✅ 看门狗整组终止正确")
+
+
+def test_processor_stall():
+    """测试处理器终止没有进度的ffmpeg并记录看门狗统计"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    # -re 按实时速度读取无限长的输入，select 丢弃前1000秒的帧：进程在运行，out_time 却一直不增长
+    cmd = ['ffmpeg', '-y', '-re', '-f', 'lavfi', '-i', 'testsrc2=s=64x36:r=25',
+           '-vf', "select='gte(t,1000)'", '-f', 'null', os.devnull]
+    processor = FFmpegProcessor(max_retries=1, timeout=60, stall_timeout=2, watchdog=Watchdog(interval=0.2))
+    ok, msg = processor.process_with_retry(cmd)
+    assert not ok
+    assert len(processor.attempt_metrics) == 1 and processor.attempt_metrics[0]['verdict'] == 'stall'
+    assert processor.attempt_metrics[0]['elapsed'] < 30
+    print("✅ 处理器卡住终止正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试ffmpeg看门狗...")
+    test_stall_detection()
+    test_timeout_and_release()
+    test_group_signal()
+    test_processor_stall()
+    print("\n🎉 所有测试通过！")
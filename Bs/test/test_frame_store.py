@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试模板帧仓库：只解码一次、预乘alpha、内存映射读取和LRU淘汰
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_store import FrameStore
+
+FILTERS = ['fps=10', 'format=rgba']
+
+
+def _make_template(path, color='red@0.5', duration=1):
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', f'color={color}:s=16x8:r=25:d={duration},format=rgba',
+                    '-c:v', 'qtrle', path], check=True)
+
+
+def test_store_and_reuse():
+    """测试首次解码后复用，帧为预乘的内存映射数组"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        template = os.path.join(workdir, 'tpl.mov')
+        _make_template(template)
+        store = FrameStore(os.path.join(workdir, 'frames'))
+        stored = store.get(template, None, 1.0, 10, 16, 8, FILTERS)
+        assert len(stored) == 10 and stored.timestamps[:2] == [0.0, 0.1]
+        assert isinstance(stored.frames, np.memmap) and stored.frames.shape == (10, 8, 16, 4)
+        r, g, b, a = stored.frames[0, 0, 0].tolist()
+        # 半透明红色预乘后 r ≈ a
+        assert abs(a - 128) <= 1 and abs(r - a) <= 1 and g == b == 0
+
+        again = store.get(template, None, 1.0, 10, 16, 8, FILTERS)
+        assert (store.hits, store.misses) == (1, 1)
+        assert np.array_equal(np.asarray(again.frames), np.asarray(stored.frames))
+
+        # 另一个进程的仓库对象直接读到同一文件
+        other = FrameStore(os.path.join(workdir, 'frames'))
+        assert other.get(template, None, 1.0, 10, 16, 8, FILTERS).path == stored.path and other.misses == 0
+
+        # 截取范围不同是不同的条目
+        part = store.get(template, 0.5, 0.5, 10, 16, 8, FILTERS)
+        assert len(part) == 5 and part.path != stored.path
+
+        # 模板文件变化后重新解码
+        time.sleep(0.01)
+        _make_template(template, color='blue')
+        changed = store.get(template, None, 1.0, 10, 16, 8, FILTERS)
+        assert changed.path != stored.path and changed.frames[0, 0, 0, 2] == 255
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 模板帧缓存和复用正确")
+
+
+def test_lru_prune():
+    """测试超过大小上限时淘汰最久未使用的条目"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        templates = []
+        for n in range(3):
+            path = os.path.join(workdir, f'tpl{n}.mov')
+            _make_template(path)
+            templates.append(path)
+        entry_size = 10 * 16 * 8 * 4
+        store = FrameStore(os.path.join(workdir, 'frames'), max_bytes=int(entry_size * 2.5))
+        first = store.get(templates[0], None, 1.0, 10, 16, 8, FILTERS)
+        second = store.get(templates[1], None, 1.0, 10, 16, 8, FILTERS)
+        # 第一条最近用过，淘汰第二条
+        past = time.time() - 60
+        os.utime(second.path, (past, past))
+        os.utime(second.path[:-len('.rgba')] + '.json', (past, past))
+        store.get(templates[0], None, 1.0, 10, 16, 8, FILTERS)
+        store.get(templates[2], None, 1.0, 10, 16, 8, FILTERS)
+        assert os.path.exists(first.path) and not os.path.exists(second.path)
+        assert store.total_bytes() <= store.max_bytes
+        # 已映射的帧在文件删除后仍可读取
+        assert second.frames[0, 0, 0, 3] > 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ LRU淘汰正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试模板帧仓库...")
+    test_store_and_reuse()
+    test_lru_prune()
+    print("\n🎉 所有测试通过！")
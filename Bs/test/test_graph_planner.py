@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试滤镜图规划：模板分支的帧率、缩放和像素格式转换，以及叠加位置和overlay格式
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from layer_graph import LayerPlacement, build_layered_command
+from graph_planner import plan_branch, plan_graph, describe_graph
+
+
+def _info(path, codec, pix_fmt, width, height, fps, duration=2.0):
+    return MediaInfo(path=path, container='mov', duration=duration, streams=[
+        StreamInfo(0, 'video', codec, pix_fmt, width, height, fps),
+        StreamInfo(1, 'audio', 'aac', sample_rate=44100, channels=1)])
+
+
+MATERIAL = _info('/m/a.mp4', 'h264', 'yuv420p', 1280, 720, 25.0, duration=10.0)
+
+
+def test_plan_branch():
+    """测试模板分支：只丢帧不补帧，开启缩放且尺寸不同才缩放，最后统一转成yuva420p"""
+    # 默认不缩放模板，只统一帧率和像素格式
+    branch = plan_branch(_info('/t/a.mov', 'qtrle', 'argb', 1920, 1080, 30.0), 24, 1280, 720)
+    assert branch.filters == ['fps=24', 'format=yuva420p'] and branch.scale == 1.0
+
+    branch = plan_branch(_info('/t/a.mov', 'qtrle', 'argb', 1920, 1080, 30.0), 24, 1280, 720, scale_templates=True)
+    assert branch.filters == ['fps=24', 'scale=1280:720', 'format=yuva420p']
+    assert branch.scale == 1280 / 1920
+
+    branch = plan_branch(_info('/t/b.mov', 'prores', 'yuva444p10le', 1280, 720, 15.0), 24, 1280, 720)
+    assert branch.filters == ['format=yuva420p']
+
+    # 裁剪后的模板按原画面尺寸计算缩放比例
+    branch = plan_branch(_info('/t/c.mov', 'qtrle', 'argb', 300, 100, 25.0), 25, 1280, 720, canvas=(1920, 1080),
+                         scale_templates=True)
+    assert branch.filters == ['scale=200:66', 'format=yuva420p']
+
+    # 宽高比不同（竖屏模板叠加到横屏素材）时不缩放，避免拉伸
+    branch = plan_branch(_info('/t/d.mov', 'qtrle', 'argb', 1080, 1920, 25.0), 25, 1280, 720, scale_templates=True)
+    assert branch.filters == ['format=yuva420p'] and branch.scale == 1.0
+    assert branch.size == (1080, 1920)
+    # 取整造成的微小宽高比差异仍按相同处理
+    branch = plan_branch(_info('/t/e.mov', 'qtrle', 'argb', 854, 480, 25.0), 25, 1920, 1080, scale_templates=True)
+    assert branch.filters == ['scale=1920:1080', 'format=yuva420p']
+    print("✅ 模板分支规划正确")
+
+
+def test_plan_graph():
+    """测试素材帧率统一和叠加位置缩放"""
+    placement = LayerPlacement('top_layer', '/t/c.mov', 0, 0, 2.0, x=960, y=540, canvas=(1920, 1080))
+    infos = {'/t/c.mov': _info('/t/c.mov', 'qtrle', 'argb', 300, 100, 30.0)}
+    plan = plan_graph(MATERIAL, [placement], output_fps=24, infos=infos)
+    assert plan.material_filters == ['fps=24']
+    # 默认不缩放，叠加位置不变
+    assert plan.position(placement) == (960, 540)
+    plan = plan_graph(MATERIAL, [placement], output_fps=24, infos=infos, scale_templates=True)
+    assert plan.position(placement) == (640, 360)
+
+    # 宽高比不同的模板保持原位置
+    square = LayerPlacement('top_layer', '/t/s.mov', 0, 0, 2.0, x=100, y=50)
+    plan = plan_graph(MATERIAL, [square], output_fps=24, scale_templates=True,
+                      infos={'/t/s.mov': _info('/t/s.mov', 'qtrle', 'argb', 500, 500, 24.0)})
+    assert plan.position(square) == (100, 50)
+    assert plan.branch_filters('/t/s.mov') == ['format=yuva420p']
+
+    # 智能渲染保持素材帧率
+    plan = plan_graph(MATERIAL, [placement], output_fps=None, infos=infos)
+    assert plan.material_filters == [] and plan.fps == 25.0
+    assert plan.branch_filters('/t/c.mov')[0] == 'fps=25'
+
+    # 拿不到流信息的模板交给ffmpeg自动协商
+    plan = plan_graph(MATERIAL, [LayerPlacement('top_layer', '/t/missing.mov', 0, 0, 2.0)], output_fps=24)
+    assert plan.branches == {} and any('missing.mov' in note for note in plan.notes)
+    assert plan_graph(None, [placement]) is None
+    print("✅ 滤镜图规划正确")
+
+
+def test_planned_command():
+    """测试转换在split之前，每个输入只做一次"""
+    placement = LayerPlacement('top_layer', '/t/a.mov', 1.0, 0, 2.0)
+    infos = {'/t/a.mov': _info('/t/a.mov', 'qtrle', 'argb', 1920, 1080, 30.0)}
+    plan = plan_graph(MATERIAL, [placement], output_fps=24, infos=infos, scale_templates=True)
+    _, graph = build_layered_command('/m/a.mp4', [[placement], [placement]], ['/o/1.mp4', '/o/2.mp4'], [], 10.0,
+                                     graph_plan=plan)
+    chains = graph.split(';')
+    assert chains[0] == '[1:v]fps=24,scale=1280:720,format=yuva420p[p1]'
+    assert chains[1] == '[p1]split=2[t1v0][t1v1]'
+    assert '[0:v]fps=24,split=2[base0][base1]' in chains
+    assert graph.count('overlay=0:0:format=yuv420:') == 2
+
+    _, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/1.mp4'], [], 10.0, graph_plan=plan)
+    assert graph.startswith('[1:v]fps=24,scale=1280:720,format=yuva420p[p1];[0:v]fps=24[base];')
+    assert '[base][clip1]overlay=' in graph
+    assert describe_graph(graph, plan).splitlines()[0].startswith('# 画面 1280x720 @ 24fps')
+
+    # 默认只统一帧率和像素格式
+    plan = plan_graph(MATERIAL, [placement], output_fps=24, infos=infos)
+    _, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/1.mp4'], [], 10.0, graph_plan=plan)
+    assert graph.startswith('[1:v]fps=24,format=yuva420p[p1];[0:v]fps=24[base];')
+    print("✅ 规划后的滤镜图正确")
+
+
+def _pixel(path, x, y, t=0.5):
+    data = subprocess.run(['ffmpeg', '-v', 'error', '-ss', str(t), '-i', path, '-frames:v', '1',
+                           '-vf', f'crop=2:2:{x}:{y}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                          capture_output=True).stdout
+    return tuple(data[:3])
+
+
+def test_planned_run():
+    """测试开启模板缩放时大尺寸模板缩放到素材尺寸后叠加：右下角的红块仍在右下角"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'mat.mp4')
+        template = os.path.join(workdir, 'tpl.mov')
+        output = os.path.join(workdir, 'out.mp4')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'color=black:s=64x36:r=25:d=1',
+                        '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono', '-t', '1',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', material], check=True)
+        # 128x72 透明画布，右下四分之一是红色
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'color=black@0.0:s=128x72:r=30:d=1,format=rgba',
+                        '-f', 'lavfi', '-i', 'color=red:s=64x36:r=30:d=1,format=rgba',
+                        '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono', '-t', '1',
+                        '-filter_complex', '[0:v][1:v]overlay=64:36:format=rgb,format=rgba[v]',
+                        '-map', '[v]', '-map', '2:a', '-c:v', 'qtrle', '-c:a', 'pcm_s16le', template], check=True)
+        placement = LayerPlacement('top_layer', template, 0, 0, 1.0)
+        plan = plan_graph(_info(material, 'h264', 'yuv420p', 64, 36, 25.0, duration=1.0), [placement], output_fps=24,
+                          infos={template: _info(template, 'qtrle', 'argb', 128, 72, 30.0, duration=1.0)},
+                          scale_templates=True)
+        args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-r', '24']
+        cmd, _ = build_layered_command(material, [[placement]], [output], args, 1.0, graph_plan=plan)
+        subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+        assert _pixel(output, 48, 26)[0] > 200
+        assert _pixel(output, 8, 6)[0] < 30
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 缩放后叠加位置正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试滤镜图规划...")
+    test_plan_branch()
+    test_plan_graph()
+    test_planned_command()
+    test_planned_run()
+    print("\n🎉 所有测试通过！")
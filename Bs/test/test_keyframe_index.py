@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试关键帧索引的构建、二分查找和缓存
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_cache import MediaCache
+from keyframe_index import (KeyframeIndex, KEYFRAME_BLOB_KIND,
+                            build_keyframe_index, get_keyframe_index)
+
+# 模拟 ffprobe -show_packets 的CSV输出：25fps，每50帧一个关键帧，首包pts为N/A
+FAKE_FFPROBE = """#!{python}
+print("N/A,0.000000,K__")
+for i in range(1, 250):
+    flags = "K__" if i % 50 == 0 else "___"
+    print("%.6f,%.6f,%s" % (i / 25, i / 25, flags))
+"""
+
+
+def test_lookup():
+    """测试前后关键帧查找"""
+    index = KeyframeIndex([4.0, 0.0, 2.0, 6.0])
+    assert index.nearest_keyframe_before(3.5) == 2.0
+    assert index.nearest_keyframe_before(4.0) == 4.0
+    assert index.nearest_keyframe_after(4.1) == 6.0
+    assert index.nearest_keyframe_after(4.0) == 4.0
+    assert index.nearest_keyframe_after(6.5) is None
+    assert KeyframeIndex([1.0]).nearest_keyframe_before(0.5) is None
+    print("✅ 关键帧查找正确")
+
+
+def test_build_and_cache():
+    """测试扫描包信息构建索引，并通过缓存复用"""
+    with tempfile.TemporaryDirectory() as tmp:
+        script = os.path.join(tmp, "ffprobe")
+        with open(script, "w") as f:
+            f.write(FAKE_FFPROBE.format(python=sys.executable))
+        os.chmod(script, 0o755)
+        video = os.path.join(tmp, "material.mp4")
+        with open(video, "wb") as f:
+            f.write(b"\0" * 16)
+
+        index = build_keyframe_index(video, ffprobe=script)
+        assert list(index.times) == [0.0, 2.0, 4.0, 6.0, 8.0]
+        assert index.packet_count == 250
+        assert abs(index.duration - 249 / 25) < 1e-9
+
+        cache = MediaCache(os.path.join(tmp, "cache.db"))
+        cache.put_blob(video, KEYFRAME_BLOB_KIND, index.to_bytes())
+        cached = get_keyframe_index(video, cache=cache)
+        assert list(cached.times) == list(index.times)
+        assert cached.nearest_keyframe_before(5.0) == 4.0
+
+        # 文件变化后缓存失效
+        with open(video, "ab") as f:
+            f.write(b"\0")
+        assert cache.get_blob(video, KEYFRAME_BLOB_KIND) is None
+        cache.close()
+    print("✅ 关键帧索引构建与缓存正确")
+
+
+if __name__ == "__main__":
+    test_lookup()
+    test_build_and_cache()
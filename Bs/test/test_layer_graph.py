@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试叠加滤镜图：各层时间计算、多变体共享解码和单条命令多输出
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_catalog import TemplateEntry
+from layer_graph import LayerPlacement, plan_layer_placements, build_layered_command, visible_segments
+
+
+def test_plan_placements():
+    """测试定点模式和标准模式的各层摆放"""
+    chosen = {
+        'top_layer': TemplateEntry('top_layer', '/t/top.mov', 4.0, True, 1080, 1920),
+        'bottom_layer': TemplateEntry('bottom_layer', '/t/bottom.mov', 30.0, True, 1080, 1920),
+    }
+    placements = plan_layer_placements(chosen, 20.0, exact_timing_enabled=True, random_timing_exact=18,
+                                       alpha_clips={'top_layer': (1, 2)})
+    # 叠加顺序：底层在前，顶层最后
+    assert [p.layer for p in placements] == ['bottom_layer', 'top_layer']
+    bottom, top = placements
+    assert bottom.offset == 0 and top.offset == 18
+    assert (top.trim_start, top.trim_duration, top.end) == (1, 2, 20)
+
+    placements = plan_layer_placements(chosen, 20.0)
+    bottom, top = placements
+    assert bottom.trim_duration == 20.0 and bottom.enable_until is None
+    assert not top.trim and top.enable_until == 4.0
+    print("✅ 各层摆放计算正确")
+
+
+def test_single_variant_graph():
+    """测试只选顶层以外的图层时也会输出最终视频标签"""
+    placements = [LayerPlacement('middle_layer', '/t/mid.mov', 2.0, 0, 3.0)]
+    cmd, graph = build_layered_command('/m/a.mp4', [placements], ['/o/out.mp4'], ['-c:v', 'libx264'], 10.0)
+    assert '[vout]' in graph and '[aout]' in graph
+    assert 'split' not in graph
+    assert cmd.count('-i') == 2
+    assert cmd[-1] == '/o/out.mp4'
+    print("✅ 单变体滤镜图正确")
+
+
+def test_multi_variant_graph():
+    """测试多变体：素材split一次，共用的模板只解码一次"""
+    shared = LayerPlacement('top_layer', '/t/top.mov', 1.0, 0, 2.0)
+    variants = [
+        [shared],
+        [LayerPlacement('top_layer', '/t/top.mov', 5.0, 0, 2.0)],
+        [LayerPlacement('top_layer', '/t/other.mov', 3.0, 0, 2.0)],
+    ]
+    outputs = ['/o/v1.mp4', '/o/v2.mp4', '/o/v3.mp4']
+    cmd, graph = build_layered_command('/m/a.mp4', variants, outputs, ['-c:v', 'libx264'], 10.0)
+    # 素材 + 两个不同模板
+    assert cmd.count('-i') == 3
+    assert '[0:v]split=3[base0][base1][base2]' in graph
+    assert '[0:a]asplit=3[abase0][abase1][abase2]' in graph
+    assert '[1:v]split=2' in graph and '[1:a]asplit=2' in graph
+    for j in range(3):
+        assert f'[vout_{j}]' in graph and f'[aout_{j}]' in graph
+        assert cmd.index(outputs[j]) > cmd.index(f'[vout_{j}]')
+    print("✅ 多变体滤镜图正确")
+
+
+def test_input_seek():
+    """测试Alpha截取用输入级 -ss/-t 表达，滤镜图中不再有trim"""
+    placement = LayerPlacement('top_layer', '/t/top.mov', 3.0, 40.0, 5.0)
+    cmd, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/out.mp4'], [], 30.0)
+    i = cmd.index('/t/top.mov')
+    assert cmd[i - 5:i] == ['-ss', '40.000', '-t', '5.000', '-i']
+    assert 'trim' not in graph
+    assert '[1:v]setpts=PTS-STARTPTS+3.000/TB' in graph
+    assert '[1:a]asetpts=PTS-STARTPTS,adelay=3000:all=1' in graph
+    # overlay只在 [3, 8) 内生效，窗口外直接透传素材帧
+    assert "overlay=0:0:enable='gte(t,3.000)*lt(t,8.000)':eof_action=pass[vout]" in graph
+
+    # 标准模式短模板整段播放，不加seek
+    full = LayerPlacement('top_layer', '/t/top.mov', 0, 0, 4.0, trim=False, enable_until=4.0)
+    cmd, _ = build_layered_command('/m/a.mp4', [[full]], ['/o/out.mp4'], [], 30.0)
+    assert cmd[cmd.index('/t/top.mov') - 2] != '-t'
+    print("✅ 输入级seek正确")
+
+
+def test_skip_transparent():
+    """测试去掉全透明时间段后的可见片段和时间戳平移"""
+    assert visible_segments(0, 10, [(0, 2), (4, 5), (9, 12)]) == [(2, 4), (5, 9)]
+    assert visible_segments(3, 4, [(0, 2)]) == [(3, 7)]
+    assert visible_segments(0, 2, [(0, 5)]) == []
+
+    entry = TemplateEntry('top_layer', '/t/top.mov', 10.0, True, 1080, 1920,
+                          transparent_ranges=((0.0, 2.0), (4.0, 5.0)))
+    [placement] = plan_layer_placements({'top_layer': entry}, 30.0, exact_timing_enabled=True,
+                                        random_timing_exact=6, alpha_clips={'top_layer': (1, 6)})
+    assert placement.visible == ((2.0, 4.0), (5.0, 7.0))
+    cmd, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/out.mp4'], [], 30.0)
+    # 每个可见片段单独seek；模板第2秒的画面仍出现在素材的 6 + (2 - 1) 秒
+    args = " ".join(cmd)
+    assert '-ss 2.000 -t 2.000 -i /t/top.mov' in args
+    assert '-ss 5.000 -t 2.000 -i /t/top.mov' in args
+    assert '[1:v]setpts=PTS-STARTPTS+7.000/TB' in graph
+    assert '[2:v]setpts=PTS-STARTPTS+10.000/TB' in graph
+    assert "enable='gte(t,7.000)*lt(t,9.000)'" in graph
+    assert "enable='gte(t,10.000)*lt(t,12.000)'" in graph
+    # 音频不受影响，仍按截取范围完整播放
+    assert '-ss 1.000 -t 6.000 -i /t/top.mov' in args
+    assert '[3:a]asetpts=PTS-STARTPTS,adelay=6000:all=1' in graph
+
+    hidden = LayerPlacement('top_layer', '/t/top.mov', 0, 0, 2.0, visible=())
+    _, graph = build_layered_command('/m/a.mp4', [[hidden]], ['/o/out.mp4'], [], 30.0)
+    assert '[0:v]null[vout]' in graph and 'overlay' not in graph
+    print("✅ 全透明片段跳过正确")
+
+
+def _pixel(path, t):
+    data = subprocess.run(['ffmpeg', '-v', 'error', '-ss', str(t), '-i', path, '-frames:v', '1',
+                           '-vf', 'crop=2:2:0:0', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                          capture_output=True).stdout
+    return tuple(data[:3])
+
+
+def test_skip_transparent_run():
+    """测试跳过全透明片段后画面与整段叠加一致"""
+    if not shutil.which('ffmpeg'):
+        print("⚠️ 未安装ffmpeg，跳过")
+        return
+    import numpy as np
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'material.mp4')
+        template = os.path.join(workdir, 'template.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=blue:size=32x18:rate=25:duration=4',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=4',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', material],
+                       check=True)
+        # 0-1秒透明，1-1.5秒红色，1.5-2.5秒透明，2.5-3秒红色
+        frames = np.zeros((75, 18, 32, 4), dtype=np.uint8)
+        frames[25:37, :, :] = (255, 0, 0, 255)
+        frames[62:75, :, :] = (255, 0, 0, 255)
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '32x18',
+                        '-r', '25', '-i', 'pipe:0',
+                        '-f', 'lavfi', '-i', 'sine=frequency=880:duration=3',
+                        '-c:v', 'qtrle', '-pix_fmt', 'argb', '-c:a', 'aac', '-shortest', template],
+                       input=frames.tobytes(), check=True)
+
+        full = LayerPlacement('top_layer', template, 0.5, 0, 3.0)
+        skipped = LayerPlacement('top_layer', template, 0.5, 0, 3.0,
+                                 visible=tuple(visible_segments(0, 3.0, [(0.0, 1.0), (1.48, 2.48)])))
+        args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac']
+        outputs = []
+        for name, placement in (('full.mp4', full), ('skipped.mp4', skipped)):
+            output = os.path.join(workdir, name)
+            cmd, _ = build_layered_command(material, [[placement]], [output], args, 4.0)
+            subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+            outputs.append(output)
+        for t in (0.3, 1.2, 1.7, 2.5, 3.2, 3.8):
+            a, b = (_pixel(o, t) for o in outputs)
+            assert max(abs(x - y) for x, y in zip(a, b)) <= 4, (t, a, b)
+        assert _pixel(outputs[1], 1.7)[0] > 200 and _pixel(outputs[1], 2.5)[2] > 200
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 跳过全透明片段后画面一致")
+
+
+def test_input_seek_run():
+    """测试从模板中间截取时画面对应截取起点之后的帧"""
+    if not shutil.which('ffmpeg'):
+        print("⚠️ 未安装ffmpeg，跳过")
+        return
+    import numpy as np
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'material.mp4')
+        template = os.path.join(workdir, 'template.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=blue:size=32x18:rate=25:duration=3',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', material],
+                       check=True)
+        # 0-2秒红色，2-3秒绿色
+        frames = np.zeros((75, 18, 32, 4), dtype=np.uint8)
+        frames[:50] = (255, 0, 0, 255)
+        frames[50:] = (0, 255, 0, 255)
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '32x18',
+                        '-r', '25', '-i', 'pipe:0',
+                        '-f', 'lavfi', '-i', 'sine=frequency=880:duration=3',
+                        '-c:v', 'qtrle', '-pix_fmt', 'argb', '-c:a', 'aac', '-shortest', template],
+                       input=frames.tobytes(), check=True)
+        output = os.path.join(workdir, 'out.mp4')
+        # 截取模板1.5-2.5秒，放在素材0.5秒处：0.5-1.0红色，1.0-1.5绿色
+        placement = LayerPlacement('top_layer', template, 0.5, 1.5, 1.0)
+        cmd, _ = build_layered_command(material, [[placement]], [output],
+                                       ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac'], 3.0)
+        subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+        assert _pixel(output, 0.2)[2] > 200
+        assert _pixel(output, 0.8)[0] > 200
+        assert _pixel(output, 1.2)[1] > 200
+        assert _pixel(output, 2.0)[2] > 200
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 输入级seek截取画面正确")
+
+
+def test_multi_variant_run():
+    """测试一条ffmpeg命令同时写出多个变体"""
+    if not shutil.which('ffmpeg'):
+        print("⚠️ 未安装ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'material.mp4')
+        template = os.path.join(workdir, 'template.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'testsrc=size=160x90:rate=25:duration=4',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=4',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', material],
+                       check=True)
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=red@0.5:size=160x90:rate=25:duration=1,format=rgba',
+                        '-f', 'lavfi', '-i', 'sine=frequency=880:duration=1',
+                        '-c:v', 'qtrle', '-c:a', 'aac', '-shortest', template],
+                       check=True)
+        variants = [[LayerPlacement('top_layer', template, t, 0, 1.0)] for t in (0.5, 2.5)]
+        outputs = [os.path.join(workdir, f'out_v{j + 1}.mp4') for j in range(2)]
+        cmd, _ = build_layered_command(material, variants, outputs,
+                                       ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac'], 4.0)
+        subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+        for output in outputs:
+            assert os.path.getsize(output) > 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 多变体一次输出成功")
+
+
+def test_variant_fallback_status():
+    """测试多变体合成失败后逐个重试：进度按变体记录，回退写入 processing_status['jobs']"""
+    import main
+    workdir = tempfile.mkdtemp()
+    original = main._run_ffmpeg_job
+    calls = []
+
+    def fake_job(cmd, show, fallbacks=None, job=None):
+        calls.append(job)
+        if job:
+            show(40.0)
+            return False, '模板解码失败', []
+        show(60.0)
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'x')
+        return True, '', []
+
+    main._run_ffmpeg_job = fake_job
+    try:
+        variants = [('plan', [LayerPlacement('top_layer', '/t/top.mov', t, 0, 1.0)]) for t in (0.5, 2.5)]
+        outputs = [os.path.join(workdir, f'out_v{j + 1}.mp4') for j in range(2)]
+        result = main._run_variant_job('/m/material.mp4', variants, outputs, ['-c:v', 'libx264'], 4.0)
+        jobs = main.processing_status['jobs']
+        assert result['success'] and len(result['outputs']) == 2
+        # 先跑一条合成命令，失败后每个变体单独一条
+        assert calls == ['material.mp4 [2个变体]', None, None]
+        assert jobs['material.mp4 [2个变体]']['fallback'] == 'per_variant'
+        for name in ('out_v1.mp4', 'out_v2.mp4'):
+            assert jobs[name]['shared_decode'] is False
+            assert jobs[name]['fallback_reason'] == '模板解码失败'
+            assert jobs[name]['done'] and jobs[name]['success']
+    finally:
+        main._run_ffmpeg_job = original
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 多变体回退逐个重试有记录")
+
+
+if __name__ == "__main__":
+    print("🧪 测试叠加滤镜图...")
+    test_plan_placements()
+    test_single_variant_graph()
+    test_multi_variant_graph()
+    test_input_seek()
+    test_skip_transparent()
+    test_skip_transparent_run()
+    test_input_seek_run()
+    test_multi_variant_run()
+    test_variant_fallback_status()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试媒体元数据缓存（SQLite + LRU）
+"""
+
+import os
+import sys
+import time
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from media_cache import MediaCache
+
+
+def _make_info(path, duration=12.5):
+    return MediaInfo(
+        path=path, container="mov,mp4,m4a,3gp,3g2,mj2", duration=duration,
+        streams=[StreamInfo(index=0, codec_type="video", codec_name="h264",
+                            pix_fmt="yuv420p", width=1280, height=720, fps=25.0)]
+    )
+
+
+def test_cache_roundtrip_and_invalidation():
+    """测试写入、持久化读取以及文件变化后自动失效"""
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "a.mp4")
+        with open(video, "wb") as f:
+            f.write(b"\0" * 1024)
+
+        db_path = os.path.join(tmp, "cache.db")
+        cache = MediaCache(db_path)
+        assert cache.get(video) is None
+        cache.put(video, _make_info(video))
+        assert cache.get(video).duration == 12.5
+        cache.close()
+
+        # 新实例从SQLite读取
+        cache = MediaCache(db_path)
+        info = cache.get(video)
+        assert info is not None and info.video.width == 1280
+
+        # 修改文件后缓存失效
+        time.sleep(0.01)
+        with open(video, "ab") as f:
+            f.write(b"\1")
+        assert cache.get(video) is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1
+        cache.close()
+    print("✅ 缓存读写与失效正确")
+
+
+def test_cache_bulk_lookup():
+    """测试批量查询"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(5):
+            path = os.path.join(tmp, f"{i}.mp4")
+            with open(path, "wb") as f:
+                f.write(b"\0" * (i + 1))
+            paths.append(path)
+
+        db_path = os.path.join(tmp, "cache.db")
+        cache = MediaCache(db_path)
+        for path in paths[:3]:
+            cache.put(path, _make_info(path, duration=float(len(path))))
+        cache.close()
+
+        cache = MediaCache(db_path)
+        found = cache.get_many(paths + [os.path.join(tmp, "missing.mp4")])
+        assert sorted(found) == sorted(paths[:3])
+        assert cache.stats()['misses'] == 2
+        cache.close()
+    print("✅ 批量查询正确")
+
+
+def test_cache_content_hash():
+    """测试启用内容哈希后，内容未变的文件被touch仍可命中"""
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "b.mov")
+        with open(video, "wb") as f:
+            f.write(b"template" * 100)
+
+        cache = MediaCache(os.path.join(tmp, "cache.db"), hash_content=True)
+        cache.put(video, _make_info(video))
+        st = os.stat(video)
+        os.utime(video, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert cache.get(video) is not None
+        cache.close()
+    print("✅ 内容哈希命中正确")
+
+
+if __name__ == "__main__":
+    test_cache_roundtrip_and_invalidation()
+    test_cache_bulk_lookup()
+    test_cache_content_hash()
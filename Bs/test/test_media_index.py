@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试目录内存索引（MediaIndex）的扫描、增量更新和排序视图
+"""
+
+import os
+import sys
+import time
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_index import MediaIndex
+
+
+def _write(path, mtime=None):
+    with open(path, "wb") as f:
+        f.write(b"x")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_lookup_and_touch():
+    """测试扫描、O(1)查找以及touch同步增删"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _write(os.path.join(tmp, "b.mp4"), 100)
+        _write(os.path.join(tmp, "a.mov"), 200)
+        _write(os.path.join(tmp, "notes.txt"))
+
+        index = MediaIndex({"material": tmp}, {"material": (".mp4", ".mov")})
+        index.rescan()
+        index._started = True  # 不启动后台线程
+        assert index.names("material") == ["a.mov", "b.mp4"]
+        assert index.names("material", order="mtime") == ["a.mov", "b.mp4"]
+        assert index.lookup("material", "b.mp4") == os.path.join(tmp, "b.mp4")
+        assert index.lookup("material", "notes.txt") is None
+
+        version = index.version("material")
+        new_path = os.path.join(tmp, "c.MP4")
+        _write(new_path, 300)
+        index.touch(new_path)
+        assert index.names("material", order="mtime")[0] == "c.MP4"
+        assert index.version("material") > version
+
+        os.remove(os.path.join(tmp, "a.mov"))
+        index.touch(os.path.join(tmp, "a.mov"))
+        assert ("material", "a.mov") not in index
+        assert index.names("material") == ["b.mp4", "c.MP4"]
+    print("✅ 索引查找与同步正确")
+
+
+def test_background_watch():
+    """测试后台监听（inotify或轮询）能发现外部新增的文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MediaIndex({"output": tmp}, {"output": (".mp4",)}, poll_interval=0.1)
+        index.start()
+        try:
+            assert index.names("output") == []
+            _write(os.path.join(tmp, "out.mp4"))
+            deadline = time.time() + 5
+            while time.time() < deadline and "out.mp4" not in index.names("output"):
+                time.sleep(0.05)
+            assert index.names("output") == ["out.mp4"]
+        finally:
+            index.stop()
+    print(f"✅ 后台监听正确 ({index.backend})")
+
+
+def test_background_start():
+    """测试后台启动：就绪前cached_names返回空列表，names等待首次扫描完成"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(3):
+            _write(os.path.join(tmp, f"{i}.mp4"))
+        index = MediaIndex({"material": tmp}, {"material": (".mp4",)})
+        assert index.cached_names("material") == []
+        index.start(background=True)
+        try:
+            assert index.names("material") == ["0.mp4", "1.mp4", "2.mp4"]
+            assert index.ready
+            assert index.cached_names("material") == ["0.mp4", "1.mp4", "2.mp4"]
+        finally:
+            index.stop()
+    print("✅ 后台启动正确")
+
+
+def test_create_dirs():
+    """测试 create_dirs：构造时不创建目录，首次扫描时才创建"""
+    with tempfile.TemporaryDirectory() as tmp:
+        nested = os.path.join(tmp, "alpha", "top_layer")
+        index = MediaIndex({"top_layer": nested}, {"top_layer": (".mp4",)}, create_dirs=True)
+        assert not os.path.exists(nested)
+        index.start(background=True)
+        try:
+            assert index.names("top_layer") == []
+            assert os.path.isdir(nested)
+        finally:
+            index.stop()
+    print("✅ 目录在首次扫描时创建")
+
+
+def test_start_failure():
+    """测试启动失败时查询不会一直等待，退回直接扫描"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _write(os.path.join(tmp, "a.mp4"))
+        index = MediaIndex({"material": tmp}, {"material": (".mp4",)})
+
+        def broken():
+            raise PermissionError("no access")
+
+        index._start_watching = broken
+        index.start(background=True)
+        try:
+            assert index.names("material") == ["a.mp4"]
+            assert isinstance(index.start_error, PermissionError)
+            # 没有后台线程，新文件在下次查询时被扫到
+            _write(os.path.join(tmp, "b.mp4"))
+            assert index.names("material") == ["a.mp4", "b.mp4"]
+        finally:
+            index.stop()
+    print("✅ 启动失败时退回直接扫描")
+
+
+def test_missing_directory():
+    """测试目录缺失时只为它重试监听，其他目录不被反复重扫；目录出现后开始索引"""
+    with tempfile.TemporaryDirectory() as tmp:
+        present = os.path.join(tmp, "present")
+        missing = os.path.join(tmp, "missing")
+        os.mkdir(present)
+        index = MediaIndex({"present": present, "missing": missing},
+                           {"present": (".mp4",), "missing": (".mp4",)}, poll_interval=0.05)
+        rescans = []
+        original = index.rescan
+        index.rescan = lambda key=None: (rescans.append(key), original(key))[1]
+        index.start()
+        try:
+            if index.backend != 'inotify':
+                print("⚠️ 非inotify后端，跳过")
+                return
+            rescans.clear()
+            time.sleep(0.5)
+            assert rescans == []
+            os.mkdir(missing)
+            _write(os.path.join(missing, "late.mp4"))
+            deadline = time.time() + 5
+            while time.time() < deadline and "late.mp4" not in index.names("missing"):
+                time.sleep(0.05)
+            assert index.names("missing") == ["late.mp4"]
+            assert "present" not in rescans and None not in rescans
+        finally:
+            index.stop()
+    print("✅ 缺失目录只重试自身")
+
+
+if __name__ == "__main__":
+    test_lookup_and_touch()
+    test_background_watch()
+    test_background_start()
+    test_create_dirs()
+    test_start_failure()
+    test_missing_directory()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试单次ffprobe媒体探测结果的解析
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import _parse_media_info, pix_fmt_has_alpha
+
+SAMPLE_PROBE = {
+    "streams": [
+        {
+            "index": 0, "codec_name": "prores", "codec_type": "video",
+            "width": 1920, "height": 1080, "pix_fmt": "yuva444p10le",
+            "r_frame_rate": "25/1", "avg_frame_rate": "25/1",
+            "duration": "5.000000", "nb_frames": "125"
+        },
+        {
+            "index": 1, "codec_name": "aac", "codec_type": "audio",
+            "r_frame_rate": "0/0", "avg_frame_rate": "0/0",
+            "duration": "5.002667"
+        }
+    ],
+    "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "duration": "5.002667"}
+}
+
+
+def test_parse_media_info():
+    """测试ffprobe JSON转换为MediaInfo"""
+    info = _parse_media_info("template.mov", SAMPLE_PROBE)
+
+    assert info.container == "mov,mp4,m4a,3gp,3g2,mj2"
+    assert abs(info.duration - 5.002667) < 1e-6
+    assert info.codec == "prores"
+    assert (info.width, info.height) == (1920, 1080)
+    assert info.fps == 25.0
+    assert info.frame_count == 125
+    assert info.has_audio
+    assert info.has_alpha
+    print("✅ MediaInfo解析正确")
+
+
+def test_frame_count_estimate():
+    """测试容器未记录帧数时按时长估算"""
+    data = {
+        "streams": [{"index": 0, "codec_type": "video", "codec_name": "h264",
+                     "pix_fmt": "yuv420p", "avg_frame_rate": "30000/1001"}],
+        "format": {"format_name": "matroska,webm", "duration": "10.0"}
+    }
+    info = _parse_media_info("material.mkv", data)
+
+    assert not info.has_audio
+    assert not info.has_alpha
+    assert info.frame_count == 300
+    print("✅ 帧数估算正确")
+
+
+def test_pix_fmt_alpha():
+    """测试像素格式alpha判断"""
+    assert pix_fmt_has_alpha("yuva420p")
+    assert pix_fmt_has_alpha("rgba")
+    assert not pix_fmt_has_alpha("yuv420p")
+    assert not pix_fmt_has_alpha(None)
+    print("✅ 像素格式判断正确")
+
+
+if __name__ == "__main__":
+    test_parse_media_info()
+    test_frame_count_estimate()
+    test_pix_fmt_alpha()
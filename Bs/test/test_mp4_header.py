@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试纯Python的MP4/MOV文件头解析（moov位于文件末尾、64位mdat）
+"""
+
+import os
+import sys
+import struct
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import read_mp4_header
+
+
+def _box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _video_trak(width, height, timescale, duration, samples, fourcc=b"avc1"):
+    tkhd = _box(b"tkhd", b"\0" * 76 + struct.pack(">II", width << 16, height << 16))
+    mdhd = _box(b"mdhd", b"\0" * 12 + struct.pack(">II", timescale, duration) + b"\0" * 4)
+    hdlr = _box(b"hdlr", b"\0" * 8 + b"vide" + b"\0" * 12)
+    entry = struct.pack(">I4s", 86, fourcc) + b"\0" * 16 + struct.pack(">HH", width, height) + b"\0" * 50
+    stsd = _box(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + entry)
+    stsz = _box(b"stsz", b"\0" * 8 + struct.pack(">I", samples))
+    stbl = _box(b"stbl", stsd + stsz)
+    minf = _box(b"minf", stbl)
+    mdia = _box(b"mdia", mdhd + hdlr + minf)
+    return _box(b"trak", tkhd + mdia)
+
+
+def _audio_trak(timescale, duration):
+    mdhd = _box(b"mdhd", b"\0" * 12 + struct.pack(">II", timescale, duration) + b"\0" * 4)
+    hdlr = _box(b"hdlr", b"\0" * 8 + b"soun" + b"\0" * 12)
+    entry = struct.pack(">I4s", 36, b"mp4a") + b"\0" * 28
+    stsd = _box(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + entry)
+    minf = _box(b"minf", _box(b"stbl", stsd))
+    return _box(b"trak", _box(b"mdia", mdhd + hdlr + minf))
+
+
+def test_moov_at_end():
+    """测试moov在mdat之后，且mdat使用64位大小"""
+    mvhd = _box(b"mvhd", b"\0" * 12 + struct.pack(">II", 1000, 90500) + b"\0" * 80)
+    moov = _box(b"moov", mvhd + _video_trak(1920, 1080, 12800, 1152000, 2250) + _audio_trak(44100, 3991050))
+    mdat_payload = 64 * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "material.mp4")
+        with open(path, "wb") as f:
+            f.write(_box(b"ftyp", b"isom\0\0\2\0isomiso2avc1mp41"))
+            f.write(struct.pack(">I4sQ", 1, b"mdat", 16 + mdat_payload))
+            # 稀疏写入，mdat内容不会被读取
+            f.seek(mdat_payload, os.SEEK_CUR)
+            f.write(moov)
+
+        info = read_mp4_header(path)
+
+    assert info is not None
+    assert abs(info.duration - 90.5) < 1e-9
+    assert (info.width, info.height) == (1920, 1080)
+    assert info.codec == "h264"
+    assert abs(info.fps - 25.0) < 1e-6
+    assert info.frame_count == 2250
+    assert info.has_audio
+    print("✅ 文件头解析正确")
+
+
+def test_non_mp4_falls_back():
+    """测试非MP4容器或缺少moov时返回None"""
+    with tempfile.TemporaryDirectory() as tmp:
+        mkv = os.path.join(tmp, "a.mkv")
+        truncated = os.path.join(tmp, "b.mov")
+        for path in (mkv, truncated):
+            with open(path, "wb") as f:
+                f.write(_box(b"ftyp", b"qt  ") + struct.pack(">I4s", 4096, b"mdat"))
+        assert read_mp4_header(mkv) is None
+        assert read_mp4_header(truncated) is None
+    print("✅ 非MP4回退正确")
+
+
+if __name__ == "__main__":
+    test_moov_at_end()
+    test_non_mp4_falls_back()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试NumPy合成后端：预乘alpha混合、片段帧范围和与滤镜图一致的输出
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from layer_graph import LayerPlacement, build_layered_command
+from graph_planner import plan_graph
+from frame_store import FrameStore
+from numpy_compositor import premultiply, BLEND_MODES, plan_clips, build_encoder_command, composite
+
+
+def _info(path, codec, pix_fmt, width, height, fps, duration=10.0):
+    return MediaInfo(path=path, container='mov', duration=duration, streams=[
+        StreamInfo(0, 'video', codec, pix_fmt, width, height, fps),
+        StreamInfo(1, 'audio', 'aac', sample_rate=44100, channels=1)])
+
+
+def test_blend_modes():
+    """测试预乘和各混合模式"""
+    src = np.array([[[255, 0, 0, 128], [255, 255, 255, 0], [0, 0, 255, 255]]], dtype=np.uint8)
+    rgb, alpha = premultiply(src)
+    assert rgb.tolist() == [[[128, 0, 0], [0, 0, 0], [0, 0, 255]]]
+    dst = np.full((1, 3, 3), 100, dtype=np.uint16)
+    assert BLEND_MODES['normal'](dst, rgb, alpha).tolist() == [[[178, 50, 50], [100, 100, 100], [0, 0, 255]]]
+    assert BLEND_MODES['add'](dst, rgb, alpha).tolist() == [[[228, 100, 100], [100, 100, 100], [100, 100, 255]]]
+    assert BLEND_MODES['screen'](dst, rgb, alpha)[0, 2].tolist() == [100, 100, 255]
+    assert BLEND_MODES['multiply'](dst, rgb, alpha)[0, 2].tolist() == [0, 0, 100]
+    print("✅ 混合模式正确")
+
+
+def test_plan_clips():
+    """测试片段帧范围与overlay的enable窗口一致"""
+    material = _info('/m/a.mp4', 'h264', 'yuv420p', 1280, 720, 25.0)
+    placements = [
+        LayerPlacement('bottom_layer', '/t/a.mov', 4.5, 0, 2.0),
+        LayerPlacement('top_layer', '/t/b.mov', 1.0, 1.0, 3.0, visible=((1.0, 2.0), (3.0, 4.0)), x=8, y=4),
+    ]
+    infos = {'/t/a.mov': _info('/t/a.mov', 'qtrle', 'argb', 1920, 1080, 30.0, 2.0),
+             '/t/b.mov': _info('/t/b.mov', 'qtrle', 'argb', 640, 360, 25.0, 5.0)}
+    plan = plan_graph(material, placements, output_fps=24, infos=infos, scale_templates=True)
+    clips = plan_clips(placements, plan)
+    assert [(c.first_frame, c.end_frame) for c in clips] == [(108, 156), (24, 48), (72, 96)]
+    assert clips[0].filters == ['fps=24', 'scale=1280:720', 'format=rgba']
+    assert (clips[0].width, clips[0].height) == (1280, 720)
+    # 640x360 模板放大到素材尺寸，叠加位置同比例放大
+    assert (clips[1].seek, clips[2].seek, clips[2].x, clips[2].y) == (1.0, 3.0, 16, 8)
+
+    # 智能渲染时出现时间前移
+    clips = plan_clips(placements[:1], plan, time_shift=4.0)
+    assert (clips[0].first_frame, clips[0].end_frame) == (12, 60)
+    print("✅ 片段帧范围正确")
+
+
+def test_encoder_command():
+    """测试编码进程只从ffmpeg混合音频"""
+    placements = [LayerPlacement('top_layer', '/t/a.mov', 2.0, 0.5, 1.0)]
+    cmd = build_encoder_command('/m/a.mp4', placements, '/o/out.mp4', ['-c:v', 'libx264'], 64, 36, 24, 5.0)
+    graph = cmd[cmd.index('-filter_complex') + 1]
+    assert cmd[cmd.index('-f') + 1] == 'rawvideo' and '64x36' in cmd
+    assert '-ss' in cmd and '[2:a]asetpts=PTS-STARTPTS,adelay=2000:all=1' in graph
+    assert '[1:a][a1]amix=inputs=2' in graph and 'overlay' not in graph
+    assert cmd[-3:] == ['-t', '5.0', '/o/out.mp4']
+    print("✅ 编码命令正确")
+
+
+def _pixel(path, x, y, t):
+    data = subprocess.run(['ffmpeg', '-v', 'error', '-ss', str(t), '-i', path, '-frames:v', '1',
+                           '-vf', f'crop=2:2:{x}:{y}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                          capture_output=True).stdout
+    return tuple(data[:3])
+
+
+def test_composite_run():
+    """测试NumPy合成结果与滤镜图一致"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'mat.mp4')
+        bottom = os.path.join(workdir, 'bottom.mov')
+        top = os.path.join(workdir, 'top.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'color=gray:s=64x36:r=25:d=3',
+                        '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono', '-t', '3',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', material], check=True)
+        for path, color in ((bottom, 'red@0.5'), (top, 'blue')):
+            subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'color={color}:s=32x18:r=25:d=1,format=rgba',
+                            '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono', '-t', '1',
+                            '-c:v', 'qtrle', '-c:a', 'pcm_s16le', path], check=True)
+        placements = [LayerPlacement('bottom_layer', bottom, 1.0, 0, 1.0, x=0, y=0),
+                      LayerPlacement('top_layer', top, 1.5, 0, 1.0, x=16, y=10)]
+        plan = plan_graph(_info(material, 'h264', 'yuv420p', 64, 36, 25.0, 3.0), placements, output_fps=24,
+                          infos={p: _info(p, 'qtrle', 'argb', 32, 18, 25.0, 1.0) for p in (bottom, top)},
+                          scale_templates=True)
+        args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-r', '24']
+        filter_out = os.path.join(workdir, 'filter.mp4')
+        numpy_out = os.path.join(workdir, 'numpy.mp4')
+        cmd, _ = build_layered_command(material, [placements], [filter_out], args, 3.0, graph_plan=plan)
+        subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+        ok, msg = composite(material, placements, numpy_out, args, 3.0, plan, batch_frames=5)
+        assert ok, msg
+        # 32x18 模板放大到 64x36，顶层叠加位置 (16, 10) -> (32, 20)
+        for x, y, t in ((4, 4, 0.5), (4, 4, 1.2), (20, 12, 1.7), (48, 28, 1.7), (4, 4, 2.2), (48, 28, 2.7)):
+            # 两次都是有损编码，允许少量误差
+            a, b = _pixel(filter_out, x, y, t), _pixel(numpy_out, x, y, t)
+            assert max(abs(i - j) for i, j in zip(a, b)) <= 6, (x, y, t, a, b)
+        assert _pixel(numpy_out, 48, 28, 1.7)[2] > 200
+
+        # 从模板帧仓库读取，第二次不再解码模板
+        store = FrameStore(os.path.join(workdir, 'frames'))
+        stored_out = os.path.join(workdir, 'stored.mp4')
+        for _ in range(2):
+            ok, msg = composite(material, placements, stored_out, args, 3.0, plan, frame_store=store)
+            assert ok, msg
+        assert (store.misses, store.hits) == (2, 2)
+        for x, y, t in ((20, 12, 1.7), (48, 28, 1.7)):
+            assert max(abs(i - j) for i, j in zip(_pixel(numpy_out, x, y, t), _pixel(stored_out, x, y, t))) <= 2
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ NumPy合成结果与滤镜图一致")
+
+
+def test_decoder_failure():
+    """测试模板解码失败时整个任务失败（而不是悄悄少一层），并删除写了一半的输出"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        material = os.path.join(workdir, 'mat.mp4')
+        broken = os.path.join(workdir, 'broken.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'color=gray:s=64x36:r=25:d=3',
+                        '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono', '-t', '3',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', material], check=True)
+        with open(broken, 'wb') as f:
+            f.write(b'not a video' * 100)
+        placements = [LayerPlacement('top_layer', broken, 1.0, 0, 1.0)]
+        plan = plan_graph(_info(material, 'h264', 'yuv420p', 64, 36, 25.0, 3.0), placements, output_fps=24,
+                          infos={broken: _info(broken, 'qtrle', 'argb', 32, 18, 25.0, 1.0)})
+        output = os.path.join(workdir, 'out.mp4')
+        ok, msg = composite(material, placements, output, ['-c:v', 'libx264', '-c:a', 'aac'], 3.0, plan,
+                            batch_frames=5)
+        assert not ok and '读取top_layer帧失败' in msg and '退出码' in msg, msg
+        assert not os.path.exists(output)
+
+        # 素材解码失败同样报错
+        ok, msg = composite(broken, [], output, ['-c:v', 'libx264'], 3.0, plan)
+        assert not ok and not os.path.exists(output), msg
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 解码失败正确报错")
+
+
+if __name__ == "__main__":
+    print("🧪 测试NumPy合成后端...")
+    test_blend_modes()
+    test_plan_clips()
+    test_encoder_command()
+    test_composite_run()
+    test_decoder_failure()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多层模板预合成：批次适用条件、叠加计划匹配和带alpha的中间文件
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from layer_graph import LayerPlacement, build_layered_command
+from precomposite import LayerSpan, PrecompositeStack, layer_spans, build_precomposite
+
+
+def test_match():
+    """测试叠加计划一致（含素材较短导致截断）时用一路叠加代替"""
+    stack = PrecompositeStack('/s/stack.mov', (
+        LayerSpan('/t/bottom.mov', 0, 0.0, 30.0),
+        LayerSpan('/t/top.mov', 1, 0.0, 2.0),
+    ), 30.0)
+    placements = [
+        LayerPlacement('bottom_layer', '/t/bottom.mov', 5.0, 0, 30.0),
+        LayerPlacement('top_layer', '/t/top.mov', 5.0, 1, 2.0),
+    ]
+    stacked = stack.match(placements, 60.0)
+    assert stacked.template_path == '/s/stack.mov'
+    assert stacked.offset == 5.0 and stacked.audio_weight == 2
+
+    # 底层被20秒的素材截断，超出部分本来就会被裁掉
+    truncated = [
+        LayerPlacement('bottom_layer', '/t/bottom.mov', 5.0, 0, 15.0),
+        LayerPlacement('top_layer', '/t/top.mov', 5.0, 1, 2.0),
+    ]
+    assert stack.match(truncated, 20.0) is not None
+
+    # 时间错开或截取不同时不能共用
+    shifted = [
+        LayerPlacement('bottom_layer', '/t/bottom.mov', 5.0, 0, 30.0),
+        LayerPlacement('top_layer', '/t/top.mov', 6.0, 1, 2.0),
+    ]
+    assert stack.match(shifted, 60.0) is None
+    assert stack.match(truncated, 60.0) is None
+
+    # 标准模式短模板（不trim，仅在前N秒生效）按可见时长比较
+    _, spans = layer_spans([LayerPlacement('top_layer', '/t/top.mov', 0, 0, 4.0, trim=False, enable_until=4.0)])
+    assert spans == [LayerSpan('/t/top.mov', 0.0, 0.0, 4.0)]
+    print("✅ 叠加计划匹配正确")
+
+
+def test_audio_weight():
+    """测试预合成层混音时按包含的图层数加权"""
+    placement = LayerPlacement('stack', '/s/stack.mov', 0, 0, 5.0, audio_weight=3)
+    _, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/out.mp4'], [], 10.0)
+    assert 'weights=1 3' in graph
+    print("✅ 预合成层混音权重正确")
+
+
+def _pixel(path, t):
+    data = subprocess.run(['ffmpeg', '-v', 'error', '-ss', str(t), '-i', path, '-frames:v', '1',
+                           '-f', 'rawvideo', '-pix_fmt', 'rgba', '-'], capture_output=True).stdout
+    return tuple(data[:4])
+
+
+def test_build():
+    """测试预合成结果保留alpha，且同样的输入第二次直接复用"""
+    if not shutil.which('ffmpeg'):
+        print("⚠️ 未安装ffmpeg，跳过")
+        return
+    import media_cache
+    from utils import MediaInfo, StreamInfo
+
+    workdir = tempfile.mkdtemp()
+    saved_cache = media_cache._default_cache
+    try:
+        cache = media_cache.configure_media_cache(os.path.join(workdir, 'cache.db'))
+        template = os.path.join(workdir, 'red.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=red@0.5:size=32x18:rate=25:duration=2,format=rgba',
+                        '-f', 'lavfi', '-i', 'sine=frequency=880:duration=2',
+                        '-c:v', 'qtrle', '-c:a', 'aac', '-shortest', template],
+                       check=True)
+        cache.put(template, MediaInfo(path=template, container='mov', duration=2.0, streams=[
+            StreamInfo(0, 'video', 'qtrle', 'argb', 32, 18, 25.0),
+            StreamInfo(1, 'audio', 'aac', sample_rate=44100, channels=1)]))
+        spans = [LayerSpan(template, 0.0, 0.0, 2.0), LayerSpan(template, 0.0, 1.0, 1.0)]
+        scratch = os.path.join(workdir, 'scratch')
+        stack = build_precomposite(spans, scratch)
+        assert stack.duration == 2.0
+        # 只有一层：半透明；两层重叠：alpha = 0.5 + 0.5 * 0.5
+        assert _pixel(stack.path, 0.5)[3] in (127, 128)
+        assert _pixel(stack.path, 1.5)[3] in (191, 192)
+
+        mtime = os.path.getmtime(stack.path)
+        again = build_precomposite(spans, scratch)
+        assert again.path == stack.path and os.path.getmtime(again.path) >= mtime
+        assert len(os.listdir(scratch)) == 1
+    finally:
+        media_cache._default_cache = saved_cache
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 预合成文件生成和复用正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试多层模板预合成...")
+    test_match()
+    test_audio_weight()
+    test_build()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试异步探测服务的并发上限、重复请求合并和超时
+"""
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_cache import MediaCache
+import utils
+from probe_service import ProbeService
+
+# 模拟ffprobe：休眠指定秒数后输出固定JSON
+FAKE_FFPROBE = """#!{python}
+import sys, time, json
+time.sleep({delay})
+print(json.dumps({{"format": {{"format_name": "mov", "duration": "4.0"}},
+                  "streams": [{{"index": 0, "codec_type": "video", "codec_name": "prores",
+                               "pix_fmt": "yuva444p10le", "width": 64, "height": 36,
+                               "avg_frame_rate": "25/1"}}]}}))
+"""
+
+
+def _make_service(tmp, delay, **kwargs):
+    script = os.path.join(tmp, "ffprobe")
+    with open(script, "w") as f:
+        f.write(FAKE_FFPROBE.format(python=sys.executable, delay=delay))
+    os.chmod(script, 0o755)
+    cache = MediaCache(os.path.join(tmp, "cache.db"))
+    return ProbeService(ffprobe=script, cache=cache, **kwargs), cache
+
+
+def _media(tmp, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(tmp, f"{i}.mov")
+        with open(path, "wb") as f:
+            f.write(bytes([i]))
+        paths.append(path)
+    return paths
+
+
+def test_coalescing_and_limit():
+    """测试同一文件只探测一次，且同时运行的ffprobe不超过上限"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service, cache = _make_service(tmp, 0.3, max_concurrent=2)
+        paths = _media(tmp, 4)
+
+        async def run():
+            # 每个文件5个并发请求
+            return await asyncio.gather(*[service.probe(p) for p in paths for _ in range(5)])
+
+        results = asyncio.run(run())
+        assert all(info.has_alpha and info.duration == 4.0 for info in results)
+        stats = service.stats()
+        assert stats['spawned'] == 4
+        assert stats['coalesced'] == 16
+        assert stats['peak_running'] <= 2
+
+        # 再次请求直接命中缓存
+        asyncio.run(service.probe(paths[0]))
+        assert service.stats()['spawned'] == 4
+        cache.close()
+    print("✅ 请求合并与并发上限正确")
+
+
+def test_timeouts():
+    """测试请求等待超时和ffprobe运行超时"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service, cache = _make_service(tmp, 5, probe_timeout=0.5)
+        path = _media(tmp, 1)[0]
+
+        async def run():
+            try:
+                await service.probe(path, timeout=0.1)
+                raise AssertionError("应当超时")
+            except asyncio.TimeoutError:
+                pass
+            # 第一个请求超时后，后续请求仍共享同一次探测，直到探测本身超时被终止
+            try:
+                await service.probe(path)
+                raise AssertionError("应当超时")
+            except asyncio.TimeoutError:
+                pass
+            return await service.duration(path)
+
+        assert asyncio.run(run()) is None
+        stats = service.stats()
+        assert stats['spawned'] == 2
+        assert stats['coalesced'] == 1
+        assert stats['timeouts'] == 2
+        assert stats['running'] == 0
+        cache.close()
+    print("✅ 超时处理正确")
+
+
+def test_shared_slots():
+    """测试异步服务和同步 probe_media 共用进程内的ffprobe名额"""
+    previous = utils.probe_slot_limit()
+    slots = utils.configure_probe_slots(1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            service, cache = _make_service(tmp, 0)
+            path = _media(tmp, 1)[0]
+            assert service.slots is slots and service.stats()['max_concurrent'] == 1
+
+            # 名额被同步代码占用时，异步探测只能排队
+            slots.acquire()
+            try:
+                try:
+                    asyncio.run(service.probe(path, timeout=0.3))
+                    raise AssertionError("应当排队等待名额")
+                except asyncio.TimeoutError:
+                    pass
+                assert service.stats()['spawned'] == 0
+            finally:
+                slots.release()
+            assert asyncio.run(service.probe(path)).duration == 4.0
+
+            # 同步 probe_media 同样要先拿到名额
+            slots.acquire()
+            done = threading.Event()
+
+            def sync_probe():
+                try:
+                    utils.probe_media(path)
+                except Exception:
+                    pass
+                done.set()
+
+            threading.Thread(target=sync_probe, daemon=True).start()
+            assert not done.wait(0.3)
+            slots.release()
+            assert done.wait(10)
+            # 名额全部归还
+            assert slots.acquire(blocking=False)
+            slots.release()
+            cache.close()
+    finally:
+        utils.configure_probe_slots(previous)
+    print("✅ 同步与异步探测共用并发上限")
+
+
+if __name__ == "__main__":
+    test_coalescing_and_limit()
+    test_timeouts()
+    test_shared_slots()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试子进程登记处：按任务/批次登记、整组停止、SIGKILL升级和取消后拒绝启动
+"""
+
+import os
+import sys
+import time
+import shutil
+import threading
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_supervisor import ProcessSupervisor, ProcessCancelled
+from ffmpeg_processor import FFmpegProcessor
+
+SLEEPER = [sys.executable, '-c', 'import time; time.sleep(60)']
+# 忽略SIGTERM，只能被SIGKILL结束
+STUBBORN = [sys.executable, '-c',
+            'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print("ready", flush=True); time.sleep(60)']
+
+
+def test_scope_and_cancel_job():
+    """测试范围内启动的进程按任务登记，取消一个任务不影响其他任务"""
+    supervisor = ProcessSupervisor(kill_grace=0.5)
+    with supervisor.scope(job='a.mp4', batch='b1'):
+        a = supervisor.popen(SLEEPER)
+        with supervisor.scope(job='a-variant'):
+            nested = supervisor.popen(SLEEPER)
+    with supervisor.scope(job='c.mp4', batch='b1'):
+        c = supervisor.popen(SLEEPER)
+    try:
+        assert [child.process for child in supervisor.children(job='a.mp4')] == [a]
+        assert supervisor.children(job='a-variant')[0].batch == 'b1'
+        assert len(supervisor.children(batch='b1')) == 3
+        # 每个子进程自成进程组
+        assert os.getpgid(a.pid) == a.pid
+
+        assert supervisor.cancel_job('a.mp4') == 1
+        assert a.wait(timeout=2) is not None and c.poll() is None and nested.poll() is None
+        with supervisor.scope(job='a.mp4', batch='b1'):
+            try:
+                supervisor.popen(SLEEPER)
+                assert False, "已取消的任务不应再启动进程"
+            except ProcessCancelled:
+                pass
+        supervisor.release(a)
+        assert len(supervisor.children(batch='b1')) == 2
+    finally:
+        supervisor.cancel_all()
+    print("✅ 任务登记和取消正确")
+
+
+def test_cancel_batch_escalates():
+    """测试取消16个进程的批次在1秒内全部结束，忽略SIGTERM的进程被SIGKILL"""
+    supervisor = ProcessSupervisor(kill_grace=0.3)
+    processes = []
+    with supervisor.scope(batch='big'):
+        for n in range(15):
+            with supervisor.scope(job=f'm{n}.mp4'):
+                processes.append(supervisor.popen(SLEEPER))
+        stubborn = supervisor.popen(STUBBORN, stdout=subprocess.PIPE)
+        assert stubborn.stdout.readline().strip() == b'ready'
+    other = supervisor.popen(SLEEPER, batch='other')
+    try:
+        start = time.monotonic()
+        assert supervisor.cancel_batch('big') == 16
+        for process in processes + [stubborn]:
+            process.wait(timeout=2)
+        elapsed = time.monotonic() - start
+        assert elapsed < 1.0, elapsed
+        assert stubborn.returncode == -9
+        assert all(p.returncode == -15 for p in processes)
+        assert other.poll() is None
+
+        # 重置后同名批次可以再次启动
+        supervisor.reset()
+        extra = supervisor.popen(SLEEPER, batch='big')
+        assert supervisor.cancel_all() == 2 and extra.wait(timeout=2) is not None
+    finally:
+        supervisor.cancel_all()
+    print(f"✅ 批次取消正确（16个进程 {elapsed * 1000:.0f}ms 内结束）")
+
+
+def test_cancel_during_popen():
+    """测试启动进程时不占锁；启动期间任务被取消时，新进程被停止并抛出ProcessCancelled"""
+    import process_supervisor
+    supervisor = ProcessSupervisor(kill_grace=0.3)
+    real_popen = subprocess.Popen
+    spawned = []
+
+    def racing_popen(*args, **kwargs):
+        process = real_popen(*args, **kwargs)
+        spawned.append(process)
+        # 另一个线程在进程启动后、登记前取消任务；启动时若占着锁这里会一直等待
+        canceller = threading.Thread(target=supervisor.cancel_job, args=('race',))
+        canceller.start()
+        canceller.join(timeout=2)
+        assert not canceller.is_alive(), "启动进程时不应占着锁"
+        return process
+
+    process_supervisor.subprocess.Popen = racing_popen
+    try:
+        with supervisor.scope(job='race'):
+            supervisor.popen(SLEEPER)
+        assert False, "启动期间被取消应抛出ProcessCancelled"
+    except ProcessCancelled:
+        pass
+    finally:
+        process_supervisor.subprocess.Popen = real_popen
+        supervisor.cancel_all()
+    assert spawned[0].poll() is not None
+    assert supervisor.children() == []
+    print("✅ 启动期间取消正确")
+
+
+def test_run_timeout():
+    """测试 run 超时时停止进程并注销"""
+    supervisor = ProcessSupervisor(kill_grace=0.2)
+    result = supervisor.run([sys.executable, '-c', 'print("hi")'], capture_output=True, text=True)
+    assert result.returncode == 0 and result.stdout.strip() == 'hi'
+    start = time.monotonic()
+    try:
+        supervisor.run(SLEEPER, timeout=0.3)
+        assert False, "应当超时"
+    except subprocess.TimeoutExpired:
+        pass
+    assert time.monotonic() - start < 2
+    assert supervisor.children() == []
+    print("✅ run超时处理正确")
+
+
+def test_processor_cancel_job():
+    """测试取消任务时正在编码的FFmpegProcessor立即返回"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    supervisor = ProcessSupervisor(kill_grace=0.5)
+    cmd = ['ffmpeg', '-y', '-re', '-f', 'lavfi', '-i', 'testsrc2=s=64x36:r=25', '-t', '60', '-f', 'null', os.devnull]
+    processor = FFmpegProcessor(max_retries=3, timeout=120, supervisor=supervisor)
+    result = {}
+
+    def run():
+        with supervisor.scope(job='encode'):
+            result['value'] = processor.process_with_retry(cmd)
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    deadline = time.monotonic() + 10
+    while not supervisor.children(job='encode') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    start = time.monotonic()
+    assert supervisor.cancel_job('encode') == 1
+    worker.join(timeout=5)
+    assert not worker.is_alive() and time.monotonic() - start < 2
+    ok, msg = result['value']
+    assert not ok and '取消' in msg
+    # 被取消的任务不再重试
+    assert len(processor.attempt_metrics) == 1
+    assert supervisor.children() == []
+    print("✅ 处理器随任务取消正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试子进程登记处...")
+    test_scope_and_cancel_job()
+    test_cancel_batch_escalates()
+    test_cancel_during_popen()
+    test_run_timeout()
+    test_processor_cancel_job()
+    print("\n🎉 所有测试通过！")
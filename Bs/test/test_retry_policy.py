@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试重试策略：失败分类、降级阶梯、永久性错误不重试和尝试路径记录
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retry_policy import (RetryPolicy, RetryState, classify_failure, faster_preset, fewer_threads,
+                          lower_resolution, PERMANENT, RESOURCE, TRANSIENT)
+from ffmpeg_processor import FFmpegProcessor
+
+# 与 build_layered_command 生成的命令同样的结构：两个输出，各自先映射视频再映射音频
+COMMAND = ["ffmpeg", "-threads", "0", "-i", "m.mp4", "-i", "t.mov",
+           "-filter_complex", "[0:v][1:v]overlay[v0];[0:v][1:v]overlay[v1];[0:a]asplit[a0][a1]", "-y",
+           "-map", "[v0]", "-map", "[a0]", "-c:v", "libx264", "-preset", "veryfast", "-threads", "4", "-t", "5", "a.mp4",
+           "-map", "[v1]", "-map", "[a1]", "-c:v", "libx264", "-preset", "veryfast", "-threads", "4", "-t", "5", "b.mp4"]
+
+
+def test_classify():
+    """测试按看门狗决定、错误类别和退出码分类"""
+    assert classify_failure({'verdict': 'stall', 'error_class': 'missing_file'}) == RESOURCE
+    assert classify_failure({'error_class': 'filter_graph', 'returncode': 1}) == PERMANENT
+    assert classify_failure({'error_class': 'memory', 'returncode': 1}) == RESOURCE
+    assert classify_failure({'error_class': None, 'returncode': -9}) == RESOURCE
+    assert classify_failure({'error_class': None, 'returncode': 137}) == RESOURCE
+    assert classify_failure({'error_class': None, 'returncode': 1}) == TRANSIENT
+    assert classify_failure({}) == TRANSIENT
+    print("✅ 失败分类正确")
+
+
+def test_fallbacks():
+    """测试各级降级对命令的改写"""
+    faster = faster_preset(COMMAND)
+    assert faster.count("ultrafast") == 2 and "veryfast" not in faster
+    assert faster_preset(faster) is None
+
+    fewer = fewer_threads(COMMAND)
+    # 输入级 -threads 0 不变，输出级 4 -> 2
+    assert fewer[1:3] == ["-threads", "0"] and fewer.count("2") == 2
+    assert fewer_threads(["ffmpeg", "-i", "a", "-threads", "1", "o.mp4"]) is None
+    assert fewer_threads(["ffmpeg", "-i", "a", "o.mp4"])[-3] == "-threads"
+
+    lowered = lower_resolution(COMMAND)
+    graph = lowered[lowered.index("-filter_complex") + 1]
+    assert graph.endswith("[v0]scale=trunc(iw*0.75/2)*2:trunc(ih*0.75/2)*2[v0_lowres];"
+                          "[v1]scale=trunc(iw*0.75/2)*2:trunc(ih*0.75/2)*2[v1_lowres]")
+    assert lowered.count("[v0_lowres]") == 1 and "[a0]" in lowered and "[a0_lowres]" not in graph
+    assert lower_resolution(["ffmpeg", "-i", "a", "-vf", "fps=24", "o.mp4"])[4] == \
+        "fps=24,scale=trunc(iw*0.75/2)*2:trunc(ih*0.75/2)*2"
+    assert lower_resolution(["ffmpeg", "-i", "a", "-c:v", "copy", "o.mp4"]) is None
+    print("✅ 降级改写正确")
+
+
+def test_decide():
+    """测试资源不足沿阶梯降级，跳过不适用的级，永久性错误不重试"""
+    policy = RetryPolicy(transient_retries=1, backoff=0)
+    state = RetryState()
+    command = ["ffmpeg", "-i", "a", "-preset", "ultrafast", "o.mp4"]
+    first = policy.decide(RESOURCE, command, state)
+    # 已是 ultrafast，直接跳到减少线程
+    assert first.retry and first.fallback == "fewer_threads"
+    second = policy.decide(RESOURCE, first.command, state)
+    assert second.fallback == "lower_resolution" and "-vf" in second.command
+    third = policy.decide(RESOURCE, second.command, state)
+    assert third.retry and third.fallback is None and third.command == second.command
+    assert not policy.decide(RESOURCE, third.command, state).retry
+    assert not policy.decide(PERMANENT, command, RetryState()).retry
+    try:
+        RetryPolicy(ladder=["bigger_gpu"])
+        assert False, "未知的降级方式应当报错"
+    except ValueError:
+        pass
+    print("✅ 重试决定正确")
+
+
+class FlakyProcessor(FFmpegProcessor):
+    """分辨率降低之前一直内存不足的处理器"""
+
+    def _execute_ffmpeg(self, command, progress_callback=None, duration=None, stats_callback=None):
+        graph = command[command.index("-filter_complex") + 1]
+        if "_lowres" in graph:
+            return True, "ok"
+        self.attempt_metrics.append({'error_class': 'memory', 'returncode': 1, 'verdict': None})
+        return False, "内存不足: Cannot allocate memory"
+
+
+def test_processor_path():
+    """测试处理器记录尝试路径，永久性错误只尝试一次"""
+    processor = FlakyProcessor(max_retries=5, retry_policy=RetryPolicy(backoff=0))
+    ok, _ = processor.process_with_retry(COMMAND)
+    assert ok
+    assert [step['fallbacks'] for step in processor.attempt_path] == [
+        [], ["faster_preset"], ["faster_preset", "fewer_threads"],
+        ["faster_preset", "fewer_threads", "lower_resolution"]]
+    assert [step['outcome'] for step in processor.attempt_path] == [RESOURCE] * 3 + ['ok']
+
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未找到ffmpeg，跳过")
+        return
+    workdir = tempfile.mkdtemp()
+    try:
+        processor = FFmpegProcessor(max_retries=3, timeout=60)
+        ok, msg = processor.process_with_retry(
+            ['ffmpeg', '-y', '-i', os.path.join(workdir, 'missing.mov'), os.path.join(workdir, 'out.mp4')])
+        assert not ok and msg.startswith("文件不存在或路径错误")
+        assert len(processor.attempt_path) == 1 and processor.attempt_path[0]['outcome'] == PERMANENT
+
+        # 降低分辨率后的多输出命令能被ffmpeg执行
+        output = os.path.join(workdir, 'low.mp4')
+        cmd = lower_resolution(['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc2=s=320x180:r=25', '-f', 'lavfi',
+                                '-i', 'sine', '-filter_complex', '[0:v]null[v];[1:a]anull[a]',
+                                '-map', '[v]', '-map', '[a]', '-t', '1', output])
+        assert FFmpegProcessor(max_retries=1).process_with_retry(cmd)[0]
+        frame = subprocess.run(['ffmpeg', '-v', 'error', '-i', output, '-frames:v', '1', '-f', 'rawvideo',
+                                '-pix_fmt', 'gray', '-'], capture_output=True, check=True).stdout
+        assert len(frame) == 240 * 134
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 尝试路径记录正确")
+
+
+if __name__ == "__main__":
+    print("🧪 测试重试策略...")
+    test_classify()
+    test_fallbacks()
+    test_decide()
+    test_processor_path()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试智能渲染：时间窗合并、关键帧对齐和片段拼接
+"""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+from keyframe_index import KeyframeIndex
+from smart_render import merge_windows, check_source, plan_smart_render, assemble, SmartRenderPlan
+
+
+def test_plan():
+    """测试时间窗合并及向外对齐到关键帧"""
+    assert merge_windows([(5, 8), (-1, 0), (7, 9), (20, 95)], 90) == [(5, 9), (20, 90)]
+
+    keyframes = KeyframeIndex([float(t) for t in range(0, 90, 2)])
+    plan, _ = plan_smart_render([(31.5, 36.5), (33, 34)], 90, keyframes)
+    assert (plan.render_start, plan.render_end) == (30.0, 38.0)
+    assert plan.has_head and plan.has_tail
+
+    plan, _ = plan_smart_render([(0.5, 4)], 90, keyframes)
+    assert plan.render_start == 0.0 and not plan.has_head
+
+    plan, _ = plan_smart_render([(85.5, 89.5)], 90, keyframes)
+    assert plan.render_end == 90 and not plan.has_tail
+
+    # 重编码区间过大时回退到整段编码
+    plan, reason = plan_smart_render([(5, 80)], 90, keyframes)
+    assert plan is None and reason
+    print("✅ 智能渲染区间计算正确")
+
+
+def test_check_source():
+    """测试只有H.264/AAC素材才能直接复制拼接"""
+    video = StreamInfo(index=0, codec_type="video", codec_name="h264", pix_fmt="yuv420p")
+    audio = StreamInfo(index=1, codec_type="audio", codec_name="aac", sample_rate=48000, channels=2)
+    assert check_source(MediaInfo(path="a.mp4", streams=[video, audio])) is None
+    hevc = StreamInfo(index=0, codec_type="video", codec_name="hevc", pix_fmt="yuv420p")
+    assert check_source(MediaInfo(path="b.mp4", streams=[hevc, audio]))
+    mp3 = StreamInfo(index=1, codec_type="audio", codec_name="mp3", sample_rate=44100, channels=2)
+    assert check_source(MediaInfo(path="c.mp4", streams=[video, mp3]))
+    print("✅ 素材格式检查正确")
+
+
+def test_output_fps_mismatch():
+    """测试素材帧率与输出帧率不同时不做智能渲染，避免同一批输出帧率不一致"""
+    import media_cache
+    from keyframe_index import KEYFRAME_BLOB_KIND
+    from smart_render import plan_for_material
+
+    previous_cache = media_cache._default_cache
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = media_cache.configure_media_cache(os.path.join(tmp, "cache.db"))
+        try:
+            material = os.path.join(tmp, "material.mp4")
+            with open(material, "wb") as f:
+                f.write(b"x")
+            cache.put(material, MediaInfo(path=material, container="mov", duration=90.0, streams=[
+                StreamInfo(0, "video", "h264", "yuv420p", 320, 180, 25.0),
+                StreamInfo(1, "audio", "aac", sample_rate=44100, channels=1)]))
+            cache.put_blob(material, KEYFRAME_BLOB_KIND,
+                           KeyframeIndex([float(t) for t in range(0, 90, 2)], 90.0, 2250).to_bytes())
+
+            plan, _, reason = plan_for_material(material, 90.0, [(31.5, 36.5)], output_fps=24)
+            assert plan is None and "帧率" in reason
+            plan, _, _ = plan_for_material(material, 90.0, [(31.5, 36.5)], output_fps=25)
+            assert (plan.render_start, plan.render_end) == (30.0, 38.0)
+        finally:
+            cache.close()
+            media_cache._default_cache = previous_cache
+    print("✅ 帧率不同时不做智能渲染")
+
+
+def _frame_count(path):
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-i', path, '-f', 'null', '-'],
+                            capture_output=True, text=True)
+    return int(re.findall(r"frame=\s*(\d+)", result.stderr)[-1])
+
+
+def test_assemble():
+    """测试在关键帧处切开素材、替换中间片段并拼接，总帧数不变"""
+    if shutil.which('ffmpeg') is None:
+        print("⚠️ 未安装FFmpeg，跳过")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        material = os.path.join(tmp, "material.mp4")
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'testsrc=s=160x90:r=25:d=6',
+                        '-f', 'lavfi', '-i', 'sine=f=440:d=6',
+                        '-c:v', 'libx264', '-g', '25', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-shortest', material], check=True)
+        rendered = os.path.join(tmp, "render.mp4")
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-ss', '2', '-t', '2', '-i', material,
+                        '-vf', 'negate', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-ar', '44100', '-ac', '1', '-t', '2', rendered], check=True)
+
+        output = os.path.join(tmp, "output.mp4")
+        ok, message = assemble(material, SmartRenderPlan(2.0, 4.0, 6.0), rendered, output, tmp)
+        assert ok, message
+        assert _frame_count(output) == 150
+    print("✅ 片段拼接正确")
+
+
+if __name__ == "__main__":
+    test_plan()
+    test_check_source()
+    test_output_fps_mismatch()
+    test_assemble()
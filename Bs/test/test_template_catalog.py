@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试批次级模板目录快照（TemplateCatalog）
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MediaInfo, StreamInfo
+import media_cache
+from media_cache import configure_media_cache
+from template_catalog import get_template_catalog, invalidate_template_catalog
+
+
+def _add_template(cache, layer_dir, name, duration):
+    path = os.path.join(layer_dir, name)
+    with open(path, "wb") as f:
+        f.write(name.encode())
+    cache.put(path, MediaInfo(
+        path=path, container="mov,mp4,m4a,3gp,3g2,mj2", duration=duration,
+        streams=[StreamInfo(index=0, codec_type="video", codec_name="prores",
+                            pix_fmt="yuva444p10le", width=1920, height=1080, fps=25.0)]
+    ))
+    return path
+
+
+def test_catalog_reuse_and_invalidation():
+    """测试快照复用、目录变化重建以及手动失效"""
+    previous_cache = media_cache._default_cache
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = configure_media_cache(os.path.join(tmp, "cache.db"))
+        top_dir = os.path.join(tmp, "top_layer")
+        os.makedirs(top_dir)
+        _add_template(cache, top_dir, "a.mov", 5.0)
+        # 无法识别的文件不进入快照
+        with open(os.path.join(top_dir, "broken.mov"), "wb") as f:
+            f.write(b"")
+        cache.put(os.path.join(top_dir, "broken.mov"), MediaInfo(path="broken.mov"))
+
+        template_dirs = {"top_layer": top_dir}
+        invalidate_template_catalog()
+        catalog = get_template_catalog(template_dirs)
+        entries = catalog.entries("top_layer")
+        assert [e.name for e in entries] == ["a.mov"]
+        assert entries[0].has_alpha and entries[0].duration == 5.0
+        assert get_template_catalog(template_dirs) is catalog
+
+        invalidate_template_catalog()
+        rebuilt = get_template_catalog(template_dirs)
+        assert rebuilt is not catalog
+
+        _add_template(cache, top_dir, "b.mov", 3.0)
+        os.utime(top_dir, ns=(0, os.stat(top_dir).st_mtime_ns + 10 ** 9))
+        latest = get_template_catalog(template_dirs)
+        assert sorted(e.name for e in latest.entries("top_layer")) == ["a.mov", "b.mov"]
+        assert latest.choose("top_layer", force_template="b").name == "b.mov"
+        cache.close()
+        invalidate_template_catalog()
+    media_cache._default_cache = previous_cache
+    print("✅ 模板快照复用与失效正确")
+
+
+def test_lazy_transparency():
+    """测试构建快照时不分析alpha，选中模板时才分析且只分析一次"""
+    import template_catalog
+    from template_catalog import TemplateCatalog
+
+    class Profile:
+        def transparent_ranges(self, min_duration=0.0):
+            return [(0.0, 1.0)]
+
+    calls = []
+    previous_cache = media_cache._default_cache
+    previous_profile = template_catalog.get_alpha_profile
+    template_catalog.get_alpha_profile = lambda path, sample_fps: calls.append(path) or Profile()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = configure_media_cache(os.path.join(tmp, "cache.db"))
+            top_dir = os.path.join(tmp, "top_layer")
+            os.makedirs(top_dir)
+            for name in ("a.mov", "b.mov", "c.mov"):
+                _add_template(cache, top_dir, name, 5.0)
+
+            catalog = TemplateCatalog.build({"top_layer": top_dir})
+            assert calls == []
+            entry = catalog.choose("top_layer", force_template="b")
+            assert entry.name == "b.mov" and entry.transparent_ranges == ((0.0, 1.0),)
+            assert catalog.choose("top_layer", force_template="b") is entry
+            assert [os.path.basename(p) for p in calls] == ["b.mov"]
+            # 快照中的原条目不变
+            assert catalog.get(entry.path).transparent_ranges == ()
+            cache.close()
+    finally:
+        template_catalog.get_alpha_profile = previous_profile
+        media_cache._default_cache = previous_cache
+    print("✅ 透明片段按需分析")
+
+
+if __name__ == "__main__":
+    test_catalog_reuse_and_invalidation()
+    test_lazy_transparency()
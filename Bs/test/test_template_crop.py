@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试模板裁剪：alpha可见区域包围盒、裁剪缓存和按偏移叠加
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from layer_graph import LayerPlacement, build_layered_command
+from template_crop import _even_bbox, get_cropped_template, crop_placements
+
+
+def test_even_bbox():
+    """测试包围盒向外扩到偶数坐标"""
+    assert _even_bbox((3, 5, 10, 7), 64, 36) == (2, 4, 12, 8)
+    assert _even_bbox((0, 0, 63, 35), 63, 35) == (0, 0, 63, 35)
+    print("✅ 包围盒对齐正确")
+
+
+def test_overlay_offset():
+    """测试叠加滤镜使用裁剪后的偏移"""
+    placement = LayerPlacement('top_layer', '/t/badge.mov', 0, 0, 2.0, x=40, y=8)
+    _, graph = build_layered_command('/m/a.mp4', [[placement]], ['/o/out.mp4'], [], 2.0)
+    assert 'overlay=40:8:' in graph
+    print("✅ 叠加偏移正确")
+
+
+def test_skip_opaque_template():
+    """测试不带alpha的模板直接跳过裁剪，不做alpha分析"""
+    import media_cache
+    import template_crop
+    from utils import MediaInfo, StreamInfo
+
+    workdir = tempfile.mkdtemp()
+    saved_cache = media_cache._default_cache
+    saved_profile = template_crop.get_alpha_profile
+
+    def fail_profile(*args, **kwargs):
+        raise AssertionError("不透明模板不应做alpha分析")
+
+    try:
+        cache = media_cache.configure_media_cache(os.path.join(workdir, 'cache.db'))
+        template = os.path.join(workdir, 'opaque.mp4')
+        with open(template, 'wb') as f:
+            f.write(b'x')
+        cache.put(template, MediaInfo(path=template, container='mp4', duration=1.0, streams=[
+            StreamInfo(0, 'video', 'h264', 'yuv420p', 64, 36, 25.0)]))
+        template_crop.get_alpha_profile = fail_profile
+
+        assert get_cropped_template(template, os.path.join(workdir, 'cropped')) is None
+        placement = LayerPlacement('top_layer', template, 0, 0, 1.0)
+        assert crop_placements([placement], os.path.join(workdir, 'cropped')) == [placement]
+    finally:
+        template_crop.get_alpha_profile = saved_profile
+        media_cache._default_cache = saved_cache
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 不透明模板跳过裁剪")
+
+
+def _pixel(path, x, y, t=0.5):
+    data = subprocess.run(['ffmpeg', '-v', 'error', '-ss', str(t), '-i', path, '-frames:v', '1',
+                           '-vf', f'crop=2:2:{x}:{y}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                          capture_output=True).stdout
+    return tuple(data[:3])
+
+
+def test_crop_and_overlay():
+    """测试角标模板裁剪后叠加结果与整帧叠加一致"""
+    if not shutil.which('ffmpeg'):
+        print("⚠️ 未安装ffmpeg，跳过")
+        return
+    import media_cache
+    from utils import MediaInfo, StreamInfo
+
+    workdir = tempfile.mkdtemp()
+    saved_cache = media_cache._default_cache
+    try:
+        cache = media_cache.configure_media_cache(os.path.join(workdir, 'cache.db'))
+        material = os.path.join(workdir, 'material.mp4')
+        template = os.path.join(workdir, 'badge.mov')
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=blue:size=64x36:rate=25:duration=1',
+                        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=1',
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', material],
+                       check=True)
+        # 透明画布右上角 12x8 的红色角标
+        subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'color=c=black@0.0:size=64x36:rate=25:duration=1,format=rgba',
+                        '-f', 'lavfi', '-i', 'color=c=red:size=12x8:rate=25:duration=1,format=rgba',
+                        '-f', 'lavfi', '-i', 'sine=frequency=880:duration=1',
+                        '-filter_complex', '[0:v][1:v]overlay=48:4:format=rgb,format=rgba[v]',
+                        '-map', '[v]', '-map', '2:a', '-c:v', 'qtrle', '-c:a', 'aac', '-shortest', template],
+                       check=True)
+        cache.put(template, MediaInfo(path=template, container='mov', duration=1.0, streams=[
+            StreamInfo(0, 'video', 'qtrle', 'argb', 64, 36, 25.0),
+            StreamInfo(1, 'audio', 'aac', sample_rate=44100, channels=1)]))
+
+        scratch = os.path.join(workdir, 'cropped')
+        cropped = get_cropped_template(template, scratch)
+        assert (cropped.x, cropped.y, cropped.width, cropped.height) == (48, 4, 12, 8)
+        # 第二次直接使用缓存的文件
+        assert get_cropped_template(template, scratch).path == cropped.path
+        assert len(os.listdir(scratch)) == 1
+
+        placement = LayerPlacement('top_layer', template, 0, 0, 1.0)
+        [moved] = crop_placements([placement], scratch)
+        args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac']
+        outputs = []
+        for name, p in (('full.mp4', placement), ('crop.mp4', moved)):
+            output = os.path.join(workdir, name)
+            cmd, _ = build_layered_command(material, [[p]], [output], args, 1.0)
+            subprocess.run(cmd[:1] + ['-v', 'error'] + cmd[1:], check=True)
+            outputs.append(output)
+        full, crop = outputs
+        for x, y in ((52, 6), (10, 20)):
+            # 两次都是有损编码，允许少量误差
+            assert max(abs(a - b) for a, b in zip(_pixel(full, x, y), _pixel(crop, x, y))) <= 4
+        assert _pixel(crop, 52, 6)[0] > 200
+    finally:
+        media_cache._default_cache = saved_cache
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("✅ 裁剪后叠加结果一致")
+
+
+if __name__ == "__main__":
+    print("🧪 测试模板裁剪...")
+    test_even_bbox()
+    test_overlay_offset()
+    test_skip_opaque_template()
+    test_crop_and_overlay()
+    print("\n🎉 所有测试通过！")
@@ -2,6 +2,403 @@ import subprocess
 import shutil
 import os
 import re
+import json
+import struct
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, List
+
+from process_supervisor import get_supervisor
+
+# 支持alpha通道的常见像素格式：rgba, argb, yuva420p, yuva444p等
+ALPHA_PIX_FMTS = ['rgba', 'argb', 'yuva420p', 'yuva444p', 'ya8', 'ya16',
+                  'ayuv', 'pal8a', 'gbrap', 'gbrap10le', 'gbrap12le',
+                  'gbrp16a', 'rgba64le', 'rgba64be', 'bgra', 'gbra']
+
+
+@dataclass
+class StreamInfo:
+    """单条媒体流的探测信息"""
+    index: int
+    codec_type: str
+    codec_name: str = 'unknown'
+    pix_fmt: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    nb_frames: Optional[int] = None
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+    @property
+    def has_alpha(self):
+        return pix_fmt_has_alpha(self.pix_fmt)
+
+
+@dataclass
+class MediaInfo:
+    """一次ffprobe得到的完整媒体信息"""
+    path: str
+    container: Optional[str] = None
+    duration: Optional[float] = None
+    streams: List[StreamInfo] = field(default_factory=list)
+
+    @property
+    def video(self):
+        """第一条视频流（v:0），没有则为None"""
+        for stream in self.streams:
+            if stream.codec_type == 'video':
+                return stream
+        return None
+
+    @property
+    def audio(self):
+        """第一条音频流（a:0），没有则为None"""
+        for stream in self.streams:
+            if stream.codec_type == 'audio':
+                return stream
+        return None
+
+    @property
+    def has_audio(self):
+        return self.audio is not None
+
+    @property
+    def has_alpha(self):
+        return self.video is not None and self.video.has_alpha
+
+    @property
+    def codec(self):
+        return self.video.codec_name if self.video else 'unknown'
+
+    @property
+    def pix_fmt(self):
+        return self.video.pix_fmt if self.video else None
+
+    @property
+    def width(self):
+        return self.video.width if self.video else 0
+
+    @property
+    def height(self):
+        return self.video.height if self.video else 0
+
+    @property
+    def fps(self):
+        return self.video.fps if self.video else 0.0
+
+    @property
+    def frame_count(self):
+        """视频帧数，容器未记录时按时长×帧率估算"""
+        video = self.video
+        if video is None:
+            return 0
+        if video.nb_frames:
+            return video.nb_frames
+        duration = video.duration or self.duration or 0
+        return int(round(duration * video.fps))
+
+
+def pix_fmt_has_alpha(pix_fmt):
+    """判断像素格式是否带alpha通道"""
+    if not pix_fmt:
+        return False
+    return any(fmt in pix_fmt for fmt in ALPHA_PIX_FMTS)
+
+
+def _parse_rate(rate):
+    """解析ffprobe的帧率字符串，如 30000/1001"""
+    try:
+        if '/' in rate:
+            num, den = rate.split('/', 1)
+            return float(num) / float(den) if float(den) else 0.0
+        return float(rate)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_media_info(video_path, data):
+    """把ffprobe的JSON输出转换为MediaInfo"""
+    fmt = data.get('format') or {}
+    streams = []
+    for raw in data.get('streams') or []:
+        fps = _parse_rate(raw.get('avg_frame_rate'))
+        if not fps:
+            fps = _parse_rate(raw.get('r_frame_rate'))
+        streams.append(StreamInfo(
+            index=raw.get('index', len(streams)),
+            codec_type=raw.get('codec_type', 'unknown'),
+            codec_name=raw.get('codec_name', 'unknown'),
+            pix_fmt=raw.get('pix_fmt'),
+            width=_parse_int(raw.get('width')) or 0,
+            height=_parse_int(raw.get('height')) or 0,
+            fps=fps if raw.get('codec_type') == 'video' else 0.0,
+            nb_frames=_parse_int(raw.get('nb_frames')),
+            duration=_parse_float(raw.get('duration')),
+            sample_rate=_parse_int(raw.get('sample_rate')),
+            channels=_parse_int(raw.get('channels')),
+        ))
+    return MediaInfo(
+        path=video_path,
+        container=fmt.get('format_name'),
+        duration=_parse_float(fmt.get('duration')),
+        streams=streams,
+    )
+
+
+def probe_media(video_path):
+    """
+    单次ffprobe获取媒体的格式和全部流信息
+
+    Args:
+        video_path: 视频文件路径
+
+    Returns:
+        MediaInfo: 时长、容器、各流编码/像素格式/分辨率/帧率/帧数等
+
+    Raises:
+        subprocess.CalledProcessError: 文件损坏或格式不支持
+        ValueError: ffprobe输出无法解析
+    """
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_format", "-show_streams",
+        "-of", "json",
+        video_path
+    ]
+    with probe_slots():
+        result = get_supervisor().run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore',
+                                      check=True)
+    return _parse_media_info(video_path, json.loads(result.stdout or '{}'))
+
+
+# ========== ffprobe 并发上限 ========== #
+
+# 进程内所有ffprobe（同步探测、关键帧扫描、异步探测服务）共用同一组名额
+_probe_slots = threading.BoundedSemaphore(4)
+_probe_slot_limit = 4
+_probe_slots_lock = threading.Lock()
+
+
+def configure_probe_slots(max_concurrent):
+    """设置同时运行的ffprobe上限；已占用的名额仍归还给原来的信号量"""
+    global _probe_slots, _probe_slot_limit
+    with _probe_slots_lock:
+        _probe_slots = threading.BoundedSemaphore(max_concurrent)
+        _probe_slot_limit = max_concurrent
+    return _probe_slots
+
+
+def probe_slots():
+    """获取进程内共用的ffprobe名额（threading.BoundedSemaphore）"""
+    return _probe_slots
+
+
+def probe_slot_limit():
+    """当前的ffprobe并发上限"""
+    return _probe_slot_limit
+
+
+# ========== MP4/MOV 文件头解析 ========== #
+
+MP4_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.m4a', '.3gp')
+
+_FOURCC_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc',
+    'mp4v': 'mpeg4', 'av01': 'av1', 'vp09': 'vp9',
+    'ap4h': 'prores', 'ap4x': 'prores', 'apch': 'prores', 'apcn': 'prores',
+    'apcs': 'prores', 'apco': 'prores', 'rle ': 'qtrle', 'png ': 'png',
+    'mp4a': 'aac', 'ac-3': 'ac3', 'ec-3': 'eac3', 'lpcm': 'pcm', 'sowt': 'pcm_s16le',
+}
+
+
+def _iter_mp4_boxes(f, start, end):
+    """遍历[start, end)范围内的box，只读取8/16字节的头部，box内容靠seek跳过"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack('>Q', large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            return
+        yield box_type, pos + header_size, pos + size
+        pos += size
+
+
+def _mp4_children(f, start, end):
+    """返回子box字典 {类型: (内容起点, 结束位置)}，同类型只保留第一个"""
+    children = {}
+    for box_type, body_start, body_end in _iter_mp4_boxes(f, start, end):
+        children.setdefault(box_type, (body_start, body_end))
+    return children
+
+
+def _read_box(f, box, limit=None):
+    body_start, body_end = box
+    f.seek(body_start)
+    length = body_end - body_start
+    return f.read(length if limit is None else min(length, limit))
+
+
+def _parse_time_header(data):
+    """解析mvhd/mdhd的(timescale, duration)，兼容version 0/1"""
+    if data[0] == 1:
+        timescale, duration = struct.unpack('>IQ', data[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', data[12:20])
+    return timescale, duration
+
+
+def _parse_mp4_track(f, trak, index):
+    """解析单个trak，返回StreamInfo，无法识别时返回None"""
+    boxes = _mp4_children(f, *trak)
+    if b'mdia' not in boxes:
+        return None
+    mdia = _mp4_children(f, *boxes[b'mdia'])
+    if b'mdhd' not in mdia or b'hdlr' not in mdia or b'minf' not in mdia:
+        return None
+
+    timescale, duration = _parse_time_header(_read_box(f, mdia[b'mdhd'], 32))
+    handler = _read_box(f, mdia[b'hdlr'], 12)[8:12]
+    codec_type = {b'vide': 'video', b'soun': 'audio'}.get(handler, 'data')
+
+    stbl = _mp4_children(f, *_mp4_children(f, *mdia[b'minf']).get(b'stbl', (0, 0)))
+    codec_name = 'unknown'
+    width = height = 0
+    sample_rate = channels = None
+    if b'stsd' in stbl:
+        stsd = _read_box(f, stbl[b'stsd'], 44)
+        if len(stsd) >= 16:
+            fourcc = stsd[12:16].decode('latin-1')
+            codec_name = _FOURCC_CODECS.get(fourcc, fourcc.strip())
+            if codec_type == 'video' and len(stsd) >= 44:
+                width, height = struct.unpack('>HH', stsd[40:44])
+            elif codec_type == 'audio' and len(stsd) >= 44:
+                # 音频样本描述：声道数在32，采样率为16.16定点数在40
+                channels = struct.unpack('>H', stsd[32:34])[0] or None
+                sample_rate = (struct.unpack('>I', stsd[40:44])[0] >> 16) or None
+    if codec_type == 'video' and not (width and height) and b'tkhd' in boxes:
+        tkhd = _read_box(f, boxes[b'tkhd'], 96)
+        offset = 88 if tkhd[0] == 1 else 76
+        if len(tkhd) >= offset + 8:
+            w, h = struct.unpack('>II', tkhd[offset:offset + 8])
+            width, height = w >> 16, h >> 16
+
+    sample_count = None
+    sample_box = stbl.get(b'stsz') or stbl.get(b'stz2')
+    if sample_box:
+        data = _read_box(f, sample_box, 12)
+        if len(data) >= 12:
+            sample_count = struct.unpack('>I', data[8:12])[0]
+
+    track_duration = duration / timescale if timescale else None
+    fps = 0.0
+    if codec_type == 'video' and sample_count and track_duration:
+        fps = sample_count / track_duration
+
+    return StreamInfo(
+        index=index,
+        codec_type=codec_type,
+        codec_name=codec_name,
+        width=width,
+        height=height,
+        fps=fps,
+        nb_frames=sample_count if codec_type == 'video' else None,
+        duration=track_duration,
+        sample_rate=sample_rate,
+        channels=channels,
+    )
+
+
+def read_mp4_header(video_path):
+    """
+    纯Python解析MP4/MOV文件头（moov/mvhd/tkhd/mdhd/stsd/stsz），不启动ffprobe
+    
+    只按box头部seek跳转，不读取mdat内容，moov位于文件末尾时同样适用。
+    结果不含像素格式，alpha判断仍需 probe_media。
+    
+    Args:
+        video_path: 视频文件路径
+        
+    Returns:
+        MediaInfo: 时长、各流编码/分辨率/帧率/帧数；非MP4/MOV、分片MP4或解析失败时返回None
+    """
+    if not video_path.lower().endswith(MP4_EXTENSIONS):
+        return None
+    try:
+        file_size = os.path.getsize(video_path)
+        with open(video_path, 'rb') as f:
+            moov = None
+            for box_type, body_start, body_end in _iter_mp4_boxes(f, 0, file_size):
+                if box_type == b'moov':
+                    moov = (body_start, body_end)
+                    break
+            if moov is None:
+                return None
+
+            boxes = list(_iter_mp4_boxes(f, *moov))
+            children = {box_type: (s, e) for box_type, s, e in reversed(boxes)}
+            # 分片MP4的时长在moof中，交给ffprobe
+            if b'mvhd' not in children or b'mvex' in children:
+                return None
+            timescale, duration = _parse_time_header(_read_box(f, children[b'mvhd'], 32))
+            if not timescale or not duration:
+                return None
+
+            streams = []
+            for box_type, s, e in boxes:
+                if box_type == b'trak':
+                    stream = _parse_mp4_track(f, (s, e), len(streams))
+                    if stream is not None:
+                        streams.append(stream)
+    except (OSError, struct.error, IndexError):
+        return None
+
+    return MediaInfo(
+        path=video_path,
+        container='mov,mp4,m4a,3gp,3g2,mj2',
+        duration=duration / timescale,
+        streams=streams,
+    )
+
+
+def probe_media_cached(video_path):
+    """
+    带元数据缓存的probe_media，文件未变化时不再启动ffprobe
+
+    Raises:
+        与 probe_media 相同
+    """
+    # 延迟导入，media_cache 依赖本模块的 MediaInfo
+    from media_cache import get_media_cache
+    return get_media_cache().probe(video_path)
+
 
 def check_ffmpeg_installed():
     """
@@ -12,21 +409,12 @@ def check_ffmpeg_installed():
 def validate_video_file(video_path):
     """验证视频文件完整性和可读性"""
     try:
-        # 使用ffprobe检查文件基本信息
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration,format_name', 
-             '-of', 'default=noprint_wrappers=1', video_path],
-            capture_output=True, text=True, check=True
-        )
-        output_lines = result.stdout.strip().split('\n')
+        info = probe_media_cached(video_path)
         
         # 检查是否有有效的格式信息
-        has_format = any('format_name=' in line for line in output_lines)
-        has_duration = any('duration=' in line for line in output_lines)
-        
-        if not has_format:
+        if not info.container:
             return False, "文件格式无法识别"
-        if not has_duration:
+        if info.duration is None:
             return False, "无法获取文件时长信息"
             
         return True, "文件验证通过"
@@ -40,6 +428,12 @@ def get_video_duration(video_path):
     获取视频时长（秒），float 类型
     如果 FFmpeg 未安装，返回默认时长
     """
+    # MP4/MOV 直接读文件头，不启动ffprobe
+    if os.path.exists(video_path):
+        header = read_mp4_header(video_path)
+        if header is not None:
+            return header.duration
+    
     # 检查 FFmpeg 是否安装
     if not check_ffmpeg_installed():
         print("⚠️ FFmpeg 未安装，无法获取视频时长")
@@ -53,31 +447,23 @@ def get_video_duration(video_path):
         print(f"❌ 视频文件不存在: {video_path}")
         return None
     
-    # 先验证文件完整性
-    is_valid, message = validate_video_file(video_path)
-    if not is_valid:
-        print(f"❌ 文件验证失败 {video_path}: {message}")
-        return 30.0  # 返回默认时长
-    
-    command = [
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        video_path
-    ]
+    # 验证和取时长共用一次探测
     try:
-        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True)
-        duration = float(result.stdout.strip())
-        return duration
+        info = probe_media_cached(video_path)
     except subprocess.CalledProcessError as e:
-        print(f"❌ FFmpeg 执行失败: {e}")
-        return 30.0  # 返回默认时长
-    except ValueError as e:
-        print(f"❌ 无法解析视频时长: {e}")
+        print(f"❌ 文件验证失败 {video_path}: 文件损坏或格式不支持: {e}")
         return 30.0  # 返回默认时长
     except Exception as e:
         print(f"❌ 获取视频时长失败: {e}")
         return 30.0  # 返回默认时长
+    
+    if not info.container:
+        print(f"❌ 文件验证失败 {video_path}: 文件格式无法识别")
+        return 30.0
+    if info.duration is None:
+        print(f"❌ 文件验证失败 {video_path}: 无法获取文件时长信息")
+        return 30.0
+    return info.duration
 
 
 def check_video_has_alpha(video_path, silent=False):
@@ -106,26 +492,10 @@ def check_video_has_alpha(video_path, silent=False):
             print(f"❌ 视频文件不存在: {video_path}")
         return False
     
-    # 使用ffprobe检查视频的像素格式
-    command = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=pix_fmt",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        video_path
-    ]
-    
     try:
-        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True)
-        pix_fmt = result.stdout.strip()
-        
-        # 检查像素格式是否支持alpha通道
-        # 常见的支持alpha通道的格式包括：rgba, argb, yuva420p, yuva444p等
-        alpha_formats = ['rgba', 'argb', 'yuva420p', 'yuva444p', 'ya8', 'ya16', 
-                        'ayuv', 'pal8a', 'gbrap', 'gbrap10le', 'gbrap12le', 
-                        'gbrp16a', 'rgba64le', 'rgba64be', 'bgra', 'gbra']
-        
-        has_alpha = any(fmt in pix_fmt for fmt in alpha_formats)
+        info = probe_media_cached(video_path)
+        pix_fmt = info.pix_fmt or ''
+        has_alpha = info.has_alpha
         
         if not silent:
             if has_alpha:
@@ -145,36 +515,73 @@ def check_video_has_alpha(video_path, silent=False):
         return False
 
 
-def check_directory_for_alpha_videos(directory_path, recursive=False, video_extensions=None):
+def _list_video_files(directory_path, recursive, video_extensions):
+    """列出目录中指定扩展名的视频文件"""
+    extensions = tuple(ext.lower() for ext in video_extensions)
+    video_files = []
+    if recursive:
+        # 递归遍历目录
+        for root, _, files in os.walk(directory_path):
+            for file in files:
+                if file.lower().endswith(extensions):
+                    video_files.append(os.path.join(root, file))
+    else:
+        # 只检查当前目录
+        with os.scandir(directory_path) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(extensions):
+                    video_files.append(entry.path)
+    return video_files
+
+
+def _alpha_scan_one(video_path, analyze_coverage=False, sample_fps=2.0):
+    """探测单个文件，返回扫描结果字典"""
+    try:
+        info = probe_media_cached(video_path)
+    except Exception as e:
+        return {'path': video_path, 'has_alpha': None, 'pix_fmt': "未知", 'error': str(e), 'alpha_stats': None}
+    item = {'path': video_path, 'has_alpha': info.has_alpha, 'pix_fmt': info.pix_fmt or "未知", 'error': None,
+            'alpha_stats': None}
+    if analyze_coverage and info.has_alpha:
+        # 解码alpha平面统计真实覆盖率，结果缓存
+        from alpha_analyzer import get_alpha_profile
+        try:
+            item['alpha_stats'] = get_alpha_profile(video_path, sample_fps=sample_fps).summary()
+        except Exception as e:
+            print(f"⚠️ alpha覆盖率分析失败 {os.path.basename(video_path)}: {e}")
+    return item
+
+
+def scan_directory_for_alpha_videos(directory_path, recursive=False, video_extensions=None, max_workers=None,
+                                    analyze_coverage=False, sample_fps=2.0):
     """
-    检查目录中的视频文件是否包含alpha通道，并生成报告
+    并发扫描目录中的视频alpha通道，结果按完成顺序逐个产出
+    
+    每个文件只探测一次（走元数据缓存），同时在途的探测数不超过max_workers。
     
     Args:
         directory_path: 目录路径
         recursive: 是否递归检查子目录
         video_extensions: 视频文件扩展名列表，默认为['.mp4', '.mov', '.avi']
+        max_workers: 并发探测数，默认为CPU核数（最多16）
+        analyze_coverage: 是否解码alpha平面统计覆盖率和包围盒
+        sample_fps: 覆盖率分析的采样帧率
+    
+    Yields:
+        dict: {'path', 'has_alpha', 'pix_fmt', 'error', 'alpha_stats', 'index', 'total'}，
+              has_alpha 为 None 表示检查失败，alpha_stats 见 AlphaProfile.summary
     
     Returns:
-        dict: 包含检查结果的字典，格式为：
-            {
-                'total': 检查的视频总数,
-                'with_alpha': 包含alpha通道的视频数量,
-                'without_alpha': 不包含alpha通道的视频数量,
-                'failed': 检查失败的视频数量,
-                'alpha_videos': [包含alpha通道的视频路径列表],
-                'non_alpha_videos': [不包含alpha通道的视频路径列表],
-                'failed_videos': [检查失败的视频路径列表]
-            }
+        dict: 生成器结束时返回与 check_directory_for_alpha_videos 相同的汇总字典
     """
+    from functools import partial
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    
     if video_extensions is None:
         video_extensions = ['.mp4', '.mov', '.avi']
+    if max_workers is None:
+        max_workers = min(16, os.cpu_count() or 4)
     
-    # 检查目录是否存在
-    if not os.path.exists(directory_path) or not os.path.isdir(directory_path):
-        print(f"❌ 目录不存在: {directory_path}")
-        return None
-    
-    # 初始化结果
     results = {
         'total': 0,
         'with_alpha': 0,
@@ -182,63 +589,110 @@ def check_directory_for_alpha_videos(directory_path, recursive=False, video_exte
         'failed': 0,
         'alpha_videos': [],
         'non_alpha_videos': [],
-        'failed_videos': []
+        'failed_videos': [],
+        'alpha_stats': {}
     }
     
-    # 获取视频文件列表
-    video_files = []
-    
-    if recursive:
-        # 递归遍历目录
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in video_extensions):
-                    video_files.append(os.path.join(root, file))
-    else:
-        # 只检查当前目录
-        for file in os.listdir(directory_path):
-            if any(file.lower().endswith(ext) for ext in video_extensions):
-                video_files.append(os.path.join(directory_path, file))
-    
-    # 检查每个视频文件
+    scan_one = partial(_alpha_scan_one, analyze_coverage=analyze_coverage, sample_fps=sample_fps)
+    video_files = _list_video_files(directory_path, recursive, video_extensions)
     total_files = len(video_files)
-    print(f"找到 {total_files} 个视频文件，开始检查...")
+    pending_files = iter(video_files)
     
-    for i, video_path in enumerate(video_files, 1):
-        print(f"[{i}/{total_files}] 检查: {os.path.basename(video_path)}")
-        
-        # 检查视频是否包含alpha通道（静默模式）
-        has_alpha = check_video_has_alpha(video_path, silent=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        # 有界提交：最多保持 2×max_workers 个任务在途，消费方停止迭代时不会继续排队
+        for video_path in pending_files:
+            in_flight.add(executor.submit(scan_one, video_path))
+            if len(in_flight) >= max_workers * 2:
+                break
         
-        # 获取视频的像素格式
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = future.result()
+                results['total'] += 1
+                if item['has_alpha'] is None:  # 检查失败
+                    results['failed'] += 1
+                    results['failed_videos'].append(item['path'])
+                elif item['has_alpha']:  # 包含alpha通道
+                    results['with_alpha'] += 1
+                    results['alpha_videos'].append(item['path'])
+                    if item['alpha_stats'] is not None:
+                        results['alpha_stats'][item['path']] = item['alpha_stats']
+                else:  # 不包含alpha通道
+                    results['without_alpha'] += 1
+                    results['non_alpha_videos'].append(item['path'])
+                item['index'] = results['total']
+                item['total'] = total_files
+                
+                next_path = next(pending_files, None)
+                if next_path is not None:
+                    in_flight.add(executor.submit(scan_one, next_path))
+                yield item
+    
+    return results
+
+
+def check_directory_for_alpha_videos(directory_path, recursive=False, video_extensions=None, max_workers=None,
+                                     analyze_coverage=True, sample_fps=2.0):
+    """
+    检查目录中的视频文件是否包含alpha通道，并生成报告
+    
+    Args:
+        directory_path: 目录路径
+        recursive: 是否递归检查子目录
+        video_extensions: 视频文件扩展名列表，默认为['.mp4', '.mov', '.avi']
+        max_workers: 并发探测数，默认为CPU核数（最多16）
+        analyze_coverage: 是否解码alpha平面，报告真实透明覆盖率
+        sample_fps: 覆盖率分析的采样帧率
+    
+    Returns:
+        dict: 包含检查结果的字典，格式为：
+            {
+                'total': 检查的视频总数,
+                'with_alpha': 包含alpha通道的视频数量,
+                'without_alpha': 不包含alpha通道的视频数量,
+                'failed': 检查失败的视频数量,
+                'alpha_videos': [包含alpha通道的视频路径列表],
+                'non_alpha_videos': [不包含alpha通道的视频路径列表],
+                'failed_videos': [检查失败的视频路径列表],
+                'alpha_stats': {视频路径: 覆盖率统计字典}
+            }
+    """
+    # 检查目录是否存在
+    if not os.path.exists(directory_path) or not os.path.isdir(directory_path):
+        print(f"❌ 目录不存在: {directory_path}")
+        return None
+    
+    scanner = scan_directory_for_alpha_videos(directory_path, recursive, video_extensions, max_workers,
+                                              analyze_coverage=analyze_coverage, sample_fps=sample_fps)
+    started = False
+    while True:
         try:
-            command = [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=pix_fmt",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                video_path
-            ]
-            result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True)
-            pix_fmt = result.stdout.strip()
-        except:
-            pix_fmt = "未知"
-        
-        # 更新结果
-        results['total'] += 1
+            item = next(scanner)
+        except StopIteration as stop:
+            results = stop.value
+            break
+        if not started:
+            print(f"找到 {item['total']} 个视频文件，开始检查...")
+            started = True
         
-        if has_alpha is None:  # 检查失败
-            results['failed'] += 1
-            results['failed_videos'].append(video_path)
+        # 结果按完成顺序到达，随到随打
+        print(f"[{item['index']}/{item['total']}] 检查: {os.path.basename(item['path'])}")
+        if item['has_alpha'] is None:
             print(f"  ❌ 检查失败")
-        elif has_alpha:  # 包含alpha通道
-            results['with_alpha'] += 1
-            results['alpha_videos'].append(video_path)
-            print(f"  ✅ 包含alpha通道，像素格式: {pix_fmt}")
-        else:  # 不包含alpha通道
-            results['without_alpha'] += 1
-            results['non_alpha_videos'].append(video_path)
-            print(f"  ℹ️ 不包含alpha通道，像素格式: {pix_fmt}")
+        elif item['has_alpha']:
+            print(f"  ✅ 包含alpha通道，像素格式: {item['pix_fmt']}")
+            stats = item['alpha_stats']
+            if stats:
+                print(f"     可见覆盖率 平均{stats['mean_coverage']:.1%} 峰值{stats['peak_coverage']:.1%}，"
+                      f"全透明帧{stats['transparent_ratio']:.1%}，全不透明帧{stats['opaque_ratio']:.1%}，"
+                      f"可见区域 {stats['union_bbox']}")
+        else:
+            print(f"  ℹ️ 不包含alpha通道，像素格式: {item['pix_fmt']}")
+    
+    if not started:
+        print(f"找到 0 个视频文件，开始检查...")
     
     # 打印汇总报告
     print("\n===== Alpha通道检查报告 =====")
@@ -252,6 +706,21 @@ def check_directory_for_alpha_videos(directory_path, recursive=False, video_exte
         for video in results['alpha_videos']:
             print(f"  - {video}")
     
+    # 叠加代价与实际可见像素不匹配的模板
+    wasteful = [(video, stats) for video, stats in results['alpha_stats'].items()
+                if stats['opaque_ratio'] >= 0.99 or stats['transparent_ratio'] >= 0.5
+                or stats['peak_coverage'] < 0.25]
+    if wasteful:
+        print("\n需要关注的模板（alpha通道利用率低）:")
+        for video, stats in wasteful:
+            if stats['opaque_ratio'] >= 0.99:
+                reason = "始终完全不透明，alpha通道无意义"
+            elif stats['transparent_ratio'] >= 0.5:
+                reason = f"{stats['transparent_ratio']:.0%}的时间完全透明"
+            else:
+                reason = f"可见区域最多只占画面{stats['peak_coverage']:.0%}"
+            print(f"  - {video}: {reason}")
+    
     return results
 
 
@@ -294,34 +763,22 @@ def compress_alpha_template(input_path, output_path=None, target_size_mb=50, sil
         # 获取文件大小
         original_size_mb = os.path.getsize(input_path) / (1024 * 1024)
         
-        # 获取视频信息
-        probe_cmd = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height,duration,pix_fmt,codec_name",
-            "-of", "default=noprint_wrappers=1",
-            input_path
-        ]
-        
-        result = subprocess.run(probe_cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True)
-        video_info = {}
-        for line in result.stdout.strip().split('\n'):
-            if '=' in line:
-                key, value = line.split('=', 1)
-                video_info[key] = value
+        # 获取视频信息（一次探测，alpha判断复用同一结果）
+        info = probe_media_cached(input_path)
+        video = info.video
         
-        width = int(video_info.get('width', 1920))
-        height = int(video_info.get('height', 1080))
-        duration = float(video_info.get('duration', 10))
-        pix_fmt = video_info.get('pix_fmt', 'unknown')
-        codec = video_info.get('codec_name', 'unknown')
+        width = video.width if video and video.width else 1920
+        height = video.height if video and video.height else 1080
+        duration = (video.duration if video else None) or info.duration or 10
+        pix_fmt = info.pix_fmt or 'unknown'
+        codec = info.codec
         
         if not silent:
             print(f"📹 原文件信息: {original_size_mb:.1f}MB, {width}x{height}, {duration:.1f}s")
             print(f"📹 像素格式: {pix_fmt}, 编码器: {codec}")
         
         # 检查是否包含alpha通道
-        has_alpha = check_video_has_alpha(input_path, silent=True)
+        has_alpha = info.has_alpha
         
         if not has_alpha:
             message = "输入视频不包含alpha通道，无需特殊处理"
@@ -375,7 +832,7 @@ def compress_alpha_template(input_path, output_path=None, target_size_mb=50, sil
             print(f"📝 执行命令: {' '.join(cmd[:8])}...")
         
         # 执行压缩
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        result = get_supervisor().run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
         
         if result.returncode != 0:
             message = f"压缩失败: {result.stderr}"
@@ -531,6 +988,11 @@ def batch_compress_alpha_templates(templates_dir, target_size_mb=50, backup=True
                 if os.path.exists(temp_output):
                     os.remove(temp_output)
     
+    # 模板文件已被替换，让模板目录快照失效
+    if results['compressed'] > 0:
+        from template_catalog import invalidate_template_catalog
+        invalidate_template_catalog()
+    
     # 打印汇总报告
     print(f"\n===== Alpha模板压缩报告 =====")
     print(f"总文件数: {results['total']}")